@@ -1,33 +1,61 @@
 import argparse
+import os
+import queue
 import socket
+import sys
 import threading
 import time
 from tkinter import *
 
-FORMAT = "iso-8859-1"
+from coalescer import Coalescer, unpack_batch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT, Framer, create_socket
+import udp_profile
 
 # Dark Background Themes
 BG_COLOUR = ["#282828", "#383838"]
 FG_COLOUR = "#FFFFFF"
 FONT_STYLE = "Lucida Console"
 
+# Chat Box refresh interval in ms and most messages inserted per refresh
+FRAME_INTERVAL = 16
+FRAME_BATCH = 500
+
 
 class UDPChatClient:
-    def __init__(self, packet_size, address_info, username, server_socket):
+    def __init__(self, packet_size, address_info, username, server_socket, heartbeat=5, coalesce_window=0,
+                 scrollback=1000):
         """
         UDP based Chat Client
         :param packet_size: Amount of Information sent per message in Bytes
         :param address_info: Address Info got from the `socket.getAddrInfo` for Server
         :param username: Username of the Client
         :param server_socket: (IP, Port) of the server
+        :param heartbeat: Interval in sec between Keep Alives sent to the Server
+        :param coalesce_window: Time in sec a burst of messages may be held back to share a datagram, 0 to disable
+        :param scrollback: Most messages kept in the Chat Box, the oldest are dropped first
         """
         # Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
-        # SOCK_DGRAM - Socket Type - UDP
-        self.client = socket.socket(address_info[0], socket.SOCK_DGRAM)
+        self.client = create_socket(address_info[0])
         self.server_socket = server_socket
         self.packet_size = packet_size
+        # Sends happen on both the reactor and the Tk Main Loop, every message is padded into Bytes of its own
+        self.framer = Framer(packet_size)
         self.username = username
         self.dest_username = ''
+        self.heartbeat = heartbeat
+        self.coalescer = None
+        if coalesce_window > 0:
+            self.coalescer = Coalescer(self.client.sendto, packet_size, coalesce_window)
+        self.scrollback = scrollback
+
+        # Network Reactor -> Tk Main Loop - Chat Box lines, None once the recipient is gone
+        self.inbox = queue.SimpleQueue()
+        # Network Reactor -> Handshake - Responses to the requests made before entering the chat room
+        self.responses = queue.SimpleQueue()
+        self.in_chat = False
+        self.running = True
 
         # Main Chat Window
         self.window = Tk()
@@ -40,21 +68,21 @@ class UDPChatClient:
         """
         # Sign in
         self.sign_in()
+        # From here on all the datagrams are received by the reactor
+        reactor = threading.Thread(target=self.reactor, daemon=True)
+        reactor.start()
         print()
 
         # Change Packet Size
         if self.packet_size != 1024:
             print(f"[PACKET SIZE] Requesting Server {self.server_socket} for changing size to {self.packet_size}")
-            message = self.pad(f"Size {self.packet_size}")
-            self.client.sendto(message.encode(FORMAT), self.server_socket)
+            self.client.sendto(self.framer.pad(f"Size {self.packet_size}"), self.server_socket)
             # Receive message from server
-            response, self.server_socket = self.client.recvfrom(self.packet_size)
-            print(f"[PACKET SIZE] '{response.decode(FORMAT).strip()}' from {self.server_socket}")
+            response = self.recv_response()
+            print(f"[PACKET SIZE] '{response}' from {self.server_socket}")
 
         # Chat
         self._get_recipient()
-        receiver = threading.Thread(target=self.receive)
-        receiver.start()
         self.gui_run()
         self.disconnect()
 
@@ -65,13 +93,17 @@ class UDPChatClient:
         If username already taken, repeats the process
         """
         while True:
-            message = self.pad(f"User {self.username}")
-            self.client.sendto(message.encode(FORMAT), self.server_socket)
+            self.client.sendto(self.framer.pad(f"User {self.username}"), self.server_socket)
             response, self.server_socket = self.client.recvfrom(self.packet_size)
             response = response.decode(FORMAT).strip()
             if response.lower()[:5] == "taken":
                 print(f"[USERNAME ERROR] Username '{self.username}' already taken, please provide another one")
                 self.username = input("Enter New Username : ")
+            # Clustered Server - sign in again with the shard owning the username
+            elif response.lower()[:5] == "moved":
+                _, ip, port = response.split()
+                self.server_socket = (ip, int(port))
+                print(f"[SIGN IN] Redirected to Server {self.server_socket}")
             else:
                 print(f"[SIGN IN] Successfully Signed in to Server {self.server_socket}")
                 break
@@ -84,10 +116,8 @@ class UDPChatClient:
         """
         while True:
             dest_username = input("Enter the Username of the Recipient : ")
-            message = self.pad(f"Chat {dest_username}")
-            self.client.sendto(message.encode(FORMAT), self.server_socket)
-            response, self.server_socket = self.client.recvfrom(self.packet_size)
-            response = response.decode(FORMAT).strip()
+            self.client.sendto(self.framer.pad(f"Chat {dest_username}"), self.server_socket)
+            response = self.recv_response()
             if response.lower()[:2] == "no":
                 print(f"[USERNAME ERROR] Username '{dest_username}' not found, please provide another one")
             else:
@@ -95,10 +125,83 @@ class UDPChatClient:
                 self.dest_username = dest_username
                 break
 
+    def reactor(self):
+        """
+        Background Network Loop - the only thread receiving from the Server
+
+        Keeps the session alive, parses the messages and hands them over to the Tk Main Loop through the inbox
+        """
+        alive = self.framer.pad("Alive")
+        next_alive = time.monotonic() + self.heartbeat
+        while self.running:
+            # A timeout of 0 would make the socket non-blocking, raising BlockingIOError instead of timing out
+            self.client.settimeout(max(0.001, next_alive - time.monotonic()))
+            try:
+                response, _ = self.client.recvfrom(self.packet_size)
+            except socket.timeout:
+                response = None
+            # Keep the session alive on the Server, which signs out Clients it has not heard from in a while
+            if time.monotonic() >= next_alive:
+                self.client.sendto(alive, self.server_socket)
+                next_alive = time.monotonic() + self.heartbeat
+            if response is not None:
+                self.dispatch(response.decode(FORMAT).strip())
+
+    def dispatch(self, response):
+        """
+        Routes a Server message to the handshake or to the Chat Box
+        :param response: Stripped Response
+        """
+        if response.lower()[:5] == "batch":
+            for message in self.unpack(response):
+                self.inbox.put(message)
+
+        elif not self.in_chat:
+            # The recipient's Chat handshake opens the chat room, the messages after it go to the Chat Box
+            if response.lower()[:4] == "chat":
+                self.in_chat = True
+            self.responses.put(response)
+
+        elif response.lower() == f"no {self.dest_username} found":
+            self.inbox.put(None)
+
+        elif response.lower() == "disconnected":
+            self.running = False
+
+        elif response.lower()[:6] == "queued":
+            self.inbox.put(f"{self.dest_username} is offline, message queued")
+
+        elif response.lower()[:8] == "too long":
+            self.inbox.put(f"Message too long for {self.dest_username}, not delivered")
+
+        else:
+            response = response.split()
+            self.inbox.put(f"{response[1]} : {' '.join(response[2:])}")
+
+    def recv_response(self):
+        """
+        Waits for the Server response to a request made before entering the chat room
+        :return: string - Stripped Response
+        """
+        return self.responses.get()
+
+    @staticmethod
+    def unpack(response):
+        """
+        Unpacks a Batch datagram into Chat Box lines
+        :param response: Stripped `Batch` Response
+        :return: list of strings - `Username : Message`
+        """
+        messages = []
+        for line in unpack_batch(response):
+            line = line.split()
+            messages.append(f"{line[1]} : {' '.join(line[2:])}")
+        return messages
+
     def disconnect(self):
         # Disconnect Message
         print(f"[SIGN OUT] Disconnecting from Server {self.server_socket}")
-        self.client.sendto(self.pad("Disconnect").encode(FORMAT), self.server_socket)
+        self.client.sendto(self.framer.pad("Disconnect"), self.server_socket)
         exit(0)
 
     def send(self):
@@ -107,52 +210,48 @@ class UDPChatClient:
 
         Sends the message to Server
 
-        Inserts the message onto the Tkinter Chat Box
+        Inserts the message onto the Tkinter Chat Box along with the received ones on the next frame
         """
         message = self.message_box.get()
         if message.lower() == "disconnect":
             self.disconnect()
 
-        # Insert the Message on Chat Box
-        self.chat_box.insert(END, f"You : {message}")
         # Send Message To Server
-        message = self.pad(f"Chat {self.dest_username} " + message)
-        self.client.sendto(message.encode(FORMAT), self.server_socket)
-
-    def sender_thread(self):
-        sender = threading.Thread(target=self.send)
-        sender.start()
-
-    def receive(self):
+        if self.coalescer is not None:
+            if not self.coalescer.add(f"Chat {self.dest_username} " + message, self.server_socket):
+                self.inbox.put("Message too long for the Packet Size, not sent")
+                return
+            self.inbox.put(f"You : {message}")
+            timeout = self.coalescer.next_timeout()
+            if timeout is not None:
+                self.window.after(int(timeout * 1000) + 1, self.coalescer.poll)
+            return
+        self.inbox.put(f"You : {message}")
+        self.client.sendto(self.framer.pad(f"Chat {self.dest_username} " + message), self.server_socket)
+
+    def drain_inbox(self):
         """
-        Receives messages from Server, processes and inserts on Tkinter Chat Box
+        Runs on the Tk Main Loop every frame, inserts all the messages received since the last frame at once
         """
-        while True:
-            response, self.server_socket = self.client.recvfrom(self.packet_size)
-            response = response.decode(FORMAT).strip()
-            if response.lower() == f"no {self.dest_username} found":
-                message = f"{self.dest_username} disconnected from Server"
-                self.disconnect()
-                break
-            elif response.lower() == "disconnected":
-                break
-            else:
-                response = response.split()
-                message = f"{response[1]} : {' '.join(response[2:])}"
-            # Insert the message on Chat Box
-            time.sleep(0.1)
-            self.chat_box.insert(END, message)
-
-    def pad(self, message):
-        """
-        Pads the given message upto Packet Size Amount
-        :param message:
-        :return: string - Padded String
-        """
-        message = message.encode(FORMAT)
-        if len(message) < self.packet_size:
-            message += b' ' * (self.packet_size - len(message))
-        return message.decode(FORMAT)
+        messages = []
+        try:
+            while len(messages) < FRAME_BATCH:
+                message = self.inbox.get_nowait()
+                if message is None:
+                    print(f"[CHAT ROOM] {self.dest_username} disconnected from Server")
+                    self.disconnect()
+                messages.append(message)
+        except queue.Empty:
+            pass
+
+        if messages:
+            self.chat_box.insert(END, *messages)
+            # Bounded Scroll Back
+            overflow = self.chat_box.size() - self.scrollback
+            if overflow > 0:
+                self.chat_box.delete(0, overflow - 1)
+            self.chat_box.see(END)
+        self.window.after(FRAME_INTERVAL, self.drain_inbox)
 
     def gui_run(self):
         """
@@ -184,7 +283,7 @@ class UDPChatClient:
         self.button_image = PhotoImage(file="Send_Button.png")
         # button_image = button_image.subsample(2)
         send_button = Button(self.window, image=self.button_image,
-                             command=self.sender_thread, borderwidth=0)
+                             command=self.send, borderwidth=0)
         send_button.configure(background=BG_COLOUR[0], highlightbackground=BG_COLOUR[1], highlightthickness=0)
         # Place the Send Button in the Chat Window
         send_button.place(x=250, y=430)
@@ -200,6 +299,9 @@ class UDPChatClient:
 
         scroll_bar.config(command=self.chat_box.yview)
 
+        # Messages received so far, including the ones queued while offline, then every frame
+        self.drain_inbox()
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='UDP Chat Client - Built over UDP Echo Client',
@@ -214,6 +316,13 @@ if __name__ == '__main__':
                         metavar="PACKET_SIZE")
     parser.add_argument('-u', '--username', help='Username Client Wants to use',
                         metavar="USER_NAME", required=True)
+    parser.add_argument('-t', '--heartbeat', type=float, metavar="TIME",
+                        help='Interval in sec between Keep Alives sent to the Server', default=5)
+    parser.add_argument('-c', '--coalesce', type=float, metavar="MILLI_SECONDS",
+                        help='Coalescing window for bursts of messages, 0 to disable', default=0)
+    parser.add_argument('-b', '--scrollback', type=int, metavar="NUM_MESSAGES",
+                        help='Most messages kept in the Chat Box', default=1000)
+    udp_profile.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -229,7 +338,11 @@ if __name__ == '__main__':
         username=args.username,
         packet_size=args.size,
         address_info=address_info,
-        server_socket=(address_info[4][0], address_info[4][1])
+        server_socket=(address_info[4][0], address_info[4][1]),
+        heartbeat=args.heartbeat,
+        coalesce_window=args.coalesce / 1000,
+        scrollback=args.scrollback
     )
 
+    udp_profile.from_arguments(args, client)
     client.server_handler()
@@ -0,0 +1,281 @@
+import argparse
+import bisect
+import hashlib
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
+
+from offline_store import OfflineMessageStore
+from server import UDPChatServer
+from udp_core import FORMAT, Framer, create_socket, opcode, receive, text
+import udp_log
+import udp_metrics
+
+# Largest bus datagram - a forwarded message carries the Relay header on top of a full Client packet
+BUS_SIZE = 1 << 16
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=128):
+        """
+        Consistent Hash Ring, adding or removing a node only moves the keys of its neighbours
+        :param nodes: Number of nodes
+        :param replicas: Number of virtual points per node on the ring
+        """
+        points = sorted(
+            (self.hash(f"{node}#{replica}"), node) for node in range(nodes) for replica in range(replicas)
+        )
+        self.points = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key):
+        # Python's hash() is salted per process, every shard has to agree on the placement
+        return int.from_bytes(hashlib.md5(key.encode(FORMAT)).digest()[:8], "big")
+
+    def owner(self, key):
+        """
+        :param key: Username
+        :return: int - Node owning the key
+        """
+        position = bisect.bisect(self.points, self.hash(key)) % len(self.points)
+        return self.nodes[position]
+
+
+class ShardedChatServer(UDPChatServer):
+    def __init__(self, address_info, packet_size, shard_id, shard_sockets, bus_sockets, offline_store=None,
+                 session_timeout=15, coalesce_window=0, log=None):
+        """
+        Chat Server owning the users that hash onto its shard
+
+        Messages to users of other shards are forwarded over a loopback UDP bus
+        :param address_info: Address Info got from the `socket.getAddrInfo` for this shard
+        :param packet_size: Amount of Information sent per message in Bytes
+        :param shard_id: Index of this shard
+        :param shard_sockets: (IP, Port) Clients use for every shard
+        :param bus_sockets: Loopback (IP, Port) of the bus for every shard
+        :param offline_store: OfflineMessageStore of this shard, None to drop messages to inactive users
+        :param session_timeout: Time in sec after which a silent Client is signed out
+        :param coalesce_window: Time in sec chat lines to the same Client may be held back to share a datagram
+        :param log: udp_log.Logger of the shard
+        """
+        self.shard_id = shard_id
+        self.shard_sockets = shard_sockets
+        self.bus_sockets = bus_sockets
+        self.ring = HashRing(len(shard_sockets))
+        self.bus = None
+        super().__init__(address_info, packet_size, offline_store=offline_store, session_timeout=session_timeout,
+                         coalesce_window=coalesce_window, log=log)
+
+    def initiate_server(self):
+        super().initiate_server()
+        self.bus = create_socket(socket.AF_INET, self.bus_sockets[self.shard_id])
+        self.log.info("SHARD", shard=self.shard_id, bus=self.bus_sockets[self.shard_id])
+
+    def client_handler(self):
+        """
+        Handles the Clients of this shard and the messages forwarded by the other shards
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.server, selectors.EVENT_READ)
+        selector.register(self.bus, selectors.EVENT_READ)
+        while True:
+            for key, _ in selector.select(self.poll_timeout()):
+                if key.fileobj is self.bus:
+                    self.on_bus()
+                else:
+                    buffer = self.buffers.acquire()
+                    data, client_socket = receive(self.server, buffer, self.packet_size)
+                    self.touch(client_socket)
+                    self.handle_datagram(data, client_socket)
+                    self.buffers.release(buffer)
+            self.check_sessions()
+
+    def on_bus(self):
+        # A single message forwarded by another shard
+        data, _ = self.bus.recvfrom(BUS_SIZE)
+        self.handle_bus(data.decode(FORMAT))
+
+    def handle_bus(self, data):
+        """
+        Handles a message forwarded by another shard
+          `Relay <origin> <source> <dest> [message]` - message for a user of this shard
+          `Reply <source> <response>` - response for a user of this shard
+        :param data: Decoded Bus Message
+        """
+        if data[:5] == "Relay":
+            fields = data.split(' ', 4)
+            origin, source_username, dest_username = int(fields[1]), fields[2], fields[3]
+            message = fields[4] if len(fields) > 4 else ''
+            response = self.deliver(source_username, dest_username, message)
+            if response is not None:
+                self.bus.sendto(f"Reply {source_username} {response}".encode(FORMAT), self.bus_sockets[origin])
+
+        elif data[:5] == "Reply":
+            _, source_username, response = data.split(' ', 2)
+            if source_username in self.active_clients:
+                self.send(self.active_clients[source_username], response)
+
+    def new_client(self, user_name, client_socket):
+        """
+        Registers the Client if it belongs to this shard, else redirects it to its shard
+        :param user_name: Username of the Client
+        :param client_socket: (IP, Port) of the Client
+        """
+        owner = self.ring.owner(user_name)
+        if owner == self.shard_id:
+            super().new_client(user_name, client_socket)
+            return
+        ip, port = self.shard_sockets[owner][:2]
+        self.log.info("SHARD REDIRECT", shard=self.shard_id, user=user_name, owner=owner)
+        self.send(client_socket, f"Moved {ip} {port}")
+
+    def send_message(self, source_username, dest_username, message):
+        """
+        Sends the message locally if the Destination belongs to this shard, else forwards it to its shard
+        :param source_username: Username of the Source Client
+        :param dest_username: Username of the Destination Client
+        :param message: Message to be sent
+        """
+        owner = self.ring.owner(dest_username)
+        if owner == self.shard_id:
+            super().send_message(source_username, dest_username, message)
+            return
+        relay = f"Relay {self.shard_id} {source_username} {dest_username} {message}".rstrip()
+        self.bus.sendto(relay.encode(FORMAT), self.bus_sockets[owner])
+
+
+class ChatRouter:
+    def __init__(self, address_info, packet_size, shard_sockets, log=None):
+        """
+        Optional front door of the cluster, redirects every signing in Client to the shard owning its username
+        :param address_info: Address Info got from the `socket.getAddrInfo` for the Router
+        :param packet_size: Amount of Information sent per message in Bytes
+        :param shard_sockets: (IP, Port) Clients use for every shard
+        :param log: udp_log.Logger of the Router
+        """
+        self.log = log or udp_log.Logger()
+        self.socket = (address_info[4][0], address_info[4][1])
+        self.packet_size = packet_size
+        self.shard_sockets = shard_sockets
+        self.ring = HashRing(len(shard_sockets))
+        self.framer = Framer(packet_size)
+        self.server = create_socket(address_info[0], self.socket)
+        self.log.info("ROUTER INITIATED", address=self.socket, shards=len(shard_sockets))
+
+    def client_handler(self):
+        while True:
+            data, client_socket = self.server.recvfrom(self.packet_size)
+            fields = text(data).split()
+            # A bare `User` has no name to place on the ring
+            if opcode(data) == b"user" and len(fields) > 1:
+                ip, port = self.shard_sockets[self.ring.owner(fields[1])][:2]
+                self.framer.send(self.server, f"Moved {ip} {port}", client_socket)
+
+
+def run_shard(address_info, packet_size, shard_id, shard_sockets, bus_sockets, store, session_timeout,
+              coalesce_window, quiet, log_level=udp_log.INFO, metrics_port=None):
+    """
+    Entry point of a shard process
+    :param metrics_port: Local HTTP Port serving the metrics of the shard, None for none
+    """
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    offline_store = None
+    if store:
+        offline_store = OfflineMessageStore(directory=os.path.join(store, f"shard-{shard_id}"))
+    server = ShardedChatServer(
+        address_info=address_info,
+        packet_size=packet_size,
+        shard_id=shard_id,
+        shard_sockets=shard_sockets,
+        bus_sockets=bus_sockets,
+        offline_store=offline_store,
+        session_timeout=session_timeout,
+        coalesce_window=coalesce_window,
+        log=udp_log.Logger(level=log_level)
+    )
+    if metrics_port:
+        udp_metrics.serve(server.registry, metrics_port)
+    server.client_handler()
+
+
+def start_cluster(ip, port, shards, bus_port, packet_size=1024, store=None, session_timeout=15, coalesce_window=0,
+                  router=False, quiet=False, log_level=udp_log.INFO, metrics_port=None):
+    """
+    Starts one process per shard, shard i serves Clients on port + 1 + i and its metrics on metrics_port + i
+
+    :return: list of shard Processes and the Router (None if not asked for)
+    """
+    address_infos = [socket.getaddrinfo(ip, port + 1 + shard, proto=socket.IPPROTO_UDP)[0]
+                     for shard in range(shards)]
+    shard_sockets = [address_info[4] for address_info in address_infos]
+    bus_sockets = [("127.0.0.1", bus_port + shard) for shard in range(shards)]
+    processes = []
+    for shard, address_info in enumerate(address_infos):
+        process = multiprocessing.Process(
+            target=run_shard,
+            args=(address_info, packet_size, shard, shard_sockets, bus_sockets, store, session_timeout,
+                  coalesce_window, quiet, log_level, metrics_port and metrics_port + shard),
+            daemon=True
+        )
+        process.start()
+        processes.append(process)
+
+    chat_router = None
+    if router:
+        chat_router = ChatRouter(socket.getaddrinfo(ip, port, proto=socket.IPPROTO_UDP)[0], packet_size,
+                                 shard_sockets, log=udp_log.Logger(level=log_level))
+    return processes, chat_router
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UDP Chat Server Cluster - one process per shard',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS/DOMAIN_NAME",
+                        help='UDP Chat Server Local IP (IPv4 or IPv6) Address or Domain Name to Port Bind to',
+                        default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER",
+                        help='UDP Chat Router Port Number, shard i binds to PORT_NUMBER + 1 + i', default=7776)
+    parser.add_argument('-n', '--shards', type=int, help='Number of shard processes', default=os.cpu_count())
+    parser.add_argument('-b', '--bus-port', type=int, metavar="PORT_NUMBER",
+                        help='Loopback Port of the bus of shard 0, shard i binds to PORT_NUMBER + i', default=7876)
+    parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE",
+                        help='UDP Chat Packet Size in Bytes', default=1024)
+    parser.add_argument('-t', '--timeout', type=float, metavar="TIME",
+                        help='Time in sec after which a Client without Keep Alives is signed out', default=15)
+    parser.add_argument('-c', '--coalesce', type=float, metavar="MILLI_SECONDS",
+                        help='Coalescing window for bursts of chat lines to the same Client, 0 to disable', default=0)
+    parser.add_argument('--store', type=str, metavar="DIRECTORY",
+                        help='Directory of the Offline Message Logs, one per shard', default="Offline_Messages")
+    parser.add_argument('--no-store', dest='store', action='store_const', const=None,
+                        help='Drop messages to inactive users instead of queueing them')
+    parser.add_argument('--no-router', dest='router', action='store_false',
+                        help='Do not run the Router, Clients connect to any shard and get redirected')
+    parser.add_argument('--log-level', choices=udp_log.LEVELS, default="info",
+                        help='Lowest level logged, debug adds a record per datagram')
+    parser.add_argument('--metrics-port', type=int, metavar="PORT_NUMBER",
+                        help='Local HTTP Port of the metrics of shard 0, shard i serves them on PORT_NUMBER + i')
+
+    args = parser.parse_args()
+
+    shard_processes, chat_router = start_cluster(
+        ip=args.ip,
+        port=args.port,
+        shards=args.shards,
+        bus_port=args.bus_port,
+        packet_size=args.size,
+        store=args.store,
+        session_timeout=args.timeout,
+        coalesce_window=args.coalesce / 1000,
+        router=args.router,
+        log_level=udp_log.LEVELS[args.log_level],
+        metrics_port=args.metrics_port
+    )
+    if chat_router is not None:
+        chat_router.client_handler()
+    for shard_process in shard_processes:
+        shard_process.join()
@@ -0,0 +1,100 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+from cluster import start_cluster
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT
+
+
+def sign_in(client, username, server_socket, packet_size):
+    """
+    Signs in following the redirects of the cluster
+    :return: (IP, Port) of the shard owning the username
+    """
+    while True:
+        client.sendto(f"User {username}".encode(FORMAT).ljust(packet_size), server_socket)
+        response = client.recvfrom(packet_size)[0].decode(FORMAT).strip()
+        if response.lower()[:5] != "moved":
+            return server_socket
+        _, ip, port = response.split()
+        server_socket = (ip, int(port))
+
+
+def chat_pair(pair_id, server_socket, packet_size, num_messages, start, results):
+    """
+    Signs in a sender and a receiver, blasts messages from one to the other and counts the ones delivered
+    """
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sender.settimeout(5)
+    receiver.settimeout(1)
+    sender_shard = sign_in(sender, f"sender{pair_id}", server_socket, packet_size)
+    sign_in(receiver, f"receiver{pair_id}", server_socket, packet_size)
+    message = f"Chat receiver{pair_id} benchmark message".encode(FORMAT).ljust(packet_size)
+
+    start.wait()
+    began = time.perf_counter()
+    for _ in range(num_messages):
+        sender.sendto(message, sender_shard)
+    received = 0
+    finished = began
+    try:
+        while received < num_messages:
+            receiver.recvfrom(packet_size)
+            received += 1
+            finished = time.perf_counter()
+    except socket.timeout:
+        pass
+    results.put((received, began, finished))
+
+
+def run(shards, pairs, num_messages, port, bus_port, packet_size):
+    """
+    :return: (Messages delivered per sec, Delivery Ratio) for a cluster of the given number of shards
+    """
+    processes, _ = start_cluster("127.0.0.1", port, shards, bus_port, packet_size=packet_size, quiet=True)
+    # Let the shards bind
+    time.sleep(0.5)
+    start = multiprocessing.Barrier(pairs)
+    results = multiprocessing.Queue()
+    clients = [
+        multiprocessing.Process(target=chat_pair,
+                                args=(pair, ("127.0.0.1", port + 1), packet_size, num_messages, start, results))
+        for pair in range(pairs)
+    ]
+    for client in clients:
+        client.start()
+    outcomes = [results.get() for _ in clients]
+    for process in clients + processes:
+        process.terminate()
+        process.join()
+
+    delivered = sum(received for received, _, _ in outcomes)
+    elapsed = max(finished for _, _, finished in outcomes) - min(began for _, began, _ in outcomes)
+    return delivered / max(elapsed, 1e-9), delivered / (pairs * num_messages)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Loopback throughput of the UDP Chat Server Cluster',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--shards', type=int, nargs='+', help='Shard counts to compare', default=[1, 2, 4])
+    parser.add_argument('-c', '--pairs', type=int, help='Number of sender / receiver pairs', default=8)
+    parser.add_argument('-m', '--messages', type=int, help='Messages sent by every sender', default=5000)
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER", help='First Port to use', default=17776)
+    parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE",
+                        help='UDP Chat Packet Size in Bytes', default=1024)
+
+    args = parser.parse_args()
+
+    print(f"{'Shards':>8} {'Messages/s':>12} {'Delivered':>10}")
+    for run_id, num_shards in enumerate(args.shards):
+        # Fresh ports every run, the sockets of the previous run may linger
+        base_port = args.port + run_id * 200
+        throughput, ratio = run(num_shards, args.pairs, args.messages, base_port, base_port + 100, args.size)
+        print(f"{num_shards:>8} {throughput:>12.0f} {ratio:>10.1%}")
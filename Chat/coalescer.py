@@ -0,0 +1,142 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT
+
+BATCH_HEADER = "Batch"
+
+
+def batch_lines(lines, packet_size):
+    """
+    Packs the lines into `Batch` datagrams of at most Packet Size, one line per row after the header
+
+    A line too long to fit along with the Batch header is cut short
+    :param lines: Messages to be packed, without any newline
+    :param packet_size: Maximum Size of a datagram in Bytes
+    :return: generator of unpadded datagrams
+    """
+    limit = packet_size - len(BATCH_HEADER) - 1
+    batch = [BATCH_HEADER]
+    size = len(BATCH_HEADER)
+    for line in lines:
+        line = line.encode(FORMAT)[:limit].decode(FORMAT)
+        if size + len(line) + 1 > packet_size:
+            yield "\n".join(batch)
+            batch = [BATCH_HEADER]
+            size = len(BATCH_HEADER)
+        batch.append(line)
+        size += len(line) + 1
+    if len(batch) > 1:
+        yield "\n".join(batch)
+
+
+def unpack_batch(data):
+    """
+    :param data: Stripped `Batch` datagram
+    :return: list of strings - Packed lines
+    """
+    return data.split("\n")[1:]
+
+
+class Coalescer:
+    def __init__(self, sendto, packet_size, window):
+        """
+        Nagle-style coalescing of the lines sent to the same address
+
+        A line to an address idle for the whole window goes out at once, so interactive typing is not slowed down.
+        Lines following closely behind are held for at most the window and packed into a single `Batch` datagram
+        :param sendto: Callable taking the padded Bytes and the (IP, Port) to send them to
+        :param packet_size: Maximum Size of a datagram in Bytes
+        :param window: Coalescing window in sec, the most a line is held back
+        """
+        self.sendto = sendto
+        self.packet_size = packet_size
+        self.window = window
+        # (IP, Port) -> [deadline, size, lines]
+        self.pending = {}
+        # (IP, Port) -> time of the last datagram sent
+        self.last_sent = {}
+        self.lock = threading.Lock()
+
+    def add(self, line, address):
+        """
+        Sends the line now if the address is idle, else holds it back to be packed with the lines following it
+        :param line: Message without any newline
+        :param address: (IP, Port) of the Destination
+        :return: False if the line does not fit in a datagram, it is not sent - the receiver would cut it short
+        """
+        length = len(line.encode(FORMAT))
+        if length > self.packet_size:
+            return False
+        line_size = length + 1
+        with self.lock:
+            now = time.monotonic()
+            buffered = self.pending.get(address)
+            if buffered is None:
+                if now - self.last_sent.get(address, float('-inf')) >= self.window:
+                    self._send(line, address, now)
+                    return True
+                buffered = self.pending[address] = [now + self.window, len(BATCH_HEADER), []]
+
+            if buffered[1] + line_size > self.packet_size and buffered[2]:
+                self._flush(address, now)
+                buffered = self.pending[address] = [now + self.window, len(BATCH_HEADER), []]
+            buffered[1] += line_size
+            buffered[2].append(line)
+            if buffered[1] >= self.packet_size:
+                self._flush(address, now)
+        return True
+
+    def poll(self):
+        """
+        Sends the batches whose window is over
+        :return: Time in sec until the next batch is due, None if nothing is held back
+        """
+        with self.lock:
+            now = time.monotonic()
+            for address in [address for address, buffered in self.pending.items() if buffered[0] <= now]:
+                self._flush(address, now)
+            return self._next_timeout(now)
+
+    def next_timeout(self):
+        with self.lock:
+            return self._next_timeout(time.monotonic())
+
+    def _next_timeout(self, now):
+        if not self.pending:
+            return None
+        return max(0.0, min(buffered[0] for buffered in self.pending.values()) - now)
+
+    def flush(self):
+        """
+        Sends everything held back
+        """
+        with self.lock:
+            now = time.monotonic()
+            for address in list(self.pending):
+                self._flush(address, now)
+
+    def forget(self, address):
+        """
+        Sends what is held back for an address that went away and drops its state
+        """
+        with self.lock:
+            if address in self.pending:
+                self._flush(address, time.monotonic())
+            self.last_sent.pop(address, None)
+
+    def _flush(self, address, now):
+        lines = self.pending.pop(address)[2]
+        if len(lines) == 1:
+            self._send(lines[0], address, now)
+            return
+        for batch in batch_lines(lines, self.packet_size):
+            self._send(batch, address, now)
+
+    def _send(self, data, address, now):
+        data = data.encode(FORMAT)
+        self.sendto(data + b' ' * (self.packet_size - len(data)), address)
+        self.last_sent[address] = now
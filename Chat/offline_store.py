@@ -0,0 +1,237 @@
+import os
+import struct
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT
+
+# Record Header - Type, Sequence Number, Timestamp, Username Length, Payload Length
+HEADER = struct.Struct("<BQdHI")
+MESSAGE_RECORD = 1
+DELIVERED_RECORD = 2
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".log"
+
+
+class OfflineMessageStore:
+    def __init__(self, directory, segment_size=1 << 20, max_bytes=64 << 20, max_age=7 * 24 * 3600,
+                 max_per_user=1000):
+        """
+        Append-only, segment rotated Write Ahead Log of undelivered Chat Messages
+
+        Only the location of every pending message is kept in memory, the message itself stays on disk
+        :param directory: Directory holding the Log Segments
+        :param segment_size: Size in Bytes after which a new Segment is started
+        :param max_bytes: Maximum Size in Bytes of all the Segments together, oldest Segments are dropped first
+        :param max_age: Maximum Age in sec of a pending message
+        :param max_per_user: Maximum Number of pending messages per user, oldest are dropped first
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_per_user = max_per_user
+
+        # username -> deque of (sequence, timestamp, segment_id, offset, length)
+        self.index = {}
+        # segment_id -> [size, live_records, newest_timestamp]
+        self.segments = {}
+        self.sequence = 0
+        self.active_id = 0
+        self.active_file = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.recover()
+
+    def segment_path(self, segment_id):
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{segment_id:08d}{SEGMENT_SUFFIX}")
+
+    def recover(self):
+        """
+        Rebuilds the in-memory index by scanning only the Record Headers of every Segment
+        """
+        segment_ids = sorted(
+            int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        for segment_id in segment_ids:
+            self.segments[segment_id] = [0, 0, 0.0]
+            with open(self.segment_path(segment_id), "rb") as segment:
+                # Seeking past the end succeeds, a record is whole only if it ends within the file
+                file_size = os.fstat(segment.fileno()).st_size
+                offset = 0
+                while True:
+                    header = segment.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    record_type, sequence, timestamp, user_length, payload_length = HEADER.unpack(header)
+                    user_name = segment.read(user_length)
+                    if len(user_name) < user_length:
+                        break
+                    user_name = user_name.decode(FORMAT)
+                    payload_offset = offset + HEADER.size + user_length
+                    if payload_offset + payload_length > file_size:
+                        break
+                    # Skip the Payload, only its location is needed
+                    segment.seek(payload_length, os.SEEK_CUR)
+                    offset = payload_offset + payload_length
+                    self.sequence = max(self.sequence, sequence)
+
+                    if record_type == MESSAGE_RECORD:
+                        self._index_message(user_name, sequence, timestamp, segment_id, payload_offset,
+                                            payload_length)
+                    elif record_type == DELIVERED_RECORD:
+                        self._release(user_name, sequence)
+            # Torn write at the end of the Segment is cut off, at the end of the last whole record
+            if file_size != offset:
+                with open(self.segment_path(segment_id), "r+b") as torn_segment:
+                    torn_segment.truncate(offset)
+            self.segments[segment_id][0] = offset
+
+        self.active_id = segment_ids[-1] if segment_ids else 0
+        if self.active_id not in self.segments:
+            self.segments[self.active_id] = [0, 0, 0.0]
+        self.active_file = open(self.segment_path(self.active_id), "ab")
+        self.collect()
+        self.enforce_limits()
+
+    def _index_message(self, user_name, sequence, timestamp, segment_id, offset, length):
+        pending = self.index.setdefault(user_name, deque())
+        if len(pending) >= self.max_per_user:
+            self._drop(pending.popleft())
+        pending.append((sequence, timestamp, segment_id, offset, length))
+        segment = self.segments[segment_id]
+        segment[1] += 1
+        segment[2] = max(segment[2], timestamp)
+
+    def _drop(self, entry):
+        segment = self.segments.get(entry[2])
+        if segment:
+            segment[1] -= 1
+
+    def _release(self, user_name, sequence):
+        """
+        Releases all the pending messages of the user upto the given sequence number
+        """
+        pending = self.index.get(user_name)
+        while pending and pending[0][0] <= sequence:
+            self._drop(pending.popleft())
+        if not pending:
+            self.index.pop(user_name, None)
+
+    def _append(self, record_type, user_name, payload, timestamp):
+        self.sequence += 1
+        user_name = user_name.encode(FORMAT)
+        header = HEADER.pack(record_type, self.sequence, timestamp, len(user_name), len(payload))
+        if self.segments[self.active_id][0] + len(header) + len(user_name) + len(payload) > self.segment_size \
+                and self.segments[self.active_id][0]:
+            self.rotate()
+        offset = self.segments[self.active_id][0] + len(header) + len(user_name)
+        self.active_file.write(header + user_name + payload)
+        self.active_file.flush()
+        self.segments[self.active_id][0] = offset + len(payload)
+        return self.sequence, offset
+
+    def rotate(self):
+        """
+        Closes the active Segment and starts a new one
+        """
+        self.active_file.close()
+        self.active_id += 1
+        self.segments[self.active_id] = [0, 0, 0.0]
+        self.active_file = open(self.segment_path(self.active_id), "ab")
+        self.collect()
+
+    def append(self, dest_username, source_username, message):
+        """
+        Stores a message for an inactive user
+        :param dest_username: Username of the Destination Client
+        :param source_username: Username of the Source Client
+        :param message: Message to be stored
+        """
+        timestamp = time.time()
+        payload = f"{source_username} {message}".encode(FORMAT)
+        sequence, offset = self._append(MESSAGE_RECORD, dest_username, payload, timestamp)
+        self._index_message(dest_username, sequence, timestamp, self.active_id, offset, len(payload))
+        self.enforce_limits()
+
+    def pop(self, user_name):
+        """
+        Reads and Releases all the pending messages of a user
+        :param user_name: Username of the Client
+        :return: list of (source_username, message) in order of arrival
+        """
+        pending = self.index.get(user_name)
+        if not pending:
+            return []
+        oldest = time.time() - self.max_age
+        messages = []
+        handles = {}
+        for sequence, timestamp, segment_id, offset, length in pending:
+            if timestamp < oldest:
+                continue
+            if segment_id == self.active_id:
+                self.active_file.flush()
+            segment = handles.get(segment_id)
+            if segment is None:
+                segment = handles[segment_id] = open(self.segment_path(segment_id), "rb")
+            segment.seek(offset)
+            source_username, _, message = segment.read(length).decode(FORMAT).partition(' ')
+            messages.append((source_username, message))
+        for segment in handles.values():
+            segment.close()
+
+        self._append(DELIVERED_RECORD, user_name, b'', time.time())
+        self._release(user_name, pending[-1][0])
+        self.collect()
+        return messages
+
+    def pending(self, user_name=None):
+        if user_name is not None:
+            return len(self.index.get(user_name, ()))
+        return sum(len(pending) for pending in self.index.values())
+
+    def enforce_limits(self):
+        """
+        Drops the oldest Segments while the store is over its size limit or its Segments are too old
+        """
+        oldest = time.time() - self.max_age
+        total = sum(segment[0] for segment in self.segments.values())
+        for segment_id in sorted(self.segments):
+            if segment_id == self.active_id:
+                break
+            size, _, newest = self.segments[segment_id]
+            if total <= self.max_bytes and newest >= oldest:
+                break
+            self.remove_segment(segment_id)
+            total -= size
+
+    def remove_segment(self, segment_id):
+        for user_name in list(self.index):
+            pending = self.index[user_name]
+            kept = deque(entry for entry in pending if entry[2] != segment_id)
+            if len(kept) != len(pending):
+                if kept:
+                    self.index[user_name] = kept
+                else:
+                    self.index.pop(user_name)
+        self.segments.pop(segment_id)
+        os.remove(self.segment_path(segment_id))
+
+    def collect(self):
+        """
+        Deletes the oldest closed Segments that no longer hold any pending message
+
+        Only a prefix of the log is deleted, so a Delivered Record never outlives the messages it releases
+        """
+        for segment_id in sorted(self.segments):
+            if segment_id == self.active_id or self.segments[segment_id][1] > 0:
+                break
+            self.segments.pop(segment_id)
+            os.remove(self.segment_path(segment_id))
+
+    def close(self):
+        self.active_file.close()
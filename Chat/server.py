@@ -1,25 +1,98 @@
 import argparse
+import os
 import socket
+import sys
+import time
 
-FORMAT = "iso-8859-1"
+from coalescer import Coalescer, batch_lines, unpack_batch
+from offline_store import OfflineMessageStore
+from timer_wheel import TimerWheel
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT, BufferPool, Dispatcher, Framer, create_socket, opcode, receive, text
+import udp_log
+import udp_metrics
+import udp_profile
+
+# Events logged per datagram or per chat line, DEBUG and sampled by `--log-sample`
+PACKET_EVENTS = ("MESSAGE RECEIVED", "CHAT", "OFFLINE QUEUED", "USER ERROR")
 
 
 class UDPChatServer:
-    def __init__(self, address_info, packet_size):
+    def __init__(self, address_info, packet_size, offline_store=None, session_timeout=15, coalesce_window=0,
+                 log=None, registry=None):
+        """
+        UDP based Chat Server
+        :param address_info: Address Info got from the `socket.getAddrInfo` for Server
+        :param packet_size: Amount of Information sent per message in Bytes
+        :param offline_store: OfflineMessageStore queueing messages of inactive users, None to drop them
+        :param session_timeout: Time in sec after which a silent Client is signed out
+        :param coalesce_window: Time in sec chat lines to the same Client may be held back to share a datagram,
+                                0 to send every line on its own
+        :param log: udp_log.Logger of the Server, one logging at INFO to stdout if None
+        :param registry: udp_metrics.Registry the Server counters are added to, a private one if None
+        """
         self.server = None
         self.socket = (address_info[4][0], address_info[4][1])
         self.packet_size = packet_size
         self.address_info = address_info
         self.active_clients = {}
+        # (IP, Port) -> Username, reverse of active_clients
+        self.client_users = {}
+        self.offline_store = offline_store
+        self.log = log or udp_log.Logger()
+        self.registry = registry or udp_metrics.Registry()
+
+        # Session Liveness - every Client has a single timer in the wheel, re-armed lazily on expiry
+        self.session_timeout = session_timeout
+        self.session_wheel = TimerWheel(tick=min(1.0, session_timeout / 8))
+        self.last_seen = {}
+        # Usernames with a timer pending in the wheel, a single one each however often they sign in again
+        self.timed = set()
+        self.metrics = {"signed_in": 0, "signed_out": 0, "heartbeats": 0, "expired": 0}
+        self.buffers = BufferPool(packet_size)
+        self.framer = Framer(packet_size)
+        self.commands = Dispatcher()
+        self.commands.register("alive", self.alive)
+        self.commands.register("batch", self.batch)
+        self.commands.register("user", self.sign_in)
+        self.commands.register("chat", self.chat)
+        self.commands.register("size", self.change_size)
+        self.commands.register("disconnect", self.sign_out)
+        self.commands.register("stats", self.stats)
+        self.traffic = udp_metrics.TrafficMetrics(self.registry, self.commands.handlers)
         self.initiate_server()
+        # What the store recovered is logged here, with the Server's own settings
+        if offline_store is not None:
+            self.log.info("OFFLINE STORE", pending=offline_store.pending(), segments=len(offline_store.segments),
+                          directory=offline_store.directory)
+        self.coalescer = None
+        if coalesce_window > 0:
+            self.coalescer = Coalescer(self.sendto, packet_size, coalesce_window)
+        self.add_metrics()
 
     def initiate_server(self):
         # Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
-        # SOCK_DGRAM - Socket Type - UDP
-        self.server = socket.socket(self.address_info[0], socket.SOCK_DGRAM)
-        # Port Bind the socket to the port
-        self.server.bind(self.socket)
-        print(f'[SERVER INITIATED] UDP File Transfer Server on {self.socket}')
+        # Port Bind the socket to the port, waking up every tick even when idle to expire silent sessions
+        self.server = create_socket(self.address_info[0], self.socket, timeout=self.session_wheel.tick)
+        self.log.info("SERVER INITIATED", server="UDP Chat", address=self.socket)
+
+    def add_metrics(self):
+        """
+        Registers the session counters and the queue depths, all read on scrape only
+        """
+        udp_metrics.add_socket(self.registry, lambda: self.server)
+        udp_metrics.add_log(self.registry, self.log)
+        self.registry.counter("chat_sessions_total", "Session events", ("event",), function=lambda: self.metrics)
+        self.registry.gauge("chat_active_sessions", "Signed in Clients", function=lambda: len(self.active_clients))
+        self.registry.gauge("chat_session_timers", "Timers in the Session Wheel",
+                            function=lambda: len(self.session_wheel))
+        if self.coalescer is not None:
+            self.registry.gauge("chat_coalescer_pending_clients", "Clients with chat lines held back",
+                                function=lambda: len(self.coalescer.pending))
+        if self.offline_store is not None:
+            self.registry.gauge("chat_offline_users", "Users with queued Offline Messages",
+                                function=lambda: len(self.offline_store.index))
 
     def client_handler(self):
         """
@@ -27,28 +100,148 @@ class UDPChatServer:
         """
 
         while True:
-            data, client_socket = self.server.recvfrom(self.packet_size)
-            data = data.decode(FORMAT)
-            if data:
-                print(f"[MESSAGE RECEIVED] '{data.strip()}' from {client_socket} : bytes = {len(data)}")
-                if data.lower()[:4] == "user":
-                    self.new_client(user_name=data.split()[1], client_socket=client_socket)
-
-                # Message
-                elif data.lower()[:4] == "chat":
-                    dest_username = data.split()[1]
-                    message = ' '.join(data.split()[2:]) if len(data.split()) > 2 else ''
-                    self.send_message(self.find_user_by_socket(client_socket), dest_username, message)
-
-                # Packet Size Change
-                elif data.lower()[:4] == "size":
-                    self.packet_size = int(data.split()[1])
-                    response = self.pad(f"New Size - {self.packet_size}")
-                    print(f"[PACKET SIZE] - New Packet Size - {self.packet_size}")
-                    self.server.sendto(response.encode(FORMAT), client_socket)
-
-                elif data.lower().strip() == "disconnect":
-                    self.disconnect(self.find_user_by_socket(client_socket))
+            self.server.settimeout(self.poll_timeout())
+            buffer = self.buffers.acquire()
+            try:
+                data, client_socket = receive(self.server, buffer, self.packet_size)
+            except socket.timeout:
+                data = None
+            else:
+                self.touch(client_socket)
+            self.check_sessions()
+            if data is not None:
+                self.handle_datagram(data, client_socket)
+            self.buffers.release(buffer)
+
+    def poll_timeout(self):
+        """
+        Sends the coalesced batches that are due
+        :return: Time in sec the Server may wait for the next datagram
+        """
+        if self.coalescer is None:
+            return self.session_wheel.tick
+        timeout = self.coalescer.poll()
+        return self.session_wheel.tick if timeout is None else min(self.session_wheel.tick, timeout)
+
+    def touch(self, client_socket):
+        """
+        Refreshes the session of the Client the datagram came from
+        :param client_socket: (IP, Port) of the Client
+        """
+        user_name = self.client_users.get(client_socket)
+        if user_name is not None:
+            self.last_seen[user_name] = time.monotonic()
+
+    def handle_datagram(self, data, client_socket):
+        """
+        Dispatches a single datagram from a Client
+        :param data: Received Bytes
+        :param client_socket: (IP, Port) of the Client
+        """
+        if not data:
+            return
+        command = opcode(data)
+        started = self.traffic.received(command, len(data))
+        self.dispatch(command, data, client_socket)
+        self.traffic.handled(started)
+
+    def dispatch(self, command, data, client_socket):
+        if self.log.enabled(udp_log.DEBUG):
+            self.log.debug("MESSAGE RECEIVED", command=command, client=client_socket, bytes=len(data))
+        self.commands.handler(command)(data, client_socket)
+
+    def alive(self, data, client_socket):
+        # Keep Alive - only refreshes the session, no reply
+        self.metrics["heartbeats"] += 1
+
+    def batch(self, data, client_socket):
+        # Coalesced lines - handled one by one, counted as the single Batch datagram they came in
+        for line in unpack_batch(text(data)):
+            line = line.encode(FORMAT)
+            if line:
+                self.dispatch(opcode(line), line, client_socket)
+
+    def sign_in(self, data, client_socket):
+        fields = text(data).split()
+        # A bare `User` has no name to sign in with
+        if len(fields) > 1:
+            self.new_client(user_name=fields[1], client_socket=client_socket)
+
+    def chat(self, data, client_socket):
+        # Message
+        fields = text(data).split()
+        # Without a Destination there is nobody to send to
+        if len(fields) < 2:
+            return
+        message = ' '.join(fields[2:]) if len(fields) > 2 else ''
+        source_username = self.find_user_by_socket(client_socket)
+        # Session expired or never signed in
+        if source_username is None:
+            self.send(client_socket, "Sign In")
+            return
+        self.send_message(source_username, fields[1], message)
+
+    def change_size(self, data, client_socket):
+        # Packet Size Change
+        fields = text(data).split()
+        if len(fields) < 2 or not fields[1].isdigit() or int(fields[1]) == 0:
+            return
+        self.packet_size = int(fields[1])
+        self.buffers.resize(self.packet_size)
+        self.framer.packet_size = self.packet_size
+        if self.coalescer is not None:
+            self.coalescer.packet_size = self.packet_size
+        self.log.info("PACKET SIZE", size=self.packet_size)
+        self.send(client_socket, f"New Size - {self.packet_size}")
+
+    def sign_out(self, data, client_socket):
+        user_name = self.find_user_by_socket(client_socket)
+        if user_name is None:
+            self.send(client_socket, "Disconnected")
+            return
+        self.disconnect(user_name)
+
+    def stats(self, data, client_socket):
+        # Session Counters
+        stats = ' '.join(f"{key}={value}" for key, value in self.session_stats().items())
+        self.send(client_socket, f"Stats {stats}")
+
+    def check_sessions(self):
+        """
+        Advances the Session Timer Wheel and signs out the Clients silent for longer than the Session Timeout
+        """
+        now = time.monotonic()
+        for user_name in self.session_wheel.advance(now):
+            last_seen = self.last_seen.get(user_name)
+            # Signed out in the meanwhile
+            if last_seen is None:
+                self.timed.discard(user_name)
+                continue
+            idle = now - last_seen
+            if idle < self.session_timeout:
+                self.session_wheel.schedule(user_name, self.session_timeout - idle)
+            else:
+                self.timed.discard(user_name)
+                self.expire(user_name)
+
+    def expire(self, user_name):
+        """
+        Signs out a Client that stopped sending Keep Alives
+        :param user_name: Username of the Client
+        """
+        client_socket = self.active_clients.pop(user_name)
+        self.client_users.pop(client_socket, None)
+        if self.coalescer is not None:
+            self.coalescer.forget(client_socket)
+        self.last_seen.pop(user_name, None)
+        self.metrics["expired"] += 1
+        self.log.info("EXPIRED", user=user_name, client=client_socket, timeout=self.session_timeout)
+
+    def session_stats(self):
+        """
+        :return: dict - Session Counters along with the number of active sessions, running timers and log records
+        """
+        return dict(self.metrics, active=len(self.active_clients), timers=len(self.session_wheel), **self.log.stats())
 
     def new_client(self, user_name, client_socket):
         """
@@ -58,28 +251,55 @@ class UDPChatServer:
         """
         response = ""
         if self.active_clients.get(user_name):
-            print(f"[SIGN IN] Username already taken")
-            response = self.pad(f"Taken - {user_name}")
+            self.log.info("SIGN IN", user=user_name, client=client_socket, status="taken")
+            response = f"Taken - {user_name}"
         else:
             self.active_clients[user_name] = client_socket
-            print(f"[SIGN IN] Client {user_name} - {client_socket} signed in to Server")
-        self.server.sendto(response.encode(FORMAT), client_socket)
+            self.client_users[client_socket] = user_name
+            # A timer may still be pending from an earlier session of the same user, it is re-armed on expiry
+            if user_name not in self.timed:
+                self.session_wheel.schedule(user_name, self.session_timeout)
+                self.timed.add(user_name)
+            self.last_seen[user_name] = time.monotonic()
+            self.metrics["signed_in"] += 1
+            self.log.info("SIGN IN", user=user_name, client=client_socket)
+        if response:
+            self.send(client_socket, response)
+            return
+        # An empty datagram acknowledges the sign in
+        self.sendto(b'', client_socket)
+        self.flush_offline(user_name)
+
+    def flush_offline(self, user_name):
+        """
+        Delivers the messages queued while the Client was inactive, packed into as few datagrams as possible
+        :param user_name: Username of the Client
+        """
+        if self.offline_store is None:
+            return
+        messages = self.offline_store.pop(user_name)
+        if not messages:
+            return
+        self.log.info("OFFLINE DELIVERED", user=user_name, messages=len(messages))
+        lines = [f"Chat {source_username} {message}".rstrip() for source_username, message in messages]
+        for batch in batch_lines(lines, self.packet_size):
+            self.send(self.active_clients[user_name], batch)
 
     def disconnect(self, user_name):
         """
         Disconnects a Client from Server
         :param user_name: Username of the Client
         """
-        print(f"[SIGN OUT] {user_name} - {self.active_clients[user_name]} disconnected")
-        response = self.pad("Disconnected")
-        self.server.sendto(response.encode(FORMAT), self.active_clients[user_name])
-        self.active_clients.pop(user_name)
+        self.log.info("SIGN OUT", user=user_name, client=self.active_clients[user_name])
+        if self.coalescer is not None:
+            self.coalescer.forget(self.active_clients[user_name])
+        self.send(self.active_clients[user_name], "Disconnected")
+        self.client_users.pop(self.active_clients.pop(user_name), None)
+        self.last_seen.pop(user_name, None)
+        self.metrics["signed_out"] += 1
 
     def find_user_by_socket(self, client_socket):
-        for username, active_socket in self.active_clients.items():
-            if client_socket == active_socket:
-                return username
-        return None
+        return self.client_users.get(client_socket)
 
     def send_message(self, source_username, dest_username, message):
         """
@@ -88,32 +308,50 @@ class UDPChatServer:
         :param dest_username: Username of the Destination Client
         :param message: Message to be sent
         """
+        response = self.deliver(source_username, dest_username, message)
+        source_socket = self.active_clients.get(source_username)
+        if response is not None and source_socket is not None:
+            self.send(source_socket, response)
+
+    def deliver(self, source_username, dest_username, message):
+        """
+        Delivers a Message to the Destination Client, or queues it if the Destination is inactive
+        :param source_username: Username of the Source Client
+        :param dest_username: Username of the Destination Client
+        :param message: Message to be sent
+        :return: string - Response for the Source Client, None if there is nothing to reply
+        """
+        # Queue messages for inactive destination, delivered on its next sign in
+        if dest_username not in self.active_clients.keys() and message != '' and self.offline_store is not None:
+            self.log.debug("OFFLINE QUEUED", source=source_username, dest=dest_username)
+            self.offline_store.append(dest_username, source_username, message)
+            return f"Queued {dest_username}"
+
         # If provided destination not in registered clients
         if dest_username not in self.active_clients.keys():
-            print(f"[USER ERROR] {dest_username} not found or inactive")
-            response = self.pad(f"No {dest_username} found")
-            self.server.sendto(response.encode(FORMAT), self.active_clients[source_username])
+            self.log.debug("USER ERROR", source=source_username, dest=dest_username)
+            return f"No {dest_username} found"
 
         # Send message to destination
+        self.log.debug("CHAT", source=source_username, dest=dest_username)
+        if message != '':
+            # The empty Chat Room handshake is never held back
+            if self.coalescer is not None:
+                if not self.coalescer.add(f"Chat {source_username} {message}", self.active_clients[dest_username]):
+                    return f"Too Long {dest_username}"
+                return None
+            response = f"Chat {source_username} {message}"
         else:
-            print(f"[CHAT] Sending message from {self.active_clients[source_username]} to "
-                  f"{self.active_clients[dest_username]}")
-            if message != '':
-                response = self.pad(f"Chat {source_username} {message}")
-            else:
-                response = self.pad(f"Chat {source_username}")
-            self.server.sendto(response.encode(FORMAT), self.active_clients[dest_username])
+            response = f"Chat {source_username}"
+        self.send(self.active_clients[dest_username], response)
+        return None
 
-    def pad(self, message):
-        """
-        Pads the given message upto Packet Size Amount
-        :param message:
-        :return: string - Padded String
-        """
-        message = message.encode(FORMAT)
-        if len(message) < self.packet_size:
-            message += b' ' * (self.packet_size - len(message))
-        return message.decode(FORMAT)
+    def send(self, client_socket, message):
+        self.sendto(self.framer.frame(message), client_socket)
+
+    def sendto(self, data, client_socket):
+        self.server.sendto(data, client_socket)
+        self.traffic.sent(len(data))
 
 
 if __name__ == '__main__':
@@ -127,6 +365,21 @@ if __name__ == '__main__':
                         help='UDP Chat Server Port Number to Port Bind to', default=7776)
     parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE",
                         help='UDP Chat Packet Size in Bytes', default=1024)
+    parser.add_argument('-t', '--timeout', type=float, metavar="TIME",
+                        help='Time in sec after which a Client without Keep Alives is signed out', default=15)
+    parser.add_argument('-c', '--coalesce', type=float, metavar="MILLI_SECONDS",
+                        help='Coalescing window for bursts of chat lines to the same Client, 0 to disable', default=0)
+    parser.add_argument('--store', type=str, metavar="DIRECTORY",
+                        help='Directory of the Offline Message Log', default="Offline_Messages")
+    parser.add_argument('--no-store', dest='store', action='store_const', const=None,
+                        help='Drop messages to inactive users instead of queueing them')
+    parser.add_argument('--store-size', type=int, metavar="MEGA_BYTES",
+                        help='Maximum Size of the Offline Message Log in MB', default=64)
+    parser.add_argument('--store-age', type=float, metavar="HOURS",
+                        help='Maximum Age of a queued Offline Message in hours', default=168)
+    udp_log.add_arguments(parser)
+    udp_metrics.add_arguments(parser)
+    udp_profile.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -136,6 +389,19 @@ if __name__ == '__main__':
         proto=socket.IPPROTO_UDP
     )[0]
 
+    offline_store = None
+    if args.store:
+        offline_store = OfflineMessageStore(
+            directory=args.store,
+            max_bytes=args.store_size << 20,
+            max_age=args.store_age * 3600
+        )
+
     # instantiates server
-    server = UDPChatServer(address_info=address_info, packet_size=args.size)
+    server = UDPChatServer(address_info=address_info, packet_size=args.size, offline_store=offline_store,
+                           session_timeout=args.timeout, coalesce_window=args.coalesce / 1000,
+                           log=udp_log.from_arguments(args, packet_events=PACKET_EVENTS))
+    if args.metrics_port:
+        udp_metrics.serve(server.registry, args.metrics_port)
+    udp_profile.from_arguments(args, server)
     server.client_handler()
@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from coalescer import unpack_batch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_swarm import HeadlessClient, Report, print_report, run_worker, server_stats
+
+# Stages timed by the swarm
+STAGES = ("sign_in", "chat")
+# Replies the Server sends in the normal course of a run, counted but not as errors
+CONTROL_REPLIES = ("disconnected", "queued")
+
+
+class HeadlessChatter(HeadlessClient):
+    def __init__(self, packet_size, server_socket, report):
+        """
+        Chat Client of the swarm - once signed in, the chat lines are accounted for as they arrive, no queue in
+        between
+        :param packet_size: Amount of Information sent per message in Bytes
+        :param server_socket: (IP, Port) of the server, updated when a cluster redirects the Client
+        :param report: Report the received lines are counted into
+        """
+        super().__init__(packet_size, server_socket)
+        self.report = report
+        self.signed_in = False
+        # (Source, Sequence) of the chat lines delivered, a line duplicated on the way is counted once
+        self.seen = set()
+
+    def on_message(self, message):
+        if not self.signed_in:
+            super().on_message(message)
+        elif message.lower()[:5] == "batch":
+            for line in unpack_batch(message):
+                self.on_line(line)
+        else:
+            self.on_line(message)
+
+    def on_line(self, line):
+        """
+        Accounts for a line received after signing in - `Chat <source> <sequence> <sent at ns>`
+        """
+        fields = line.split()
+        kind = fields[0].lower() if fields else ''
+        if kind == "chat" and len(fields) == 4:
+            line_id = (fields[1], fields[2])
+            if line_id in self.seen:
+                self.report.errors["duplicate"] += 1
+                return
+            self.seen.add(line_id)
+            self.report.counters["delivered"] += 1
+            self.report.latencies["chat"].append((time.perf_counter_ns() - int(fields[3])) / 1e9)
+        elif kind in CONTROL_REPLIES:
+            self.report.counters[kind] += 1
+        else:
+            self.report.errors[kind or "empty"] += 1
+
+    async def sign_in(self, username, timeout):
+        """
+        Signs in following the redirects of a cluster
+        :return: True if signed in
+        """
+        while True:
+            self.send(f"User {username}")
+            response = await self.recv(timeout)
+            if response.lower()[:5] != "moved":
+                break
+            _, ip, port = response.split()
+            self.server_socket = (ip, int(port))
+        self.signed_in = response == ''
+        return self.signed_in
+
+
+async def chat_session(client, partner, messages, rate, heartbeat):
+    """
+    Scripted chatter - sends its messages to the partner at the given rate, keeping the session alive
+    :param rate: Messages per sec, 0 to send them all at once
+    :param heartbeat: Time in sec between Keep Alives
+    """
+    interval = 1 / rate if rate > 0 else 0
+    # Chatters do not type in lockstep, a random phase keeps them from all hitting the Server in the same instant
+    await asyncio.sleep(random.random() * interval)
+    started = last_alive = time.perf_counter()
+    for sequence in range(messages):
+        client.send(f"Chat {partner} {sequence} {time.perf_counter_ns()}")
+        client.report.counters["sent_chat"] += 1
+        now = time.perf_counter()
+        if now - last_alive >= heartbeat:
+            client.send("Alive")
+            last_alive = now
+        # Pace against the start, a late wake up does not slow the whole run down
+        await asyncio.sleep(max(0.0, started + (sequence + 1) * interval - now))
+
+
+async def swarm(first, chatters, server_socket, packet_size, messages, rate, timeout, ramp, heartbeat, family):
+    """
+    Runs the virtual chatters first ... first + chatters - 1 on a single asyncio loop, in pairs chatting to
+    each other
+    :param ramp: Time in sec over which the chatters sign in, so they do not all sign in at once
+    :return: Report
+    """
+    report = Report(STAGES)
+    clients = {}
+
+    async def sign_in(chatter_id):
+        await asyncio.sleep(ramp * (chatter_id - first) / chatters)
+        client = await HeadlessChatter.connect(packet_size, server_socket, report, family=family)
+        sent_at = time.perf_counter()
+        try:
+            if await client.sign_in(f"chatter{chatter_id}", timeout):
+                report.latencies["sign_in"].append(time.perf_counter() - sent_at)
+                clients[chatter_id] = client
+                return
+            report.errors["sign_in"] += 1
+        except asyncio.TimeoutError:
+            report.errors["timeout"] += 1
+        client.close()
+
+    await asyncio.gather(*(sign_in(chatter_id) for chatter_id in range(first, first + chatters)))
+    # Only the pairs that both signed in chat, a message to a missing partner is not a delivery failure
+    pairs = [chatter_id for chatter_id in clients if chatter_id % 2 == 0 and chatter_id + 1 in clients]
+    await asyncio.gather(*(chat_session(clients[chatter_id + side], f"chatter{chatter_id + 1 - side}", messages,
+                                        rate, heartbeat) for chatter_id in pairs for side in (0, 1)))
+
+    # Drain the lines still in flight, until everything arrived or nothing did for a timeout
+    expected = len(pairs) * 2 * messages
+    delivered, idle_since = -1, time.perf_counter()
+    while report.counters["delivered"] < expected and time.perf_counter() - idle_since < timeout:
+        if report.counters["delivered"] != delivered:
+            delivered, idle_since = report.counters["delivered"], time.perf_counter()
+        await asyncio.sleep(0.01)
+    report.errors["lost"] += expected - report.counters["delivered"]
+
+    for signed_out, client in enumerate(clients.values()):
+        client.send("Disconnect")
+        # Sign out in small bursts, the Server's receive buffer would drop most of a single one
+        if signed_out % 32 == 31:
+            await asyncio.sleep(0.002)
+        report.counters["sent"] += client.sent
+        report.counters["received"] += client.received
+        client.close()
+    return report
+
+
+def run(chatters, server_socket, packet_size, messages=100, rate=10, processes=1, timeout=5, ramp=1.0, heartbeat=5,
+        family=socket.AF_INET):
+    """
+    Drives the Server with virtual chatters, split over a Process Pool if asked for - both chatters of a pair
+    always run in the same process, so the send timestamps share a clock
+    :return: (Report, elapsed time in sec)
+    """
+    started = time.perf_counter()
+    if processes <= 1:
+        report = run_worker(swarm, 0, chatters, server_socket, packet_size, messages, rate, timeout, ramp, heartbeat,
+                            family)
+    else:
+        pairs = chatters // 2
+        sizes = [2 * (pairs // processes + (worker < pairs % processes)) for worker in range(processes)]
+        firsts = [sum(sizes[:worker]) for worker in range(processes)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(run_worker, swarm, firsts[worker], sizes[worker], server_socket, packet_size,
+                                   messages, rate, timeout, ramp, heartbeat, family) for worker in range(processes)]
+            report = Report(STAGES)
+            for future in futures:
+                report.merge(future.result())
+    return report, time.perf_counter() - started
+
+
+def print_swarm(report, elapsed, chatters):
+    print_report(report, [
+        f"[SWARM] {chatters} chatters sent {report.counters['sent_chat']} messages, "
+        f"{report.counters['delivered']} delivered in {elapsed:.2f}s",
+        f"[THROUGHPUT] {report.counters['delivered'] / elapsed:.1f} messages/s delivered, "
+        f"{(report.counters['sent'] + report.counters['received']) / elapsed:.0f} datagrams/s"
+    ], report.counters['sent_chat'], "messages", width=8)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless Load Test of the UDP Chat Server',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS/DOMAIN_NAME",
+                        help='UDP Chat Server IP (IPv4 or IPv6) Address or Domain Name to connect to',
+                        default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER",
+                        help='UDP Chat Server Port Number to connect to', default=7776)
+    parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE",
+                        help='UDP Chat Packet Size in Bytes', default=1024)
+    parser.add_argument('-n', '--chatters', type=int, help='Number of virtual chatters, in pairs', default=1000)
+    parser.add_argument('-m', '--messages', type=int, help='Messages sent by every chatter', default=100)
+    parser.add_argument('-r', '--rate', type=float, help='Messages per sec of every chatter, 0 for a burst',
+                        default=10)
+    parser.add_argument('-j', '--processes', type=int, help='Worker Processes, 1 to run in process', default=1)
+    parser.add_argument('-t', '--timeout', type=float, help='Time in sec a chatter waits for a reply', default=5)
+    parser.add_argument('--ramp', type=float, help='Time in sec over which the chatters sign in', default=1)
+    parser.add_argument('--heartbeat', type=float, help='Time in sec between Keep Alives', default=5)
+    parser.add_argument('--spawn', action='store_true', help='Start a Server on the given address for the run')
+
+    args = parser.parse_args()
+
+    address_info = socket.getaddrinfo(
+        args.ip,
+        args.port,
+        proto=socket.IPPROTO_UDP
+    )[0]
+    server_socket = (address_info[4][0], address_info[4][1])
+
+    server_process = None
+    if args.spawn:
+        server_process = subprocess.Popen([sys.executable, "server.py", "-i", args.ip, "-p", str(args.port),
+                                           "-s", str(args.size), "--no-store"], stdout=subprocess.DEVNULL)
+        # Let the Server bind
+        time.sleep(0.5)
+    try:
+        report, elapsed = run(args.chatters, server_socket, args.size, args.messages, args.rate, args.processes,
+                              args.timeout, args.ramp, args.heartbeat, address_info[0])
+        after = server_stats(server_socket, args.size, address_info[0])
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    print_swarm(report, elapsed, args.chatters)
+    if after:
+        print("[SERVER]", ' '.join(f"{key}={value}" for key, value in after.items()))
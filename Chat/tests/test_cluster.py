@@ -0,0 +1,89 @@
+import hashlib
+import socket
+from collections import Counter
+
+import pytest
+
+from cluster import HashRing, ShardedChatServer
+import udp_log
+
+PACKET_SIZE = 128
+USERS = [f"user{number}" for number in range(2000)]
+
+
+def test_placement_is_the_same_in_every_process():
+    # Python's hash() is salted per process, the ring must not depend on it
+    assert [HashRing(4).owner(user) for user in USERS[:50]] == [HashRing(4).owner(user) for user in USERS[:50]]
+    assert HashRing(4).hash("alice") == int.from_bytes(hashlib.md5(b"alice").digest()[:8], "big")
+
+
+def test_users_are_spread_over_every_node():
+    owners = Counter(HashRing(4).owner(user) for user in USERS)
+    assert set(owners) == {0, 1, 2, 3}
+    assert min(owners.values()) > len(USERS) / 4 / 2
+
+
+def test_adding_a_node_only_moves_users_onto_it():
+    before, after = HashRing(4), HashRing(5)
+    moved = [user for user in USERS if before.owner(user) != after.owner(user)]
+    assert all(after.owner(user) == 4 for user in moved)
+    assert len(moved) < len(USERS) / 3
+
+
+@pytest.fixture
+def shards():
+    """
+    Two shards on loopback stepped by hand, and a Client socket for each
+    """
+    address_info = socket.getaddrinfo("127.0.0.1", 0, proto=socket.IPPROTO_UDP)[0]
+    shard_sockets, bus_sockets = [None, None], [("127.0.0.1", 0), ("127.0.0.1", 0)]
+    servers = []
+    for shard_id in range(2):
+        server = ShardedChatServer(address_info, PACKET_SIZE, shard_id, shard_sockets, list(bus_sockets),
+                                   log=udp_log.Logger(level=udp_log.ERROR, background=False))
+        shard_sockets[shard_id] = server.server.getsockname()
+        bus_sockets[shard_id] = server.bus.getsockname()
+        servers.append(server)
+    # The bus addresses are only known once bound
+    for server in servers:
+        server.bus_sockets = bus_sockets
+    clients = []
+    for _ in range(2):
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.bind(("127.0.0.1", 0))
+        client.settimeout(1)
+        clients.append(client)
+    yield servers, clients
+    for server in servers:
+        server.server.close()
+        server.bus.close()
+    for client in clients:
+        client.close()
+
+
+def request(server, client, message):
+    server.handle_datagram(message.encode().ljust(PACKET_SIZE), client.getsockname())
+
+
+def test_message_to_another_shard_is_relayed_whole(shards):
+    servers, clients = shards
+    ring = servers[0].ring
+    source = next(user for user in USERS if ring.owner(user) == 0)
+    dest = next(user for user in USERS if ring.owner(user) == 1)
+    for shard_id, user in ((0, source), (1, dest)):
+        request(servers[shard_id], clients[shard_id], f"User {user}")
+        assert clients[shard_id].recv(PACKET_SIZE).strip() == b""
+
+    # A message filling the Client's packet, longer than it once the Relay header is added
+    message = "x" * (PACKET_SIZE - len(f"Chat {dest} "))
+    request(servers[0], clients[0], f"Chat {dest} {message}")
+    servers[1].on_bus()
+    assert clients[1].recv(PACKET_SIZE).decode().strip() == f"Chat {source} {message}"
+
+
+def test_user_of_another_shard_is_redirected(shards):
+    servers, clients = shards
+    user = next(user for user in USERS if servers[0].ring.owner(user) == 1)
+    request(servers[0], clients[0], f"User {user}")
+    ip, port = servers[1].server.getsockname()
+    assert clients[0].recv(PACKET_SIZE).decode().strip() == f"Moved {ip} {port}"
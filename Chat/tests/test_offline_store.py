@@ -0,0 +1,89 @@
+import os
+
+from offline_store import HEADER, OfflineMessageStore
+
+
+def open_store(directory, **options):
+    return OfflineMessageStore(str(directory), **options)
+
+
+def test_messages_are_popped_in_order_of_arrival(tmp_path):
+    store = open_store(tmp_path)
+    store.append("bob", "alice", "hi")
+    store.append("bob", "carol", "hello there")
+    store.append("dave", "alice", "hey")
+    assert store.pending() == 3
+    assert store.pop("bob") == [("alice", "hi"), ("carol", "hello there")]
+    assert store.pending("bob") == 0
+    assert store.pop("bob") == []
+    assert store.pending() == 1
+    store.close()
+
+
+def test_recovery_keeps_only_the_undelivered_messages(tmp_path):
+    store = open_store(tmp_path)
+    store.append("bob", "alice", "first")
+    store.append("dave", "alice", "second")
+    store.pop("bob")
+    store.close()
+
+    store = open_store(tmp_path)
+    assert store.pending("bob") == 0
+    assert store.pop("dave") == [("alice", "second")]
+    # Sequence numbers carry on, a message after the restart is not released by an old Delivered Record
+    store.append("bob", "alice", "third")
+    store.close()
+    assert open_store(tmp_path).pop("bob") == [("alice", "third")]
+
+
+def test_torn_record_is_cut_off_on_recovery(tmp_path):
+    store = open_store(tmp_path)
+    store.append("bob", "alice", "kept")
+    store.append("bob", "alice", "torn")
+    segment = store.segment_path(store.active_id)
+    store.close()
+    # A crash in the middle of the payload of the last record
+    whole = os.path.getsize(segment)
+    with open(segment, "r+b") as log:
+        log.truncate(whole - 3)
+
+    store = open_store(tmp_path)
+    assert store.pop("bob") == [("alice", "kept")]
+    store.close()
+    record = HEADER.size + len("bob") + len("alice kept")
+    delivered = HEADER.size + len("bob")
+    assert os.path.getsize(segment) == record + delivered
+
+
+def test_torn_header_is_cut_off_on_recovery(tmp_path):
+    store = open_store(tmp_path)
+    store.append("bob", "alice", "kept")
+    segment = store.segment_path(store.active_id)
+    store.close()
+    with open(segment, "ab") as log:
+        log.write(b"\x01\x02")
+
+    store = open_store(tmp_path)
+    assert store.segments[store.active_id][0] == os.path.getsize(segment)
+    assert store.pop("bob") == [("alice", "kept")]
+    store.close()
+
+
+def test_oldest_messages_of_a_user_are_dropped_past_the_limit(tmp_path):
+    store = open_store(tmp_path, max_per_user=2)
+    for number in range(4):
+        store.append("bob", "alice", f"message {number}")
+    assert store.pop("bob") == [("alice", "message 2"), ("alice", "message 3")]
+    store.close()
+
+
+def test_delivered_segments_are_collected(tmp_path):
+    store = open_store(tmp_path, segment_size=64)
+    for number in range(10):
+        store.append("bob", "alice", f"message {number}")
+    assert len(store.segments) > 1
+    assert len(store.pop("bob")) == 10
+    # Only the active Segment is left once nothing is pending
+    assert list(store.segments) == [store.active_id]
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(store.segment_path(store.active_id))]
+    store.close()
@@ -0,0 +1,104 @@
+import socket
+
+import pytest
+
+from server import UDPChatServer
+from timer_wheel import TimerWheel
+import udp_log
+
+PACKET_SIZE = 256
+TIMEOUT = 0.8
+
+
+def test_timer_fires_once_its_delay_is_over():
+    wheel = TimerWheel(tick=0.1, slots=8)
+    start = wheel.last_tick
+    wheel.schedule("alice", 0.35)
+    assert wheel.advance(start + 0.35) == []
+    assert wheel.advance(start + 0.45) == ["alice"]
+    assert len(wheel) == 0
+
+
+def test_timer_past_a_turn_of_the_wheel_waits_its_rounds():
+    wheel = TimerWheel(tick=0.1, slots=8)
+    start = wheel.last_tick
+    wheel.schedule("alice", 2.0)
+    wheel.schedule("bob", 0.2)
+    assert wheel.advance(start + 0.25) == ["bob"]
+    assert wheel.advance(start + 1.95) == []
+    assert wheel.advance(start + 2.05) == ["alice"]
+
+
+@pytest.fixture
+def chat():
+    """
+    Chat Server stepped by hand and a Client socket its replies are read from
+    """
+    address_info = socket.getaddrinfo("127.0.0.1", 0, proto=socket.IPPROTO_UDP)[0]
+    server = UDPChatServer(address_info, PACKET_SIZE, session_timeout=TIMEOUT,
+                           log=udp_log.Logger(level=udp_log.ERROR, background=False))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(("127.0.0.1", 0))
+    client.settimeout(1)
+    yield server, client
+    client.close()
+    server.server.close()
+
+
+def request(server, client, message):
+    server.handle_datagram(message.encode().ljust(PACKET_SIZE), client.getsockname())
+
+
+def reply(client):
+    return client.recv(PACKET_SIZE).decode().strip()
+
+
+def sign_in(server, client, user_name):
+    request(server, client, f"User {user_name}")
+    assert reply(client) == ""
+
+
+def go_silent(server, user_name):
+    """
+    Moves the wheel and the last Keep Alive of the user back by more than the Session Timeout
+    """
+    server.session_wheel.last_tick -= 2 * TIMEOUT
+    server.last_seen[user_name] -= 2 * TIMEOUT
+
+
+def test_silent_client_is_signed_out(chat):
+    server, client = chat
+    sign_in(server, client, "alice")
+    go_silent(server, "alice")
+    server.check_sessions()
+    assert "alice" not in server.active_clients
+    assert server.session_stats()["expired"] == 1
+
+
+def test_keep_alive_keeps_the_session(chat):
+    server, client = chat
+    sign_in(server, client, "alice")
+    server.session_wheel.last_tick -= 2 * TIMEOUT
+    server.touch(client.getsockname())
+    server.check_sessions()
+    assert "alice" in server.active_clients
+    assert len(server.session_wheel) == 1
+
+
+def test_message_from_an_expired_client_asks_it_to_sign_in(chat):
+    server, client = chat
+    sign_in(server, client, "alice")
+    go_silent(server, "alice")
+    server.check_sessions()
+    request(server, client, "Chat bob hello")
+    assert reply(client) == "Sign In"
+
+
+def test_signing_in_again_keeps_a_single_timer(chat):
+    server, client = chat
+    for _ in range(5):
+        sign_in(server, client, "alice")
+        request(server, client, "Disconnect")
+        assert reply(client) == "Disconnected"
+    sign_in(server, client, "alice")
+    assert len(server.session_wheel) == 1
@@ -0,0 +1,64 @@
+import math
+import time
+
+
+class TimerWheel:
+    def __init__(self, tick=0.5, slots=512):
+        """
+        Hashed Timer Wheel
+
+        A timer lands in the slot its deadline hashes to, along with the number of full turns of the wheel still
+        left, so every tick only visits a single slot however many timers are running
+        :param tick: Duration of one slot in sec
+        :param slots: Number of slots in the wheel
+        """
+        self.tick = tick
+        self.slots = slots
+        self.wheel = [[] for _ in range(slots)]
+        self.current = 0
+        self.last_tick = time.monotonic()
+        self.size = 0
+
+    def schedule(self, key, delay):
+        """
+        Schedules the key to fire after the given delay
+        :param key: Key returned on expiry
+        :param delay: Delay in sec, rounded up to the tick
+        """
+        ticks = max(1, math.ceil(delay / self.tick))
+        slot = (self.current + ticks) % self.slots
+        # [Remaining Rounds, Key]
+        self.wheel[slot].append([(ticks - 1) // self.slots, key])
+        self.size += 1
+
+    def advance(self, now=None):
+        """
+        Moves the wheel upto the current time
+        :param now: time.monotonic() value, current time if None
+        :return: list of keys whose timers expired
+        """
+        now = time.monotonic() if now is None else now
+        elapsed = int((now - self.last_tick) / self.tick)
+        if elapsed <= 0:
+            return []
+        self.last_tick += elapsed * self.tick
+
+        expired = []
+        for _ in range(elapsed):
+            self.current = (self.current + 1) % self.slots
+            bucket = self.wheel[self.current]
+            if not bucket:
+                continue
+            pending = []
+            for timer in bucket:
+                if timer[0] > 0:
+                    timer[0] -= 1
+                    pending.append(timer)
+                else:
+                    expired.append(timer[1])
+            self.wheel[self.current] = pending
+            self.size -= len(bucket) - len(pending)
+        return expired
+
+    def __len__(self):
+        return self.size
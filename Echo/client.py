@@ -1,21 +1,36 @@
 import argparse
 import asyncio
+import os
 import socket
+import sys
+import time
 from datetime import datetime
 import matplotlib.pyplot as plt
 
-FORMAT = "iso-8859-1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import (FORMAT, STAMP, STAMP_HEADER, STAMPED, Framer, create_socket, receive_timestamped,
+                      set_timestamps)
+import udp_profile
 
 
 class UDPEchoClient:
-    def __init__(self, packet_size, address_info, interval, num_packets, message, do_graph):
+    def __init__(self, packet_size, address_info, interval, num_packets, message, do_graph, timeout=None,
+                 timestamps=False):
         # Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
-        # SOCK_DGRAM - Socket Type - UDP
-        self.client = socket.socket(address_info[0], socket.SOCK_DGRAM)
+        # A reply not in within the timeout is counted as lost instead of waited for forever
+        self.client = create_socket(address_info[0], timeout=timeout)
         self.packet_size = packet_size
+        self.framer = Framer(packet_size)
         self.interval = interval
         self.num_packets = num_packets
-        self.message = self.get_padded_message(message)
+        # Echoes stamped by the Server, the RTT split into the time on the way, in the Server and in the Client -
+        # from the kernel receive time of the echo, where there is one
+        self.timestamps = timestamps
+        self.kernel_timestamps = timestamps and set_timestamps(self.client, True)
+        self.buffer = bytearray(packet_size)
+        self.rtt_parts = {"Network": [], "Server": [], "Client": []}
+        # Padded once, sent as is every packet
+        self.message = self.framer.pad(f"Stamp {message}" if timestamps else message)
         self.do_graph = do_graph
         self.average_throughput = []
         self.average_delay = []
@@ -29,8 +44,7 @@ class UDPEchoClient:
         print(f"[PINGING] Pinging Server {server_socket} : bytes = {self.packet_size}")
         if self.packet_size != 64:
             print(f"[PACKET SIZE] Requesting Server {server_socket} for changing size to {self.packet_size}")
-            message = self.get_padded_message(f"Size {self.packet_size}")
-            self.client.sendto(message.encode(FORMAT), server_socket)
+            self.client.sendto(self.framer.pad(f"Size {self.packet_size}"), server_socket)
             # Receive message from server
             response, server_socket = self.client.recvfrom(self.packet_size)
             print(f"[PACKET SIZE] '{response.decode(FORMAT).strip()}' from {server_socket}")
@@ -39,12 +53,26 @@ class UDPEchoClient:
         for packet in range(self.num_packets):
             # Timestamp before sending message
             before_request = datetime.now()
-            self.client.sendto(self.message.encode(FORMAT), server_socket)
+            sent_at = time.time_ns()
+            self.client.sendto(self.message, server_socket)
             # Receive message from server
-            response, server_socket = self.client.recvfrom(self.packet_size)
+            try:
+                if self.timestamps:
+                    response, server_socket, received_at = receive_timestamped(self.client, self.buffer)
+                    woken_at = time.time_ns()
+                    response = bytes(response)
+                else:
+                    response, server_socket = self.client.recvfrom(self.packet_size)
+            except socket.timeout:
+                print(f"[TIMEOUT] Request timed out : packet = {packet}")
+                await asyncio.sleep(self.interval)
+                continue
             # Timestamp after receiving message
             after_response = datetime.now()
             rtt_time = (after_response - before_request).total_seconds() * 1000
+            message, parts = response, ''
+            if self.timestamps:
+                message, parts = self.split_rtt(response, sent_at, received_at, woken_at)
             rtt_values.append(rtt_time)
             throughput.append(self.packet_size * 8 / rtt_time)
 
@@ -52,28 +80,25 @@ class UDPEchoClient:
             self._delay_sec.append(rtt_time)
             self._throughput_sec.append(self.packet_size * 8 / rtt_time)
 
-            print(f"[MESSAGE RECEIVED] '{response.decode(FORMAT).strip()}' from {server_socket} : "
-                  f"bytes = {len(response)} time = {round(rtt_time, 4)} ms")
+            print(f"[MESSAGE RECEIVED] '{message.decode(FORMAT).strip()}' from {server_socket} : "
+                  f"bytes = {len(response)} time = {round(rtt_time, 4)} ms{parts}")
             num_received += 1
             await asyncio.sleep(self.interval)
 
         self.do_graph = False
         # Disconnect Message
         print(f"[TERMINATION] Requesting Server {server_socket} for disconnection")
-        self.client.sendto(self.get_padded_message("Disconnect").encode(FORMAT), server_socket)
-        response, server_socket = self.client.recvfrom(self.packet_size)
-        print(f"[TERMINATION] '{response.decode(FORMAT).strip()}' from {server_socket} : bytes = {len(response)}")
+        self.client.sendto(self.framer.pad("Disconnect"), server_socket)
+        try:
+            response, server_socket = self.client.recvfrom(self.packet_size)
+            print(f"[TERMINATION] '{response.decode(FORMAT).strip()}' from {server_socket} : bytes = {len(response)}")
+        except socket.timeout:
+            print(f"[TIMEOUT] No reply from Server {server_socket} to the disconnection")
 
         # Print Echo Statistics
         print()
         self.print_statistics(num_received, rtt_values, server_socket)
 
-    def get_padded_message(self, message):
-        message = message.encode(FORMAT)
-        if len(message) < self.packet_size:
-            message += b' ' * (self.packet_size - len(message))
-        return message.decode(FORMAT)
-
     def print_statistics(self, num_received, rtt_values, server_socket):
         """
         Print Ping like statistics
@@ -85,9 +110,44 @@ class UDPEchoClient:
         print(f"Echo Statistics for {server_socket}:")
         print(f"\t Packets : Sent = {self.num_packets + 1}, Received = {num_received + 1}, "
               f"Lost {self.num_packets - num_received} ({self.get_loss_percentage(num_received)}% Loss) ")
+        if not rtt_values:
+            return
         print("Approximate Round-Trip Times in milli-seconds (ms):")
         rtt_stats = self.rtt_statistics(rtt_values)
         print(f"\t Minimum = {rtt_stats[2]}ms, Maximum = {rtt_stats[1]}ms, Average = {rtt_stats[0]}ms")
+        if not self.rtt_parts["Network"]:
+            return
+        # Without a kernel receive time the Client time is counted as Network time
+        print(f"Round-Trip Time split in milli-seconds (ms){'' if self.kernel_timestamps else ', Client in Network'}:")
+        for name, values in self.rtt_parts.items():
+            part_stats = self.rtt_statistics(values)
+            print(f"\t {name:<7} : Minimum = {part_stats[2]}ms, Maximum = {part_stats[1]}ms, "
+                  f"Average = {part_stats[0]}ms")
+
+    def split_rtt(self, response, sent_at, received_at, woken_at):
+        """
+        Splits the RTT of a stamped echo, all times in ns since the epoch - the Server clock is only ever subtracted
+        from itself, so it need not be in sync with the Client clock
+        :param response: Bytes of the echo, `Stamped ` followed by the STAMP of the received and sent times and the
+                         message
+        :param sent_at: Time the request was sent
+        :param received_at: Time the kernel received the echo, None where there is none
+        :param woken_at: Time the Client read the echo
+        :return: (Bytes of the message echoed, string of the parts in ms - '' if the echo was not stamped)
+        """
+        # A stamp cut short by a Packet Size too small for it is no stamp at all
+        if len(response) < STAMP_HEADER or not response.startswith(STAMPED):
+            return response, ''
+        server_received, server_sent = STAMP.unpack_from(response, len(STAMPED))
+        if server_sent < server_received:
+            return response[STAMP_HEADER:], ''
+        arrived_at = received_at or woken_at
+        server = server_sent - server_received
+        parts = {"Network": arrived_at - sent_at - server, "Server": server, "Client": woken_at - arrived_at}
+        for name, value in parts.items():
+            self.rtt_parts[name].append(value / 1_000_000)
+        return response[STAMP_HEADER:], ' (' + ', '.join(
+            f"{name.lower()} = {round(value / 1_000_000, 4)}" for name, value in parts.items()) + ' ms)'
 
     def get_loss_percentage(self, num_received):
         return round(((self.num_packets - num_received) / self.num_packets * 100), 4)
@@ -168,11 +228,21 @@ if __name__ == '__main__':
                         help='UDP Echo Packet Size in Bytes', default=64)
     parser.add_argument('-t', '--interval', type=float, metavar="TIME",
                         help='UDP Echo Message Interval in sec', default=1)
+    parser.add_argument('-w', '--timeout', type=float, metavar="TIME",
+                        help='Time in sec to wait for a reply before counting it as lost, forever if not given')
     parser.add_argument('-g', '--graph', default=False, action='store_true', help="Enable iperf Graph for throughput "
                                                                                   "and delay")
+    parser.add_argument('--timestamps', action='store_true',
+                        help='Have the Server stamp its echoes and read kernel receive timestamps (SO_TIMESTAMPNS, '
+                             'Linux only), splitting the RTT into Network, Server and Client time')
     parser.set_defaults(graph=False)
+    udp_profile.add_arguments(parser)
 
     args = parser.parse_args()
+    # The stamped echo carries the Server times ahead of the whole message
+    if args.timestamps and args.size < STAMP_HEADER + len(args.message.encode(FORMAT)):
+        parser.error(f"--timestamps needs a Packet Size of at least {STAMP_HEADER + len(args.message.encode(FORMAT))} "
+                     f"Bytes for the stamp and the message")
     # Get IP for UDP
     address_info = socket.getaddrinfo(
         args.ip,
@@ -186,9 +256,12 @@ if __name__ == '__main__':
         interval=args.interval,
         message=args.message,
         num_packets=args.num_packets,
-        do_graph=args.graph
+        do_graph=args.graph,
+        timeout=args.timeout,
+        timestamps=args.timestamps
     )
 
+    udp_profile.from_arguments(args, client)
     loop = asyncio.get_event_loop()
 
     loop.run_until_complete(
@@ -0,0 +1,101 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+
+from server import UDPEchoServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import udp_log
+
+# Name -> (Level, background writer, per datagram sampling)
+MODES = {
+    "off": (udp_log.INFO, True, 1),
+    "sampled": (udp_log.DEBUG, True, 100),
+    "async": (udp_log.DEBUG, True, 1),
+    "sync": (udp_log.DEBUG, False, 1),
+}
+
+
+def serve(port, packet_size, mode, log_path):
+    """
+    Entry point of the Server process, logging as the mode says
+    """
+    level, background, every = MODES[mode]
+    log = udp_log.Logger(level=level, stream=open(log_path, "a"), background=background,
+                         sample={"MESSAGE RECEIVED": every} if every > 1 else None)
+    address_info = socket.getaddrinfo("127.0.0.1", port, proto=socket.IPPROTO_UDP)[0]
+    UDPEchoServer(address_info=address_info, packet_size=packet_size, log=log).client_handler()
+
+
+def blast(server_socket, packet_size, duration, window):
+    """
+    Keeps a window of echo requests in flight for the duration
+    :return: Echoes received per sec
+    """
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(0.2)
+    message = b"benchmark".ljust(packet_size)
+    received = 0
+    began = time.perf_counter()
+    deadline = began + duration
+    for _ in range(window):
+        client.sendto(message, server_socket)
+    while time.perf_counter() < deadline:
+        try:
+            client.recvfrom(packet_size)
+            received += 1
+            client.sendto(message, server_socket)
+        except socket.timeout:
+            # Lost echoes - refill the window
+            for _ in range(window):
+                client.sendto(message, server_socket)
+    elapsed = time.perf_counter() - began
+    client.close()
+    return received / elapsed
+
+
+def run(mode, port, packet_size, duration, window, log_path):
+    """
+    :return: (Echoes per sec, Log Lines written - None if not logging to a file) with the Server logging in the mode
+    """
+    to_file = not os.path.exists(log_path) or os.path.isfile(log_path)
+    if to_file:
+        open(log_path, "w").close()
+    server = multiprocessing.Process(target=serve, args=(port, packet_size, mode, log_path), daemon=True)
+    server.start()
+    # Let the Server bind
+    time.sleep(0.5)
+    throughput = blast(("127.0.0.1", port), packet_size, duration, window)
+    server.terminate()
+    server.join()
+    if not to_file:
+        return throughput, None
+    with open(log_path) as log:
+        return throughput, sum(1 for _ in log)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UDP Echo Server throughput with per datagram logging on and off',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-m', '--modes', nargs='+', choices=MODES, help='Logging modes to compare',
+                        default=list(MODES))
+    parser.add_argument('-d', '--duration', type=float, help='Time in sec every mode is driven for', default=3)
+    parser.add_argument('-w', '--window', type=int, help='Echo requests kept in flight', default=32)
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER", help='First Port to use', default=17976)
+    parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE",
+                        help='UDP Echo Packet Size in Bytes', default=64)
+    parser.add_argument('--log-file', type=str, metavar="FILE",
+                        help='File the Server logs to, a temporary one if not given (try /dev/tty)')
+
+    args = parser.parse_args()
+    log_file = args.log_file or os.path.join(tempfile.mkdtemp(), "echo.log")
+
+    print(f"{'Mode':>8} {'Echoes/s':>10} {'Log Lines':>10}")
+    for run_id, log_mode in enumerate(args.modes):
+        # Fresh ports every run, the sockets of the previous run may linger
+        echoes, log_lines = run(log_mode, args.port + run_id, args.size, args.duration, args.window, log_file)
+        print(f"{log_mode:>8} {echoes:>10.0f} {'-' if log_lines is None else log_lines:>10}")
@@ -1,63 +1,116 @@
 import argparse
+import os
 import socket
+import sys
+import time
 
-FORMAT = "iso-8859-1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import (STAMP, STAMPED, BufferPool, Dispatcher, Framer, create_socket, opcode, receive,
+                      receive_timestamped, set_timestamps, text)
+import udp_log
+import udp_metrics
+import udp_profile
 
 
 class UDPEchoServer:
-    def __init__(self, address_info, packet_size):
+    def __init__(self, address_info, packet_size, log=None, registry=None, timestamps=False):
         self.server = None
+        # Per datagram records are DEBUG, off unless asked for
+        self.log = log or udp_log.Logger()
+        self.registry = registry or udp_metrics.Registry()
         self.socket = (address_info[4][0], address_info[4][1])
         self.packet_size = packet_size
         self.address_info = address_info
+        self.buffers = BufferPool(packet_size)
+        self.framer = Framer(packet_size)
+        self.is_new_client = True
+        # Kernel receive time in ns of the datagram handled, read only when asked for - a recvmsg costs more
+        self.timestamps = timestamps
+        self.received_at = None
+        # Anything without a command of its own is echoed back as received
+        self.commands = Dispatcher(default=self.echo)
+        self.commands.register("hello", self.hello)
+        self.commands.register("stamp", self.stamp)
+        self.commands.register("size", self.change_size)
+        self.commands.register("disconnect", self.disconnect)
+        self.traffic = udp_metrics.TrafficMetrics(self.registry, self.commands.handlers)
+        udp_metrics.add_socket(self.registry, lambda: self.server)
+        udp_metrics.add_log(self.registry, self.log)
         self.initiate_server()
 
     def initiate_server(self):
         # Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
-        # SOCK_DGRAM - Socket Type - UDP
-        self.server = socket.socket(self.address_info[0], socket.SOCK_DGRAM)
         # Port Bind the socket to the port
-        self.server.bind(self.socket)
-        print(f'[SERVER INITIATED] UDP ECHO Server on {self.socket}')
+        self.server = create_socket(self.address_info[0], self.socket)
+        self.timestamps = self.timestamps and set_timestamps(self.server, True)
+        self.log.info("SERVER INITIATED", server="UDP ECHO", address=self.socket, timestamps=self.timestamps)
 
     def client_handler(self):
-        num_packets = 0
-        is_new_client = True
+        buffer = self.buffers.acquire()
         while True:
-            data, client_socket = self.server.recvfrom(self.packet_size)
-            if is_new_client:
-                print(f"[NEW CONNECTION] Client {client_socket} connected to server")
-                is_new_client = False
-            data = data.decode(FORMAT)
+            if self.timestamps:
+                data, client_socket, self.received_at = receive_timestamped(self.server, buffer, self.packet_size)
+            else:
+                data, client_socket = receive(self.server, buffer, self.packet_size)
+            if self.is_new_client:
+                self.log.info("NEW CONNECTION", client=client_socket)
+                self.is_new_client = False
             if data:
-                num_packets += 1
-                print(f"[MESSAGE RECEIVED] '{data.strip()}' from {client_socket} : bytes = {len(data)}")
-                response = ""
-                # Client Hello
-                if data.lower().strip() == "hello server":
-                    response = self.get_padded_message("Hello Client")
-
-                # Packet Size Change
-                elif data.lower()[:4] == "size":
-                    self.packet_size = int(data.split()[1])
-                    response = self.get_padded_message(f"New Size - {self.packet_size}")
-                    print(f"[PACKET SIZE] - New Packet Size - {self.packet_size}")
-
-                elif data.lower().strip() == "disconnect":
-                    response = self.get_padded_message("Disconnected")
-                    print(f"[TERMINATION] - Client {client_socket} disconnected")
-                    is_new_client = True
-
-                # Reply the Same Message Back
-                else:
-                    response = data
-                self.server.sendto(response.encode(FORMAT), client_socket)
-
-    def get_padded_message(self, message):
-        message = message.encode(FORMAT)
-        if len(message) < self.packet_size:
-            message += b' ' * (self.packet_size - len(message))
-        return message.decode(FORMAT)
+                command = opcode(data)
+                if self.log.enabled(udp_log.DEBUG):
+                    self.log.debug("MESSAGE RECEIVED", command=command, client=client_socket, bytes=len(data))
+                started = self.traffic.received(command, len(data))
+                self.commands.handler(command)(data, client_socket)
+                self.traffic.handled(started)
+            # A Packet Size Change swaps the pool for larger or smaller buffers
+            if len(buffer) != self.buffers.buffer_size:
+                self.buffers.release(buffer)
+                buffer = self.buffers.acquire()
+
+    def echo(self, data, client_socket):
+        # Reply the Same Message Back, straight from the receive buffer
+        self.sendto(data, client_socket)
+
+    def stamp(self, data, client_socket):
+        """
+        Stamp <message> - echoed as `Stamped ` followed by the STAMP of the received and sent times in ns since the
+        epoch, then the message, padded to the length of the request. Received is when the kernel got the datagram
+        where the server reads timestamps, when it was handled otherwise, so the Client tells the time spent in the
+        Server from the time spent on the way. The message is never cut, a reply too long for the request is sent
+        whole
+        """
+        received = self.received_at or time.time_ns()
+        message = bytes(data[len(b"Stamp "):]).rstrip(b' ')
+        sent = time.time_ns()
+        reply = STAMPED + STAMP.pack(received, sent) + message
+        self.sendto(reply.ljust(len(data)), client_socket)
+
+    def send(self, message, client_socket):
+        self.sendto(self.framer.frame(message), client_socket)
+
+    def sendto(self, data, client_socket):
+        self.server.sendto(data, client_socket)
+        self.traffic.sent(len(data))
+
+    def hello(self, data, client_socket):
+        # Client Hello
+        if text(data).lower() == "hello server":
+            self.send("Hello Client", client_socket)
+        else:
+            self.echo(data, client_socket)
+
+    def change_size(self, data, client_socket):
+        # Packet Size Change
+        self.packet_size = int(text(data).split()[1])
+        self.buffers.resize(self.packet_size)
+        self.framer.packet_size = self.packet_size
+        self.send(f"New Size - {self.packet_size}", client_socket)
+        self.log.info("PACKET SIZE", size=self.packet_size)
+
+    def disconnect(self, data, client_socket):
+        self.log.info("TERMINATION", client=client_socket)
+        self.is_new_client = True
+        self.send("Disconnected", client_socket)
 
 
 if __name__ == '__main__':
@@ -71,6 +124,12 @@ if __name__ == '__main__':
                         help='UDP Echo Server Port Number to Port Bind to', default=7777)
     parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE",
                         help='UDP Echo Packet Size in Bytes', default=64)
+    parser.add_argument('--timestamps', action='store_true',
+                        help='Read the kernel receive time of every datagram (SO_TIMESTAMPNS, Linux only) for the '
+                             'Stamp replies, so the time a request waited in the socket counts as Server time')
+    udp_log.add_arguments(parser)
+    udp_metrics.add_arguments(parser)
+    udp_profile.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -80,5 +139,10 @@ if __name__ == '__main__':
         proto=socket.IPPROTO_UDP
     )[0]
 
-    server = UDPEchoServer(address_info=address_info, packet_size=args.size)
+    server = UDPEchoServer(address_info=address_info, packet_size=args.size,
+                           log=udp_log.from_arguments(args, packet_events=("MESSAGE RECEIVED",)),
+                           timestamps=args.timestamps)
+    if args.metrics_port:
+        udp_metrics.serve(server.registry, args.metrics_port)
+    udp_profile.from_arguments(args, server)
     server.client_handler()
@@ -0,0 +1,139 @@
+import collections
+import threading
+
+# Bytes of a file cached together
+BLOCK_SIZE = 1 << 18
+
+# Blocks read from the cache, read from disk into it, and read from disk past it
+OUTCOMES = ("hit", "miss", "bypass")
+
+
+class BlockCache:
+    def __init__(self, capacity, block_size=BLOCK_SIZE):
+        """
+        Least recently used blocks of the files served, shared by every transfer
+
+        Keyed by (path, modification time, block) so a file rewritten is read afresh and its old blocks age out. A
+        file larger than half the capacity is read straight from disk - a single pass over it would otherwise evict
+        every block of the hot files for blocks not read again
+        :param capacity: Most Bytes cached, 0 to cache none
+        :param block_size: Bytes of a file cached together
+        """
+        self.capacity = capacity
+        self.block_size = block_size
+        # (Path, Modification Time in ns, Block) -> Bytes, least recently used first
+        self.blocks = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(OUTCOMES, 0)
+        self.evictions = 0
+
+    def open(self, path, size, mtime):
+        """
+        :param path: Path of the file
+        :param size: File Size in Bytes
+        :param mtime: Modification Time in ns
+        :return: File-like object opened for reading in binary, with readinto and tell
+        """
+        if size > self.capacity // 2:
+            self.stats["bypass"] += -(-size // self.block_size)
+            return open(path, 'rb')
+        return CachedFile(self, path, size, mtime)
+
+    def get(self, key):
+        """
+        :return: Bytes of the block, None if it is not cached
+        """
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is None:
+                self.stats["miss"] += 1
+            else:
+                self.blocks.move_to_end(key)
+                self.stats["hit"] += 1
+            return block
+
+    def put(self, key, block):
+        with self.lock:
+            if key in self.blocks:
+                return
+            self.blocks[key] = block
+            self.size += len(block)
+            while self.size > self.capacity:
+                _, old = self.blocks.popitem(last=False)
+                self.size -= len(old)
+                self.evictions += 1
+
+
+class CachedFile:
+    def __init__(self, cache, path, size, mtime):
+        """
+        A file read through the BlockCache - opened only once a block is not cached
+        """
+        self.cache = cache
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.position = 0
+        self.file = None
+        # Block read last, most reads fall within it
+        self.index = -1
+        self.start = 0
+        self.block = memoryview(b'')
+
+    def readinto(self, buffer):
+        """
+        :param buffer: Writable Bytes-like object
+        :return: int - Bytes read, 0 at the end of the file
+        """
+        # Within the block read last, the common case
+        offset = self.position - self.start
+        end = offset + len(buffer)
+        if offset >= 0 and end <= len(self.block):
+            buffer[:] = self.block[offset:end]
+            self.position += len(buffer)
+            return len(buffer)
+        block_size = self.cache.block_size
+        total = 0
+        while total < len(buffer) and self.position < self.size:
+            index, offset = divmod(self.position, block_size)
+            if index != self.index:
+                self.block = memoryview(self.load(index))
+                self.index = index
+                self.start = index * block_size
+            num_bytes = min(len(buffer) - total, len(self.block) - offset)
+            if num_bytes <= 0:
+                # The file shrank since it was listed
+                break
+            buffer[total:total + num_bytes] = self.block[offset:offset + num_bytes]
+            total += num_bytes
+            self.position += num_bytes
+        return total
+
+    def load(self, index):
+        key = (self.path, self.mtime, index)
+        block = self.cache.get(key)
+        if block is None:
+            block_size = self.cache.block_size
+            if self.file is None:
+                self.file = open(self.path, 'rb')
+            self.file.seek(index * block_size)
+            block = self.file.read(block_size)
+            # A block cut short by the file changing meanwhile is not kept
+            if len(block) == min(block_size, self.size - index * block_size):
+                self.cache.put(key, block)
+        return block
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,314 @@
+import bisect
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import queue
+import struct
+import threading
+import time
+
+# inotify(7) events of linux/inotify.h
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+WATCHED = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+          IN_MOVE_SELF
+# Watch Descriptor, Mask, Cookie, Name Length
+EVENT = struct.Struct("iIII")
+
+# Bytes read from a file at a time for its hash
+HASH_BLOCK = 1 << 20
+
+
+class Entry:
+    __slots__ = ("size", "mtime", "digest")
+
+    def __init__(self, size, mtime, digest=None):
+        """
+        :param size: File Size in Bytes
+        :param mtime: Modification Time in ns
+        :param digest: SHA-256 hex digest of the contents, None until hashed
+        """
+        self.size = size
+        self.mtime = mtime
+        self.digest = digest
+
+
+class Inotify:
+    def __init__(self):
+        """
+        inotify(7) through the C library - Linux only
+        :raises OSError: Where there is no inotify
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("no inotify")
+        self.libc = libc
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+
+    def add(self, path):
+        """
+        :return: int - Watch Descriptor of the directory, -1 if it could not be watched
+        """
+        return self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCHED | IN_ONLYDIR)
+
+    def read(self):
+        """
+        Blocks until there are events
+        :return: list of (Watch Descriptor, Mask, Name)
+        """
+        data = os.read(self.fd, 1 << 16)
+        events = []
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((descriptor, mask, name))
+        return events
+
+
+class Catalog:
+    def __init__(self, root, hashes=False, interval=1.0, watch=True):
+        """
+        In memory index of the files served from a directory and its subdirectories
+
+        A download looks its file up instead of listing the directory, and a `List` reads a page of the sorted
+        names. Kept up to date from a background thread - by inotify, which names the changed file, or where there
+        is none by polling the modification time of every directory, which only changes when a file is added,
+        removed or renamed. A lookup while polling stats the one file to catch contents rewritten in place
+        :param root: Directory served
+        :param hashes: True to hash the contents of every file on a background thread
+        :param interval: Time in sec between polls of the directories
+        :param watch: False to poll even where there is inotify
+        """
+        self.root = root
+        self.interval = interval
+        # Relative path, / separated -> Entry, along with the paths sorted for the pages
+        self.entries = {}
+        self.names = []
+        # Relative path of every directory -> Modification Time in ns, '' for the root
+        self.directories = {}
+        self.lock = threading.Lock()
+        self.hashes = queue.Queue() if hashes else None
+        self.rescans = 0
+        self.inotify = None
+        self.watches = {}
+        if watch:
+            try:
+                self.inotify = Inotify()
+            except OSError:
+                self.inotify = None
+        self.scan('')
+        threading.Thread(target=self.watch_loop if self.inotify else self.poll_loop, daemon=True).start()
+        if self.hashes is not None:
+            threading.Thread(target=self.hash_loop, daemon=True).start()
+
+    @property
+    def mode(self):
+        return "inotify" if self.inotify else "poll"
+
+    def path(self, name):
+        return os.path.join(self.root, *name.split('/')) if name else self.root
+
+    def lookup(self, name):
+        """
+        :param name: Relative path of the file, / separated
+        :return: Entry, None if there is no such file
+        """
+        entry = self.entries.get(name)
+        if entry is not None and self.inotify is None:
+            entry = self.refresh(name)
+        return entry
+
+    def page(self, directory='', start=0, count=None):
+        """
+        :param directory: Relative path of a directory, its subdirectories included - '' for every file
+        :param start: Index of the first file
+        :param count: Most files, every one after the start if None
+        :return: (list of (Relative path, Entry), Total files in the directory)
+        """
+        with self.lock:
+            if directory:
+                prefix = directory.strip('/') + '/'
+                # '0' follows '/', the first name past the directory
+                low = bisect.bisect_left(self.names, prefix)
+                high = bisect.bisect_left(self.names, prefix[:-1] + '0')
+            else:
+                low, high = 0, len(self.names)
+            end = high if count is None else min(high, low + start + count)
+            return [(name, self.entries[name]) for name in self.names[low + start:end]], high - low
+
+    def __len__(self):
+        return len(self.entries)
+
+    def scan(self, directory, recursive=True):
+        """
+        Indexes the directory afresh
+        :param recursive: False to leave the subdirectories already indexed as they are, the new ones are scanned
+        """
+        self.rescans += 1
+        found = {}
+        subdirectories = []
+        try:
+            directory_mtime = os.stat(self.path(directory)).st_mtime_ns
+            if self.inotify is not None:
+                watch = self.inotify.add(self.path(directory))
+                if watch >= 0:
+                    self.watches[watch] = directory
+            with os.scandir(self.path(directory)) as listing:
+                for item in listing:
+                    name = f"{directory}/{item.name}" if directory else item.name
+                    if item.is_dir(follow_symlinks=False):
+                        subdirectories.append(name)
+                    elif item.is_file():
+                        stat = item.stat()
+                        found[name] = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            self.remove_directory(directory)
+            return
+        with self.lock:
+            self.directories[directory] = directory_mtime
+            for name in [name for name in self.files_in(directory) if name not in found]:
+                self.discard(name)
+            for name, (size, mtime) in found.items():
+                self.put(name, size, mtime)
+            # Subdirectories gone since the last scan
+            for gone in [path for path in self.directories if self.parent(path) == directory and path and
+                         path not in subdirectories]:
+                self.remove_directory(gone, locked=True)
+        for subdirectory in subdirectories:
+            if recursive or subdirectory not in self.directories:
+                self.scan(subdirectory)
+
+    @staticmethod
+    def parent(name):
+        return name.rsplit('/', 1)[0] if '/' in name else ''
+
+    def files_in(self, directory):
+        """
+        :return: list of the files right in the directory, not in its subdirectories
+        """
+        if not directory:
+            return [name for name in self.names if '/' not in name]
+        prefix = directory + '/'
+        low = bisect.bisect_left(self.names, prefix)
+        high = bisect.bisect_left(self.names, directory + '0')
+        return [name for name in self.names[low:high] if '/' not in name[len(prefix):]]
+
+    def refresh(self, name):
+        """
+        Stats a single file and updates its entry
+        :return: Entry, None if the file is gone
+        """
+        try:
+            stat = os.stat(self.path(name))
+        except OSError:
+            with self.lock:
+                self.discard(name)
+            return None
+        with self.lock:
+            return self.put(name, stat.st_size, stat.st_mtime_ns)
+
+    def put(self, name, size, mtime):
+        entry = self.entries.get(name)
+        if entry is not None and entry.size == size and entry.mtime == mtime:
+            return entry
+        if entry is None:
+            bisect.insort(self.names, name)
+        entry = self.entries[name] = Entry(size, mtime)
+        if self.hashes is not None:
+            self.hashes.put(name)
+        return entry
+
+    def discard(self, name):
+        if self.entries.pop(name, None) is not None:
+            del self.names[bisect.bisect_left(self.names, name)]
+
+    def remove_directory(self, directory, locked=False):
+        if not locked:
+            with self.lock:
+                return self.remove_directory(directory, locked=True)
+        prefix = directory + '/'
+        for name in [name for name in self.entries if name.startswith(prefix)]:
+            self.discard(name)
+        for path in [path for path in self.directories if path == directory or path.startswith(prefix)]:
+            del self.directories[path]
+        for watch in [watch for watch, path in self.watches.items() if path == directory or path.startswith(prefix)]:
+            del self.watches[watch]
+
+    def watch_loop(self):
+        while True:
+            try:
+                events = self.inotify.read()
+            except OSError:
+                time.sleep(self.interval)
+                continue
+            for watch, mask, file_name in events:
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost, every directory is scanned again
+                    self.scan('')
+                    continue
+                directory = self.watches.get(watch)
+                if directory is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(watch, None)
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF) or not file_name:
+                    continue
+                name = f"{directory}/{file_name}" if directory else file_name
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.scan(name)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self.remove_directory(name)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    with self.lock:
+                        self.discard(name)
+                else:
+                    self.refresh(name)
+
+    def poll_loop(self):
+        while True:
+            time.sleep(self.interval)
+            for directory, mtime in list(self.directories.items()):
+                try:
+                    changed = os.stat(self.path(directory)).st_mtime_ns != mtime
+                except OSError:
+                    changed = True
+                if changed and directory in self.directories:
+                    self.scan(directory, recursive=False)
+
+    def hash_loop(self):
+        while True:
+            name = self.hashes.get()
+            entry = self.entries.get(name)
+            if entry is None or entry.digest is not None:
+                continue
+            digest = hashlib.sha256()
+            try:
+                with open(self.path(name), 'rb') as file:
+                    while True:
+                        block = file.read(HASH_BLOCK)
+                        if not block:
+                            break
+                        digest.update(block)
+            except OSError:
+                continue
+            # Kept only if the file did not change while hashed
+            if self.entries.get(name) is entry:
+                entry.digest = digest.hexdigest()
@@ -1,29 +1,51 @@
 import argparse
 import os
 import socket
+import sys
 import time
 
-FORMAT = "iso-8859-1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import (FORMAT, MAX_OFFLOAD, BufferPool, Framer, SegmentSender, create_socket, opcode,
+                      receive_segments, set_gro, text)
+import udp_profile
+from fec import FecDecoder, FecEncoder, pack
+
+MEGA_BYTE = 1 << 20
+# Bytes per sec the file chunks are sent at by default
+RATE = 8 * MEGA_BYTE
+
 
 class FileTransferClient:
-    def __init__(self, packet_size, address_info, up_or_down, file_paths):
+    def __init__(self, packet_size, address_info, up_or_down, file_paths, offload=False, fec=False, listing=None,
+                 rate=RATE):
         # Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
-        # SOCK_DGRAM - Socket Type - UDP
-        self.client = socket.socket(address_info[0], socket.SOCK_DGRAM)
+        self.client = create_socket(address_info[0])
         self.packet_size = packet_size
+        # File chunks sent a block at a time with UDP GSO, and received coalesced with UDP GRO, where there are -
+        # paced by their Bytes, a GSO block waits only as long as its datagrams sent one by one would
+        self.sender = SegmentSender(self.client, packet_size, offload=offload, rate=rate)
+        self.buffers = BufferPool(packet_size * self.sender.batch, count=1)
+        self.gro_buffer = bytearray(MAX_OFFLOAD) if self.sender.offload else None
+        self.framer = Framer(packet_size)
         self.up_or_down = up_or_down  # 1 - Upload 2 - Download
         self.file_paths = file_paths
+        # Parity sent along with the chunks, sized by the loss the Server reports after every file - None for none
+        self.fec = FecEncoder(packet_size) if fec else None
+        # Directory of the Server whose files are listed, '' for every file - None to list none
+        self.listing = listing
 
     def server_handler(self, server_socket):
         print(f"[PINGING] Pinging Server {server_socket} : bytes = {self.packet_size}")
         if self.packet_size != 4096:
             print(f"[PACKET SIZE] Requesting Server {server_socket} for changing size to {self.packet_size}")
-            message = self.pad(f"Size {self.packet_size}")
-            self.client.sendto(message.encode(FORMAT), server_socket)
+            self.send(f"Size {self.packet_size}", server_socket)
             # Receive message from server
             response, server_socket = self.client.recvfrom(self.packet_size)
             print(f"[PACKET SIZE] '{response.decode(FORMAT).strip()}' from {server_socket}")
 
+        if self.listing is not None:
+            self.list_files(self.listing, server_socket)
+
         for file_path in self.file_paths:
             if self.up_or_down:
                 self.upload(file_path, server_socket)
@@ -32,7 +54,7 @@ class FileTransferClient:
 
         # Disconnect Message
         print(f"[TERMINATION] Requesting Server {server_socket} for disconnection")
-        self.client.sendto(self.pad("Disconnect").encode(FORMAT), server_socket)
+        self.send("Disconnect", server_socket)
         response, server_socket = self.client.recvfrom(self.packet_size)
         print(f"[TERMINATION] '{response.decode(FORMAT).strip()}' from {server_socket} : bytes = {len(response)}")
 
@@ -40,37 +62,79 @@ class FileTransferClient:
         # Send the File Name
         file_name = os.path.basename(file_path)
         file_size = os.path.getsize(file_path)
-        message = self.pad(f"Upload {file_name} {file_size}")
         print(f"[FILE UPLOAD] Requesting Server {server_socket} for Sending File - '{file_name}'")
-        self.client.sendto(message.encode(FORMAT), server_socket)
+        self.send(f"Upload {file_name} {file_size}{' FEC' if self.fec else ''}", server_socket)
         response, server_socket = self.client.recvfrom(self.packet_size)
         response = response.decode(FORMAT).strip()
         if response.lower() == "waiting":
             print(f"[FILE UPLOAD] Server Accepted - '{response}' from {server_socket}")
             print(f"[FILE UPLOAD] Sending File - '{os.path.basename(file_path)}' to Server {server_socket}")
-            # Read the contents of the file.
+            if self.fec:
+                print(f"[FILE UPLOAD] {self.fec.parities} parity chunks per {self.fec.group_size} chunks - "
+                      f"{self.fec.loss:.2%} loss expected")
+            buffer = self.buffers.acquire()
+            # Read the contents of the file, a block of as many chunks as a single send takes
             with open(file_path, mode='rb') as file:
-                while True:
-                    contents = file.read(self.packet_size)
-                    if not contents:
-                        break
-                    # Send Contents to Server
-                    time.sleep(0.1)
-                    self.client.sendto(contents, server_socket)
-            file.close()
-        self.client.sendto(self.pad(f"Upload Done").encode(FORMAT), server_socket)
+                for block in self.blocks_of(file, buffer):
+                    # Send Contents to Server, paced at the rate however they are sent
+                    self.sender.send(block, server_socket)
+            self.buffers.release(buffer)
+        self.send("Upload Done", server_socket)
         response, server_socket = self.client.recvfrom(self.packet_size)
+        # Done or Corrupted, followed by the datagrams lost and sent with FEC
+        fields = response.decode(FORMAT).lower().split()
+        if self.fec and len(fields) == 3:
+            self.fec.update(int(fields[1]), int(fields[2]))
+            print(f"[FILE UPLOAD] Server lost {fields[1]} of {fields[2]} datagrams")
 
-        if response.decode(FORMAT).strip().lower() != "done":
+        if fields[:1] != ["done"]:
             print(f"[FILE UPLOAD] '{file_name}' upload is corrupted. Resending the file to Server")
             self.upload(file_path, server_socket)
         else:
             print(f"[FILE UPLOAD] '{file_name}' is uploaded to Server")
 
+    def blocks_of(self, file, buffer):
+        """
+        :return: generator of memoryview of the next chunks of the file back to back in the buffer, FEC framed and
+                 followed by their parity if asked for
+        """
+        if self.fec:
+            yield from pack(self.fec.frames(file), buffer, self.packet_size)
+            return
+        block = memoryview(buffer)
+        while True:
+            num_bytes = file.readinto(block)
+            if not num_bytes:
+                return
+            yield block[:num_bytes]
+
+    def list_files(self, directory, server_socket):
+        """
+        Reads the listing of the Server a page at a time, each as many files as a datagram holds
+        """
+        print(f"[FILE LIST] Requesting Server {server_socket} for the Files in '{directory or '/'}'")
+        start = 0
+        while True:
+            self.send(f"List {start} {directory}".rstrip(), server_socket)
+            response, server_socket = self.client.recvfrom(self.packet_size * 2)
+            lines = response.decode(FORMAT).rstrip('\0').strip().split('\n')
+            header = lines[0].split()
+            if len(header) != 4 or header[0].lower() != "files":
+                print(f"'{lines[0]}' from {server_socket}")
+                return
+            end, total = int(header[2]), int(header[3])
+            for line in lines[1:]:
+                name, size, mtime, digest = line.rsplit(' ', 3)
+                print(f"{name:<40} {int(size):>12} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(int(mtime)))}"
+                      f"{' ' + digest if digest != '-' else ''}")
+            if end >= total or end <= start:
+                break
+            start = end
+        print(f"[FILE LIST] {total} Files on Server {server_socket}")
+
     def download(self, file_name, server_socket):
-        message = self.pad(f"Download {file_name}")
         print(f"[FILE DOWNLOAD] Requesting Server {server_socket} for Receiving File - '{file_name}'")
-        self.client.sendto(message.encode(FORMAT), server_socket)
+        self.send(f"Download {file_name}{' FEC' if self.fec else ''}", server_socket)
         response, server_socket = self.client.recvfrom(self.packet_size)
         response = response.decode(FORMAT).strip()
 
@@ -80,34 +144,59 @@ class FileTransferClient:
 
         elif response.lower().split()[0] == "sending":
             file_size = int(response.split()[-1])
-            message = self.pad("Waiting")
-            self.client.sendto(message.encode(FORMAT), server_socket)
+            # Coalesced receives only for the chunks, the replies are read a datagram at a time
+            gro = self.sender.offload and set_gro(self.client, True)
+            self.send("Waiting", server_socket)
             print(f"[FILE DOWNLOAD] Server {server_socket} sending file '{file_name}'")
-            file = open(os.path.join("Client_Receive", file_name), "wb")
+            # Files of the subdirectories of the Server land in the same subdirectories
+            file_path = os.path.join("Client_Receive", *file_name.split('/'))
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            file = open(file_path, "wb")
+            # Chunks written where they belong in the file, the lost ones rebuilt from the parity
+            decoder = FecDecoder(file, file_size, self.packet_size) if self.fec else None
             bytes_wrote = 0
-            while True:
-                data, server_socket = self.client.recvfrom(self.packet_size)
-                if data.decode(FORMAT).strip().lower() == 'upload done':
-                    if bytes_wrote < file_size:
-                        print(f"[FILE DOWNLOAD] {file_name} corrupted. Requesting Server {server_socket} for Resend")
-                        response = self.pad("Corrupted")
-                    else:
-                        print(f"[FILE DOWNLOAD] File download '{file_name}' from {server_socket} complete")
-                        response = self.pad("Done")
-
-                    self.client.sendto(response.encode(FORMAT), server_socket)
-                    break
-
-                file.write(data)
-                bytes_wrote += len(data)
+            buffer = self.gro_buffer if gro else self.buffers.acquire()
+            done = False
+            while not done:
+                chunks, server_socket = receive_segments(self.client, buffer, gro, self.packet_size)
+                for data in chunks:
+                    # Only a chunk starting like the end marker is decoded
+                    if opcode(data) == b"upload" and text(data).lower() == 'upload done':
+                        loss = ''
+                        if decoder is not None:
+                            complete = not decoder.close()
+                            lost, expected = decoder.lost()
+                            loss = f" {lost} {expected}"
+                            print(f"[FILE DOWNLOAD] Lost {lost} of {expected} datagrams, rebuilt {decoder.rebuilt} "
+                                  f"chunks")
+                        else:
+                            complete = bytes_wrote >= file_size
+                        if not complete:
+                            print(f"[FILE DOWNLOAD] {file_name} corrupted. Requesting Server {server_socket} for "
+                                  f"Resend")
+                            response = "Corrupted"
+                        else:
+                            print(f"[FILE DOWNLOAD] File download '{file_name}' from {server_socket} complete")
+                            response = "Done"
+
+                        self.send(response + loss, server_socket)
+                        done = True
+                        break
+
+                    if decoder is not None:
+                        decoder.add(data)
+                        continue
+                    file.write(data)
+                    bytes_wrote += len(data)
 
+            if gro:
+                set_gro(self.client, False)
+            else:
+                self.buffers.release(buffer)
             file.close()
 
-    def pad(self, message):
-        message = message.encode(FORMAT)
-        if len(message) < self.packet_size:
-            message += b' ' * (self.packet_size - len(message))
-        return message.decode(FORMAT)
+    def send(self, message, server_socket):
+        self.framer.send(self.client, message, server_socket)
 
 
 if __name__ == '__main__':
@@ -126,7 +215,20 @@ if __name__ == '__main__':
     file_transfer_parser.add_argument('-u', '--upload', nargs='+', help='Upload Specified File(s) to Server',
                                       metavar="FILE_PATH")
     file_transfer_parser.add_argument('-d', '--download', nargs='+',  metavar="FILE_PATH",
-                                      help='Download Specified File(s) (if any) from Server')
+                                      help='Download Specified File(s) (if any) from Server, by their path in the '
+                                           'Server directory')
+    file_transfer_parser.add_argument('-l', '--list', nargs='?', const='', metavar="DIRECTORY",
+                                      help='List the Files on Server, those in the Directory and its subdirectories '
+                                           'if given')
+    parser.add_argument('--offload', action='store_true',
+                        help='Send the file chunks with UDP GSO and receive them with UDP GRO, Linux only - falls back '
+                             'to a datagram per syscall where the kernel has neither')
+    parser.add_argument('--rate', type=float, metavar="MB", default=RATE / MEGA_BYTE,
+                        help='MB per sec the file chunks are sent at, 0 for as fast as the socket takes them')
+    parser.add_argument('--fec', action='store_true',
+                        help='Send XOR parity along with the chunks, either way, so the receiver rebuilds lost ones '
+                             'instead of the whole file being resent')
+    udp_profile.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -137,13 +239,18 @@ if __name__ == '__main__':
         proto=socket.IPPROTO_UDP
     )[0]
 
-    file_paths = args.upload if args.upload else args.download
+    file_paths = args.upload or args.download or []
 
     client = FileTransferClient(
         packet_size=args.size,
         address_info=address_info,
         file_paths=file_paths,
-        up_or_down=bool(args.upload)
+        up_or_down=bool(args.upload),
+        offload=args.offload,
+        fec=args.fec,
+        listing=args.list,
+        rate=args.rate * MEGA_BYTE or None
     )
 
+    udp_profile.from_arguments(args, client)
     client.server_handler(server_socket=(address_info[4][0], address_info[4][1]))
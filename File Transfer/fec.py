@@ -0,0 +1,245 @@
+import math
+import struct
+
+import numpy as np
+
+# Group, Index in the group - data chunks first, then the parity chunks - Data chunks per group, Parity chunks per group
+HEADER = struct.Struct("!IBBBx")
+
+# Data chunks per group, and the most parity chunks
+GROUP_SIZE = 16
+
+# Share of the data chunks the parity is sized to leave unrecoverable
+RESIDUAL_LOSS = 1e-3
+
+# Weight of the loss seen by the latest transfer in the estimate
+SMOOTHING = 0.5
+
+
+def residual_loss(loss, group_size, parities):
+    """
+    Share of the data chunks lost for good under independent loss - a parity chunk covers every `parities`th data
+    chunk of its group and rebuilds one of them, so a chunk is lost for good when another one of its class is lost
+    too. A class of n data chunks loses n * p * (1 - (1 - p) ^ n) of them on average
+    :param loss: Loss Probability of a datagram
+    """
+    per_class = math.ceil(group_size / parities)
+    return loss * (1 - (1 - loss) ** per_class)
+
+
+def plan(loss, group_size=GROUP_SIZE, target=RESIDUAL_LOSS):
+    """
+    :return: int - Fewest parity chunks per group leaving at most the target share of the data chunks unrecoverable,
+             a parity per data chunk where none does
+    """
+    for parities in range(1, group_size + 1):
+        if residual_loss(loss, group_size, parities) <= target:
+            return parities
+    return group_size
+
+
+def pack(frames, block, frame_size):
+    """
+    Packs the datagrams back to back, as many as the block holds, for a single SegmentSender send
+    :param frames: Iterable of datagrams of the Frame Size in Bytes
+    :return: generator of memoryview of the block - valid until the next one
+    """
+    view = memoryview(block)
+    per_block = max(1, len(block) // frame_size)
+    count = 0
+    for frame in frames:
+        view[count * frame_size:(count + 1) * frame_size] = frame
+        count += 1
+        if count == per_block:
+            yield view[:count * frame_size]
+            count = 0
+    if count:
+        yield view[:count * frame_size]
+
+
+class FecEncoder:
+    def __init__(self, packet_size, loss=0.01, group_size=GROUP_SIZE):
+        """
+        Interleaved XOR parity over groups of file chunks
+
+        Every datagram carries a HEADER and a payload of equal size, the last chunk is zero padded - the receiver
+        knows the File Size. After the data chunks of a group come its parity chunks, parity j the XOR of the data
+        chunks j, j + r, j + 2r, ... so a burst of upto r losses is rebuilt. The parity count r is planned from the
+        loss estimate, updated with the loss the receiver reports after every transfer
+        :param packet_size: Datagram Size in Bytes, header included
+        :param loss: Loss Probability assumed before any transfer reported one
+        :param group_size: Data chunks per group
+        """
+        self.packet_size = packet_size
+        self.loss = loss
+        self.group_size = group_size
+        self.parities = plan(loss, group_size)
+
+    @property
+    def payload(self):
+        return self.packet_size - HEADER.size
+
+    def frames(self, file):
+        """
+        Reads the file a chunk at a time
+        :return: generator of memoryview of the datagrams - valid until the next one
+        """
+        group_size, parities, payload = self.group_size, self.parities, self.payload
+        frame = bytearray(self.packet_size)
+        view = memoryview(frame)
+        body = view[HEADER.size:]
+        data = np.frombuffer(frame, np.uint8)[HEADER.size:]
+        parity = np.zeros((parities, payload), np.uint8)
+        group = 0
+        while True:
+            parity[:] = 0
+            count = 0
+            for index in range(group_size):
+                num_bytes = file.readinto(body)
+                if not num_bytes:
+                    break
+                if num_bytes < payload:
+                    body[num_bytes:] = bytes(payload - num_bytes)
+                HEADER.pack_into(frame, 0, group, index, group_size, parities)
+                np.bitwise_xor(parity[index % parities], data, out=parity[index % parities])
+                count += 1
+                yield view
+            if not count:
+                return
+            for row in range(min(parities, count)):
+                HEADER.pack_into(frame, 0, group, group_size + row, group_size, parities)
+                body[:] = parity[row].data
+                yield view
+            if count < group_size:
+                return
+            group += 1
+
+    def update(self, lost, expected):
+        """
+        Folds the loss a receiver reported into the estimate and plans the parity of the next transfer
+        :param lost: Datagrams lost, before any was rebuilt
+        :param expected: Datagrams sent
+        """
+        if expected:
+            self.loss = (1 - SMOOTHING) * self.loss + SMOOTHING * lost / expected
+            self.parities = plan(self.loss, self.group_size)
+
+
+class FecDecoder:
+    def __init__(self, file, file_size, packet_size):
+        """
+        Writes the chunks of an FecEncoder to the file as they come, in any order, and rebuilds the lost ones from
+        the parity once their group is over - a datagram of a group two past it arrived, or the transfer ended
+        :param file: File opened for writing
+        :param file_size: Size in Bytes the file is written to
+        :param packet_size: Datagram Size in Bytes, header included
+        """
+        self.file = file
+        self.file_size = file_size
+        self.payload = packet_size - HEADER.size
+        self.chunks = -(-file_size // self.payload)
+        # Chunk written or not
+        self.written = bytearray(self.chunks)
+        self.missing = self.chunks
+        self.bytes_written = 0
+        # Group -> [data chunks (group size x payload), data chunk present, parity chunks, parity chunk present]
+        self.pending = {}
+        # Group over -> parity chunk present, to tell the late parity chunks from the duplicated ones
+        self.finished = {}
+        self.latest = -1
+        # Distinct datagrams received, the parity chunks the groups seen were sent with
+        self.received = 0
+        self.parity_expected = 0
+        self.rebuilt = 0
+
+    def add(self, datagram):
+        """
+        :param datagram: Bytes-like of a datagram of the FecEncoder
+        """
+        if len(datagram) <= HEADER.size:
+            return
+        group, index, group_size, parities = HEADER.unpack_from(datagram)
+        if not group_size or not parities:
+            return
+        finished = self.finished.get(group)
+        if finished is not None:
+            if group_size <= index < group_size + len(finished) and not finished[index - group_size]:
+                finished[index - group_size] = 1
+                self.received += 1
+            return
+        state = self.pending.get(group)
+        if state is None:
+            first = group * group_size
+            count = max(0, min(group_size, self.chunks - first))
+            state = self.pending[group] = [np.zeros((group_size, self.payload), np.uint8), bytearray(count),
+                                           np.zeros((parities, self.payload), np.uint8),
+                                           bytearray(min(parities, count))]
+            self.parity_expected += len(state[3])
+        data, present, parity, parity_present = state
+        body = np.frombuffer(datagram, np.uint8)[HEADER.size:HEADER.size + self.payload]
+        if index < group_size:
+            if index < len(present) and not present[index]:
+                present[index] = 1
+                self.received += 1
+                data[index, :len(body)] = body
+                self.write(group * group_size + index, data[index])
+        elif index - group_size < len(parity_present) and not parity_present[index - group_size]:
+            parity_present[index - group_size] = 1
+            parity[index - group_size, :len(body)] = body
+            self.received += 1
+        if all(present):
+            self.finish(group)
+        if group > self.latest:
+            self.latest = group
+            for old in [old for old in self.pending if old < group - 1]:
+                self.repair(old)
+
+    def write(self, chunk, payload):
+        if self.written[chunk]:
+            return
+        offset = chunk * self.payload
+        num_bytes = min(self.payload, self.file_size - offset)
+        self.file.seek(offset)
+        self.file.write(payload[:num_bytes].data)
+        self.bytes_written += num_bytes
+        self.written[chunk] = 1
+        self.missing -= 1
+
+    def repair(self, group):
+        """
+        Rebuilds every lost data chunk of the group that is the only one lost of its parity class
+        """
+        data, present, parity, parity_present = self.pending[group]
+        parities = len(parity)
+        first = group * len(data)
+        for row in range(len(parity_present)):
+            members = range(row, len(present), parities)
+            lost = [index for index in members if not present[index]]
+            if len(lost) != 1 or not parity_present[row]:
+                continue
+            index = lost[0]
+            others = [member for member in members if member != index]
+            np.bitwise_xor.reduce(np.vstack((parity[row:row + 1], data[others])), axis=0, out=data[index])
+            present[index] = 1
+            self.write(first + index, data[index])
+            self.rebuilt += 1
+        self.finish(group)
+
+    def finish(self, group):
+        self.finished[group] = self.pending.pop(group)[3]
+
+    def close(self):
+        """
+        Rebuilds what the groups still pending allow, the transfer is over
+        :return: int - Data chunks lost for good
+        """
+        for group in list(self.pending):
+            self.repair(group)
+        return self.missing
+
+    def lost(self):
+        """
+        :return: (Datagrams lost before any was rebuilt, Datagrams sent) - a group lost whole is not counted
+        """
+        expected = self.chunks + self.parity_expected
+        return max(0, expected - self.received), expected
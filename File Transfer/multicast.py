@@ -0,0 +1,530 @@
+import argparse
+import ipaddress
+import os
+import random
+import socket
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT, SegmentSender, create_socket, opcode, text
+from udp_impair import Impairment
+
+# Tag, Session, Chunk Index - ahead of every chunk of the file
+HEADER = struct.Struct("!4sII")
+DATA = b"Data"
+
+# Time in sec a receiver waits at most before it NACKs the chunks it misses - drawn at random, so the first NACK,
+# echoed by the sender to every receiver, suppresses the ones after it for the same chunks
+BACKOFF = 0.05
+# Time in sec the sender collects the NACKs of a round after the longest backoff
+HOLDOFF = 0.05
+# Most repair rounds before the receivers still missing chunks are given up on
+MAX_ROUNDS = 100
+# Times every control message to the receivers is sent, any one of them may be lost
+REPEAT = 2
+
+MEGA_BYTE = 1 << 20
+
+
+def spans(flags, value):
+    """
+    :param flags: bytearray of 0 and 1, a flag per chunk
+    :param value: Flag looked for
+    :return: list of (first, last) - the runs of chunks flagged with the value
+    """
+    other = 1 - value
+    runs = []
+    first = flags.find(value)
+    while first >= 0:
+        last = flags.find(other, first)
+        if last < 0:
+            last = len(flags)
+        runs.append((first, last - 1))
+        first = flags.find(value, last)
+    return runs
+
+
+def format_ranges(runs, budget):
+    """
+    :param runs: list of (first, last)
+    :param budget: Most characters
+    :return: string - `first-last,index,...` of as many runs as the budget holds
+    """
+    parts = []
+    for first, last in runs:
+        part = f"{first}-{last}" if last > first else f"{first}"
+        budget -= len(part) + 1
+        if budget < 0:
+            break
+        parts.append(part)
+    return ','.join(parts)
+
+
+def parse_ranges(ranges, chunks):
+    """
+    :return: generator of (first, last) of the `first-last,index,...` ranges, clipped to the chunks
+    """
+    for part in ranges.split(','):
+        first, _, last = part.partition('-')
+        if not first.isdigit() or last and not last.isdigit():
+            continue
+        first, last = int(first), int(last or first)
+        if first <= last < chunks:
+            yield first, last
+
+
+def set_flags(flags, first, last):
+    flags[first:last + 1] = b'\x01' * (last - first + 1)
+
+
+def is_multicast(host):
+    try:
+        return ipaddress.ip_address(host).is_multicast
+    except ValueError:
+        return False
+
+
+def join_group(udp_socket, group, interface):
+    """
+    Joins the IPv4 multicast group on the interface, its address - 0.0.0.0 for the one the kernel routes it on
+    """
+    membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface))
+    udp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+
+
+class MulticastSender:
+    def __init__(self, address_info, destination, file_path, packet_size, receivers, rate=8 * MEGA_BYTE,
+                 offload=False, ttl=1, interface=None):
+        """
+        Distributes a file to many receivers at once, every chunk sent a single time to an IP multicast group or a
+        FanOutRelay
+
+        Once every receiver joined, the file is offered and sent, then the repair rounds begin - an End asks the
+        receivers for the chunks they miss, each NACKs them unicast after a random backoff and the sender echoes
+        every NACK to the group, so the receivers missing the same chunks keep quiet. The union of the chunks
+        NACKed is sent again a single time for all of them, until every receiver is Done
+        :param address_info: socket.getaddrinfo of the Local Address the receivers send their control messages to
+        :param destination: (IP, Port) of the multicast group or the FanOutRelay
+        :param file_path: Path of the file distributed
+        :param packet_size: Datagram Size in Bytes, header included
+        :param receivers: Receivers waited for before the file is sent
+        :param rate: Bytes per sec the chunks are paced at, None for as fast as the socket takes them
+        :param offload: True to send the chunks a block at a time with UDP GSO
+        :param ttl: Multicast Time To Live - 1 keeps the datagrams on the local network
+        :param interface: IPv4 Address of the interface the multicast datagrams leave on, None for the routed one
+        """
+        self.sender = create_socket(address_info[0], (address_info[4][0], address_info[4][1]), timeout=BACKOFF)
+        if is_multicast(destination[0]):
+            self.sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+            self.sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            if interface:
+                self.sender.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        self.destination = destination
+        self.file_path = file_path
+        self.file_size = os.path.getsize(file_path)
+        self.packet_size = packet_size
+        self.payload = packet_size - HEADER.size
+        self.chunks = -(-self.file_size // self.payload)
+        self.expected = receivers
+        self.segments = SegmentSender(self.sender, packet_size, offload=offload, rate=rate)
+        self.block = bytearray(packet_size * self.segments.batch)
+        self.session = random.getrandbits(32)
+        # Address -> Done or not
+        self.receivers = {}
+        self.stats = {"chunks": 0, "repairs": 0, "rounds": 0, "nacks": 0, "datagrams": 0, "bytes": 0}
+
+    def distribute(self, wait=None):
+        """
+        :param wait: Time in sec the receivers are waited for, None for as long as it takes
+        :return: int - Receivers that did not get the whole file
+        """
+        print(f"[MULTICAST] Waiting for {self.expected} Receivers on {self.sender.getsockname()}")
+        deadline = None if wait is None else time.monotonic() + wait
+        while len(self.receivers) < self.expected and (deadline is None or time.monotonic() < deadline):
+            self.handle_control(None, None)
+        print(f"[MULTICAST] Sending '{os.path.basename(self.file_path)}' ({self.file_size} bytes, {self.chunks} "
+              f"chunks) to {len(self.receivers)} Receivers through {self.destination}")
+        began = time.perf_counter()
+        with open(self.file_path, 'rb') as file:
+            self.offer()
+            self.send_chunks(file, [(0, self.chunks - 1)] if self.chunks else [])
+            self.stats["chunks"] = self.chunks
+            while not all(self.receivers.values()) and self.stats["rounds"] < MAX_ROUNDS:
+                self.stats["rounds"] += 1
+                wanted = bytearray(self.chunks)
+                self.offer()
+                self.control(f"End {self.session} {self.stats['rounds']}")
+                round_end = time.monotonic() + BACKOFF + HOLDOFF
+                while time.monotonic() < round_end and not all(self.receivers.values()):
+                    self.handle_control(wanted, round_end)
+                repairs = spans(wanted, 1)
+                self.send_chunks(file, repairs)
+                self.stats["repairs"] += sum(last - first + 1 for first, last in repairs)
+        self.control(f"Close {self.session}")
+        elapsed = time.perf_counter() - began
+        missed = sum(not done for done in self.receivers.values())
+        print(f"[MULTICAST] {len(self.receivers) - missed}/{len(self.receivers)} Receivers Done in {elapsed:.2f} sec "
+              f"- {self.stats['chunks']} chunks, {self.stats['repairs']} repaired in {self.stats['rounds']} rounds, "
+              f"{self.stats['nacks']} NACKs, {self.stats['datagrams']} datagrams sent "
+              f"({self.stats['datagrams'] / max(1, self.chunks):.3f} per chunk)")
+        return missed
+
+    def offer(self):
+        # Name last, it may hold spaces
+        self.control(f"Offer {self.session} {self.file_size} {self.payload} {os.path.basename(self.file_path)}")
+
+    def control(self, message):
+        data = message.encode(FORMAT)
+        for _ in range(REPEAT):
+            self.sendto(data, self.destination)
+
+    def sendto(self, data, address):
+        self.sender.sendto(data, address)
+        self.stats["datagrams"] += 1
+        self.stats["bytes"] += len(data)
+
+    def handle_control(self, wanted, until):
+        """
+        Reads a control message of a receiver, waiting at most until the time given or the backoff
+        :param wanted: bytearray - Flag per chunk NACKed this round, None outside of the rounds
+        """
+        if until is not None:
+            self.sender.settimeout(max(0.001, until - time.monotonic()))
+        try:
+            data, address = self.sender.recvfrom(self.packet_size)
+        except socket.timeout:
+            return
+        finally:
+            self.sender.settimeout(BACKOFF)
+        command = opcode(data)
+        fields = text(data).split()
+        if command == b"join":
+            if address not in self.receivers:
+                print(f"[MULTICAST] Receiver {address} joined")
+                self.receivers[address] = False
+        elif len(fields) < 2 or fields[1] != str(self.session):
+            return
+        elif command == b"done":
+            self.receivers[address] = True
+        elif command == b"nack" and wanted is not None and len(fields) == 4:
+            self.stats["nacks"] += 1
+            for first, last in parse_ranges(fields[3], self.chunks):
+                set_flags(wanted, first, last)
+            # Echoed to every receiver, so the others missing these chunks do not NACK them too
+            self.sendto(data, self.destination)
+
+    def send_chunks(self, file, runs):
+        """
+        Sends the runs of chunks, a block of as many as a single send takes at a time, paced at the rate
+        """
+        view = memoryview(self.block)
+        per_block = len(self.block) // self.packet_size
+        count = 0
+        for first, last in runs:
+            file.seek(first * self.payload)
+            for index in range(first, last + 1):
+                frame = view[count * self.packet_size:(count + 1) * self.packet_size]
+                HEADER.pack_into(frame, 0, DATA, self.session, index)
+                num_bytes = file.readinto(frame[HEADER.size:])
+                if num_bytes < self.payload:
+                    frame[HEADER.size + num_bytes:] = bytes(self.payload - num_bytes)
+                count += 1
+                if count == per_block:
+                    self.send_block(view[:count * self.packet_size])
+                    count = 0
+        if count:
+            self.send_block(view[:count * self.packet_size])
+
+    def send_block(self, block):
+        datagrams = self.segments.send(block, self.destination)
+        self.stats["datagrams"] += datagrams
+        self.stats["bytes"] += len(block)
+
+
+class MulticastReceiver:
+    def __init__(self, family, sender, source, packet_size, directory="Client_Receive", interface="0.0.0.0",
+                 timeout=10.0):
+        """
+        Receives a file from a MulticastSender
+
+        :param family: Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
+        :param sender: (IP, Port) of the MulticastSender the control messages go to
+        :param source: ('group', (IP, Port)) of the multicast group joined or ('relay', (IP, Port)) of the
+                       FanOutRelay subscribed to
+        :param packet_size: Datagram Size in Bytes, header included
+        :param directory: Directory the file is written to
+        :param interface: IPv4 Address of the interface the group is joined on
+        :param timeout: Time in sec without a datagram before the sender is given up on
+        """
+        kind, address = source
+        if kind == "group":
+            self.receiver = create_socket(family, timeout=timeout)
+            self.receiver.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.receiver.bind(('', address[1]))
+            join_group(self.receiver, address[0], interface)
+            # Every receiver of the group is bound to its port, the sender tells them apart by a socket of their own
+            self.control = create_socket(family)
+        else:
+            self.receiver = create_socket(family, timeout=timeout)
+            self.receiver.sendto(b"Join", address)
+            self.control = self.receiver
+        self.source = source
+        self.sender = sender
+        self.packet_size = packet_size
+        self.directory = directory
+        self.timeout = timeout
+        self.session = None
+        self.file = None
+        self.file_name = None
+        self.file_size = 0
+        self.payload = 0
+        self.chunks = 0
+        # Chunk received or not, and this round received or NACKed by another receiver
+        self.received = bytearray()
+        self.known = bytearray()
+        self.missing = 0
+        self.round = 0
+        self.nack_at = None
+        self.stats = {"chunks": 0, "duplicates": 0, "nacks": 0, "suppressed": 0}
+
+    def receive(self):
+        """
+        :return: bool - True if the whole file was received
+        """
+        buffer = bytearray(self.packet_size)
+        view = memoryview(buffer)
+        began = None
+        last_heard = time.monotonic()
+        closed = False
+        while not closed:
+            now = time.monotonic()
+            if self.session is None:
+                # Joins until the file is offered, the first Join may be lost or come before the sender is up
+                self.control.sendto(b"Join", self.sender)
+                if self.source[0] == "relay":
+                    self.receiver.sendto(b"Join", self.source[1])
+                wait = 0.2
+            elif self.nack_at is not None:
+                wait = max(0.001, self.nack_at - now)
+            else:
+                wait = self.timeout
+            self.receiver.settimeout(wait)
+            try:
+                num_bytes, _ = self.receiver.recvfrom_into(buffer)
+            except socket.timeout:
+                if self.nack_at is not None and time.monotonic() >= self.nack_at:
+                    self.nack()
+                elif time.monotonic() - last_heard >= self.timeout:
+                    print(f"[MULTICAST] Nothing from the Sender for {self.timeout} sec")
+                    break
+                continue
+            last_heard = time.monotonic()
+            data = view[:num_bytes]
+            if num_bytes >= HEADER.size and data[:len(DATA)] == DATA:
+                if began is None:
+                    began = time.perf_counter()
+                self.on_chunk(data)
+            else:
+                closed = self.on_control(data)
+            if self.nack_at is not None and time.monotonic() >= self.nack_at:
+                self.nack()
+        if self.file is not None:
+            self.file.close()
+        elapsed = time.perf_counter() - began if began is not None else 0.0
+        print(f"[MULTICAST] '{self.file_name}' {'received' if self.chunks and not self.missing else 'incomplete'} - "
+              f"{self.stats['chunks']} chunks in {elapsed:.2f} sec, {self.stats['duplicates']} duplicates, "
+              f"{self.stats['nacks']} NACKs sent, {self.stats['suppressed']} suppressed")
+        if self.source[0] == "relay":
+            self.receiver.sendto(b"Leave", self.source[1])
+        return self.session is not None and not self.missing
+
+    def on_chunk(self, data):
+        _, session, index = HEADER.unpack_from(data)
+        if session != self.session or index >= self.chunks:
+            return
+        if self.received[index]:
+            self.stats["duplicates"] += 1
+            return
+        offset = index * self.payload
+        num_bytes = min(self.payload, self.file_size - offset)
+        self.file.seek(offset)
+        self.file.write(data[HEADER.size:HEADER.size + num_bytes])
+        self.received[index] = 1
+        self.known[index] = 1
+        self.missing -= 1
+        self.stats["chunks"] += 1
+
+    def on_control(self, data):
+        """
+        :return: bool - True once the sender closed the session
+        """
+        command = opcode(data)
+        fields = text(data).split(None, 4)
+        # Any stray datagram on the group port lands here, only well formed numbers are taken
+        if command == b"offer" and len(fields) == 5 and self.session is None:
+            if not all(field.isdigit() for field in fields[1:4]) or int(fields[3]) == 0:
+                return False
+            self.session, self.file_size, self.payload = int(fields[1]), int(fields[2]), int(fields[3])
+            self.file_name = os.path.basename(fields[4])
+            self.chunks = -(-self.file_size // self.payload)
+            self.received = bytearray(self.chunks)
+            self.known = bytearray(self.chunks)
+            self.missing = self.chunks
+            os.makedirs(self.directory, exist_ok=True)
+            self.file = open(os.path.join(self.directory, self.file_name), "wb")
+            self.file.truncate(self.file_size)
+            print(f"[MULTICAST] Receiving '{self.file_name}' ({self.file_size} bytes) from {self.sender}")
+            return False
+        if self.session is None or len(fields) < 2 or fields[1] != str(self.session):
+            return False
+        if command == b"close":
+            return True
+        if command == b"end" and len(fields) == 3 and fields[2].isdigit() and int(fields[2]) > self.round:
+            self.round = int(fields[2])
+            if not self.missing:
+                self.control.sendto(f"Done {self.session}".encode(FORMAT), self.sender)
+                return False
+            # What is missing now, less what the others NACK meanwhile
+            self.known[:] = self.received
+            self.nack_at = time.monotonic() + random.uniform(0, BACKOFF)
+        elif command == b"nack" and len(fields) == 4 and fields[2].isdigit() and int(fields[2]) == self.round:
+            for first, last in parse_ranges(fields[3], self.chunks):
+                set_flags(self.known, first, last)
+        return False
+
+    def nack(self):
+        self.nack_at = None
+        runs = spans(self.known, 0)
+        if not runs:
+            self.stats["suppressed"] += 1
+            return
+        prefix = f"Nack {self.session} {self.round} "
+        ranges = format_ranges(runs, self.packet_size - len(prefix))
+        self.control.sendto((prefix + ranges).encode(FORMAT), self.sender)
+        self.stats["nacks"] += 1
+
+
+class FanOutRelay:
+    def __init__(self, address_info, seed=None, loss=0.0, burst=None, shared_loss=0.0):
+        """
+        Stand-in for a multicast group where there is none, on loopback or across networks that do not route it -
+        every datagram is sent on to every receiver subscribed by a Join, so the sender still sends it once
+
+        :param address_info: socket.getaddrinfo of the Local Address to Port Bind to
+        :param seed: Random Seed of the loss, each receiver drawing from a Random of its own
+        :param loss: Loss Probability of a datagram to a receiver
+        :param burst: (enter, leave, loss in the Bad state) of the Gilbert-Elliott model, None for independent loss
+        :param shared_loss: Loss Probability of a datagram to every receiver at once, a link ahead of the fan-out
+        """
+        self.relay = create_socket(address_info[0], (address_info[4][0], address_info[4][1]))
+        self.seed = seed
+        self.loss = loss
+        self.burst = burst
+        # Receiver Address -> Impairment of the datagrams to it
+        self.members = {}
+        self.upstream = Impairment(None if seed is None else seed - 1, loss=shared_loss)
+
+    def serve(self):
+        buffer = bytearray(1 << 16)
+        view = memoryview(buffer)
+        print(f"[RELAY] Fanning out on {self.relay.getsockname()}")
+        while True:
+            num_bytes, address = self.relay.recvfrom_into(buffer)
+            data = view[:num_bytes]
+            if num_bytes < 8:
+                command = opcode(data)
+                if command == b"join":
+                    if address not in self.members:
+                        seed = None if self.seed is None else self.seed + len(self.members)
+                        self.members[address] = Impairment(seed, loss=self.loss, burst=self.burst)
+                        print(f"[RELAY] {address} joined - {len(self.members)} Receivers")
+                    continue
+                if command == b"leave":
+                    self.members.pop(address, None)
+                    print(f"[RELAY] {address} left - {len(self.members)} Receivers")
+                    continue
+            if not self.upstream.clean and not self.upstream.copies():
+                continue
+            for member, impairment in self.members.items():
+                if member != address:
+                    for _ in range(impairment.copies() if not impairment.clean else 1):
+                        self.relay.sendto(data, member)
+
+
+def address_of(value, default_host):
+    host, _, port = value.rpartition(':')
+    return host or default_host, int(port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UDP File Transfer to many receivers at once over IP multicast or a '
+                                                 'fan-out relay, repaired by NACKs',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    roles = parser.add_subparsers(dest='role', required=True)
+
+    send_parser = roles.add_parser('send', help='Distribute a file', formatter_class=parser.formatter_class)
+    send_parser.add_argument('file_path', metavar="FILE_PATH", help='File distributed')
+    send_parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS", default='0.0.0.0',
+                             help='Local IP Address the receivers send their control messages to')
+    send_parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER", default=7780,
+                             help='Local Port the receivers send their control messages to')
+    send_parser.add_argument('-n', '--receivers', type=int, default=1, help='Receivers waited for')
+    send_parser.add_argument('--wait', type=float, metavar="TIME",
+                             help='Time in sec the receivers are waited for before sending to those joined')
+    send_parser.add_argument('--rate', type=float, metavar="MB", default=8,
+                             help='MB per sec the chunks are paced at, 0 for no pacing')
+    send_parser.add_argument('--offload', action='store_true',
+                             help='Send the chunks a block at a time with UDP GSO, Linux only')
+    send_parser.add_argument('--ttl', type=int, default=1, help='Multicast Time To Live')
+
+    receive_parser = roles.add_parser('receive', help='Receive a file', formatter_class=parser.formatter_class)
+    receive_parser.add_argument('--sender', type=str, metavar="IP:PORT", required=True,
+                                help='Control Address of the sender')
+    receive_parser.add_argument('-d', '--directory', type=str, default="Client_Receive",
+                                help='Directory the file is written to')
+    receive_parser.add_argument('--timeout', type=float, metavar="TIME", default=10,
+                                help='Time in sec without a datagram before the sender is given up on')
+
+    relay_parser = roles.add_parser('relay', help='Fan every datagram out to the receivers subscribed, for testing '
+                                                  'where there is no multicast', formatter_class=parser.formatter_class)
+    relay_parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS", default='127.0.0.1',
+                              help='Local IP Address to Port Bind to')
+    relay_parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER", default=7781,
+                              help='Local Port to Port Bind to')
+    relay_parser.add_argument('--loss', type=float, default=0.0, help='Loss Probability of a datagram to a receiver')
+    relay_parser.add_argument('--burst', type=float, nargs=3, metavar=("ENTER", "LEAVE", "BAD_LOSS"),
+                              help='Gilbert-Elliott bursty loss instead of independent loss')
+    relay_parser.add_argument('--shared-loss', type=float, default=0.0,
+                              help='Loss Probability of a datagram to every receiver at once')
+    relay_parser.add_argument('--seed', type=int, help='Random Seed of the loss')
+
+    for role_parser in (send_parser, receive_parser):
+        role_parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE", default=4096,
+                                 help='Datagram Size in Bytes')
+        role_parser.add_argument('--interface', type=str, metavar="IP_ADDRESS",
+                                 help='IPv4 Address of the interface multicast goes out of or is joined on')
+        source = role_parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('-g', '--group', type=str, metavar="IP:PORT", help='IPv4 Multicast Group')
+        source.add_argument('-r', '--relay', type=str, metavar="IP:PORT", help='Address of a fan-out relay')
+
+    args = parser.parse_args()
+
+    if args.role == 'relay':
+        FanOutRelay(socket.getaddrinfo(args.ip, args.port, proto=socket.IPPROTO_UDP)[0], seed=args.seed,
+                    loss=args.loss, burst=args.burst, shared_loss=args.shared_loss).serve()
+    elif args.role == 'send':
+        destination = address_of(args.group or args.relay, '127.0.0.1')
+        multicast_sender = MulticastSender(socket.getaddrinfo(args.ip, args.port, proto=socket.IPPROTO_UDP)[0],
+                                           destination, args.file_path, args.size, args.receivers,
+                                           rate=args.rate * MEGA_BYTE or None, offload=args.offload, ttl=args.ttl,
+                                           interface=args.interface)
+        sys.exit(1 if multicast_sender.distribute(args.wait) else 0)
+    else:
+        source = ("group", address_of(args.group, '')) if args.group else ("relay", address_of(args.relay, '127.0.0.1'))
+        multicast_receiver = MulticastReceiver(socket.AF_INET, address_of(args.sender, '127.0.0.1'), source,
+                                               args.size, directory=args.directory,
+                                               interface=args.interface or "0.0.0.0", timeout=args.timeout)
+        sys.exit(0 if multicast_receiver.receive() else 1)
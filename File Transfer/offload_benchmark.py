@@ -0,0 +1,139 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import MAX_OFFLOAD, SegmentSender, create_socket, offload_supported, receive_segments, set_gro
+
+# Name -> (UDP GSO on the sender, UDP GRO on the receiver)
+MODES = {
+    "plain": (False, False),
+    "gso": (True, False),
+    "gso+gro": (True, True),
+}
+
+# Sent after the last chunk, shorter than any chunk
+END = b"end"
+ACK = b"ack"
+
+GIGA_BYTE = 1 << 30
+
+
+def cpu_time():
+    times = os.times()
+    return times.user + times.system
+
+
+def receive_side(port, packet_size, gro, window, ready, results):
+    """
+    Entry point of the receiving process - counts the chunks and acknowledges every window of them
+    """
+    receiver = create_socket(socket.AF_INET, ("127.0.0.1", port), timeout=5)
+    gro = gro and set_gro(receiver, True)
+    buffer = bytearray(MAX_OFFLOAD if gro else packet_size)
+    received = datagrams = syscalls = 0
+    next_ack = window
+    ready.set()
+    began = None
+    done = False
+    while not done:
+        try:
+            chunks, sender = receive_segments(receiver, buffer, gro, packet_size)
+        except socket.timeout:
+            break
+        if began is None:
+            began = cpu_time()
+        syscalls += 1
+        for chunk in chunks:
+            if len(chunk) == len(END) and chunk == END:
+                done = True
+                break
+            datagrams += 1
+            received += len(chunk)
+        if received >= next_ack:
+            receiver.sendto(ACK, sender)
+            syscalls += 1
+            next_ack = (received // window + 1) * window
+    results.put({"bytes": received, "datagrams": datagrams, "syscalls": syscalls,
+                 "cpu": cpu_time() - began if began is not None else 0.0})
+    receiver.close()
+
+
+def send_side(port, packet_size, gso, total, window):
+    """
+    Sends the chunks a window at a time, waiting for the acknowledgement of each so the receiver is not overrun
+    :return: dict - Bytes, Datagrams, Syscalls, CPU Time and Elapsed Time in sec of the sender, stalls on a lost window
+    """
+    client = create_socket(socket.AF_INET, timeout=1)
+    sender = SegmentSender(client, packet_size, offload=gso)
+    block = memoryview(bytes(packet_size * sender.batch))
+    receiver = ("127.0.0.1", port)
+    sent = datagrams = acks = stalls = 0
+    began, cpu_began = time.perf_counter(), cpu_time()
+    while sent < total:
+        window_end = min(total, sent + window)
+        while sent < window_end:
+            num_bytes = min(len(block), window_end - sent)
+            datagrams += sender.send(block[:num_bytes], receiver)
+            sent += num_bytes
+        try:
+            client.recv(len(ACK))
+            acks += 1
+        except socket.timeout:
+            stalls += 1
+    client.sendto(END, receiver)
+    result = {"bytes": sent, "datagrams": datagrams, "syscalls": sender.syscalls + acks + stalls + 1,
+              "cpu": cpu_time() - cpu_began, "elapsed": time.perf_counter() - began, "stalls": stalls,
+              "offload": sender.offload}
+    client.close()
+    return result
+
+
+def run(mode, port, packet_size, total, window):
+    """
+    :return: (sender result, receiver result) of a transfer of `total` Bytes in the mode
+    """
+    gso, gro = MODES[mode]
+    ready, results = multiprocessing.Event(), multiprocessing.Queue()
+    receiver = multiprocessing.Process(target=receive_side, args=(port, packet_size, gro, window, ready, results),
+                                       daemon=True)
+    receiver.start()
+    ready.wait(5)
+    sent = send_side(port, packet_size, gso, total, window)
+    received = results.get(timeout=30)
+    receiver.join()
+    return sent, received
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Syscalls and CPU Time per GB of the File Transfer chunks sent '
+                                                 'and received a datagram per syscall, with UDP GSO and with UDP '
+                                                 'GSO and GRO',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER", help='Local Port of the receiver',
+                        default=19777)
+    parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE", help='Chunk Size in Bytes', default=4096)
+    parser.add_argument('-g', '--gigabytes', type=float, help='Bytes sent per mode in GB', default=1)
+    parser.add_argument('-w', '--window', type=int, metavar="CHUNKS",
+                        help='Chunks in flight before waiting for the receiver', default=256)
+    parser.add_argument('-m', '--modes', nargs='+', choices=MODES, help='Modes to run', default=list(MODES))
+
+    args = parser.parse_args()
+
+    if not offload_supported(socket.socket(socket.AF_INET, socket.SOCK_DGRAM)):
+        print("[OFFLOAD] No UDP GSO / GRO here, every mode falls back to a datagram per syscall")
+    total = int(args.gigabytes * GIGA_BYTE) // args.size * args.size
+    print(f"{'Mode':<8} {'GB/s':>6} {'Send Calls/GB':>14} {'Recv Calls/GB':>14} {'Send CPU s/GB':>14} "
+          f"{'Recv CPU s/GB':>14} {'Loss %':>7}")
+    for mode in args.modes:
+        sender_result, receiver_result = run(mode, args.port, args.size, total, args.window * args.size)
+        gigabytes = sender_result["bytes"] / GIGA_BYTE
+        loss = 1 - receiver_result["datagrams"] / sender_result["datagrams"]
+        print(f"{mode:<8} {gigabytes / sender_result['elapsed']:>6.2f} "
+              f"{sender_result['syscalls'] / gigabytes:>14.0f} {receiver_result['syscalls'] / gigabytes:>14.0f} "
+              f"{sender_result['cpu'] / gigabytes:>14.2f} {receiver_result['cpu'] / gigabytes:>14.2f} "
+              f"{loss * 100:>7.2f}")
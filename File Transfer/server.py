@@ -1,126 +1,282 @@
 import argparse
 import os
 import socket
-import time
+import sys
 
-FORMAT = "iso-8859-1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import (FORMAT, MAX_OFFLOAD, BufferPool, Dispatcher, Framer, SegmentSender, create_socket, opcode,
+                      receive, receive_segments, set_gro, text)
+import udp_log
+import udp_metrics
+import udp_profile
+from blockcache import BlockCache
+from catalog import Catalog
+from fec import FecDecoder, FecEncoder, pack
+
+MEGA_BYTE = 1 << 20
+
+# Bytes of the files sent cached by default
+CACHE_SIZE = 64 * MEGA_BYTE
+# Bytes per sec the file chunks are sent at by default
+RATE = 8 * MEGA_BYTE
 
 
 class FileTransferServer:
-    def __init__(self, address_info, packet_size):
+    def __init__(self, address_info, packet_size, log=None, registry=None, offload=False, catalog=None, cache=None,
+                 rate=RATE):
         self.server = None
+        # Per datagram records are DEBUG, off unless asked for
+        self.log = log or udp_log.Logger()
+        self.registry = registry or udp_metrics.Registry()
         self.socket = (address_info[4][0], address_info[4][1])
         self.packet_size = packet_size
         self.address_info = address_info
+        # File chunks are read into and received into pooled buffers, not allocated per chunk
+        self.buffers = BufferPool(packet_size)
+        self.framer = Framer(packet_size)
+        # File chunks sent a block at a time with UDP GSO, and received coalesced with UDP GRO, where there are
+        self.offload = offload
+        # File chunks paced by their Bytes, a GSO block waits only as long as its datagrams sent one by one would
+        self.rate = rate
+        self.sender = None
+        self.blocks = None
+        self.gro_buffer = None
+        # Parity of the files sent with FEC, sized by the loss the Clients report
+        self.fec = FecEncoder(packet_size)
+        # Files served, looked up instead of listing the directory on every download
+        self.catalog = catalog if catalog is not None else Catalog("Server_Send")
+        # Blocks of the files sent, kept for the next Client downloading them
+        self.cache = cache if cache is not None else BlockCache(CACHE_SIZE)
+        self.is_new_client = True
+        self.commands = Dispatcher()
+        self.commands.register("upload", self.on_upload)
+        self.commands.register("download", self.on_download)
+        self.commands.register("list", self.list_files)
+        self.commands.register("size", self.change_size)
+        self.commands.register("disconnect", self.disconnect)
+        # Chunks are counted as datagrams of the Upload / Download they belong to
+        self.traffic = udp_metrics.TrafficMetrics(self.registry, self.commands.handlers)
+        self.transfers = self.registry.counter("file_transfers_total", "Files sent and received by outcome",
+                                               ("direction", "status"))
+        self.file_bytes = self.registry.counter("file_bytes_total", "File Bytes sent and received", ("direction",))
+        self.rebuilt = self.registry.counter("file_chunks_rebuilt_total", "File chunks lost and rebuilt from the FEC "
+                                                                          "parity")
+        self.registry.gauge("file_fec_parities", "Parity chunks per group of the files sent with FEC",
+                            function=lambda: self.fec.parities)
+        self.registry.gauge("file_catalog_files", "Files served", function=lambda: len(self.catalog))
+        self.registry.counter("file_catalog_scans_total", "Directories of the served files scanned",
+                              function=lambda: self.catalog.rescans)
+        self.registry.counter("file_cache_blocks_total", "Blocks of the files sent by where they were read from",
+                              ("outcome",), function=lambda: self.cache.stats)
+        self.registry.gauge("file_cache_bytes", "Bytes of the files sent cached", function=lambda: self.cache.size)
+        self.registry.counter("file_cache_evictions_total", "Blocks of the files sent evicted from the cache",
+                              function=lambda: self.cache.evictions)
+        udp_metrics.add_socket(self.registry, lambda: self.server)
+        udp_metrics.add_log(self.registry, self.log)
         self.initiate_server()
 
     def initiate_server(self):
         # Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
-        # SOCK_DGRAM - Socket Type - UDP
-        self.server = socket.socket(self.address_info[0], socket.SOCK_DGRAM)
         # Port Bind the socket to the port
-        self.server.bind(self.socket)
-        print(f'[SERVER INITIATED] UDP File Transfer Server on {self.socket}')
+        self.server = create_socket(self.address_info[0], self.socket)
+        self.sender = SegmentSender(self.server, self.packet_size, offload=self.offload, rate=self.rate)
+        self.blocks = BufferPool(self.packet_size * self.sender.batch, count=1)
+        self.gro_buffer = bytearray(MAX_OFFLOAD) if self.sender.offload else None
+        self.log.info("SERVER INITIATED", server="UDP File Transfer", address=self.socket,
+                      offload=self.sender.offload, files=len(self.catalog), catalog=self.catalog.mode)
 
     def client_handler(self):
-        is_new_client = True
         while True:
-            data, client_socket = self.server.recvfrom(self.packet_size)
-            if is_new_client:
-                print(f"[NEW CONNECTION] Client {client_socket} connected to server")
-                is_new_client = False
-            data = data.decode(FORMAT)
+            buffer = self.buffers.acquire()
+            data, client_socket = receive(self.server, buffer, self.packet_size)
+            if self.is_new_client:
+                self.log.info("NEW CONNECTION", client=client_socket)
+                self.is_new_client = False
             if data:
-                print(f"[MESSAGE RECEIVED] '{data.strip()}' from {client_socket} : bytes = {len(data)}")
-                
-                if data.lower()[:6] == "upload":
-                    file_name, file_size = data.split()[1:]
-                    file_size = int(file_size)
-                    self.download(file_name, file_size, client_socket)
-
-                elif data.lower()[:8] == "download":
-                    file_name = data.split()[1]
-                    self.upload(file_name, client_socket)
-
-                # Packet Size Change
-                elif data.lower()[:4] == "size":
-                    self.packet_size = int(data.split()[1])
-                    response = self.pad(f"New Size - {self.packet_size}")
-                    print(f"[PACKET SIZE] - New Packet Size - {self.packet_size}")
-                    self.server.sendto(response.encode(FORMAT), client_socket)
-
-                elif data.lower().strip() == "disconnect":
-                    response = self.pad("Disconnected")
-                    print(f"[TERMINATION] - Client {client_socket} disconnected")
-                    is_new_client = True
-                    self.server.sendto(response.encode(FORMAT), client_socket)
-
-    def upload(self, file_name, client_socket):
+                command = opcode(data)
+                if self.log.enabled(udp_log.DEBUG):
+                    self.log.debug("MESSAGE RECEIVED", command=command, client=client_socket, bytes=len(data))
+                started = self.traffic.received(command, len(data))
+                self.commands.handler(command)(data, client_socket)
+                self.traffic.handled(started)
+            self.buffers.release(buffer)
+
+    def on_upload(self, data, client_socket):
+        # Upload <name> <size> [FEC]
+        fields = text(data).split()
+        self.download(fields[1], int(fields[2]), client_socket, fec=fields[3:4] == ["FEC"])
+
+    def on_download(self, data, client_socket):
+        # Download <name> [FEC]
+        fields = text(data).split()
+        self.upload(fields[1], client_socket, fec=fields[2:3] == ["FEC"])
+
+    def list_files(self, data, client_socket):
+        """
+        List [start] [directory] - a page of the files served, as many as a datagram holds from the start on,
+        subdirectories included. Answered by `Files <start> <end> <total>` and a `<path> <size> <mtime> <sha256>`
+        line per file, `-` for a hash not known
+        """
+        fields = text(data).split()[1:]
+        start = int(fields[0]) if fields and fields[0].isdigit() else 0
+        directory = fields[1] if len(fields) > 1 else ''
+        # A line takes more than 2 Bytes, a page never has more files than the Packet Size
+        entries, total = self.catalog.page(directory, start, self.packet_size // 2)
+        budget = self.packet_size - len(f"Files {start} {start + len(entries)} {total}")
+        lines = []
+        for name, entry in entries:
+            line = f"\n{name} {entry.size} {entry.mtime // 1_000_000_000} {entry.digest or '-'}"
+            if len(line.encode(FORMAT, "replace")) > budget:
+                # A single line too long for the datagram is cut short, the page moves on regardless
+                if not lines:
+                    lines.append(line[:budget])
+                break
+            budget -= len(line.encode(FORMAT, "replace"))
+            lines.append(line)
+        self.send(client_socket, (f"Files {start} {start + len(lines)} {total}" + ''.join(lines))
+                  .encode(FORMAT, "replace"))
+
+    def change_size(self, data, client_socket):
+        # Packet Size Change
+        self.packet_size = int(text(data).split()[1])
+        self.buffers.resize(self.packet_size)
+        self.framer.packet_size = self.packet_size
+        self.sender.segment_size = self.packet_size
+        self.blocks.resize(self.packet_size * self.sender.batch)
+        self.fec.packet_size = self.packet_size
+        self.log.info("PACKET SIZE", size=self.packet_size)
+        self.send(client_socket, f"New Size - {self.packet_size}")
+
+    def disconnect(self, data, client_socket):
+        self.log.info("TERMINATION", client=client_socket)
+        self.is_new_client = True
+        self.send(client_socket, "Disconnected")
+
+    def upload(self, file_name, client_socket, fec=False):
         # Send the File Name
-        if file_name not in os.listdir("Server_Send"):
-            print(f"[FILE UPLOAD] No {file_name} in the Server")
-            message = self.pad(f"No {file_name}")
-            self.server.sendto(message.encode(FORMAT), client_socket)
+        entry = self.catalog.lookup(file_name)
+        if entry is None:
+            self.log.warning("FILE UPLOAD", file=file_name, status="missing")
+            self.transfers.inc(("sent", "missing"))
+            self.send(client_socket, f"No {file_name}")
             return
         else:
-            file_size = os.path.getsize(os.path.join("Server_Send", file_name))
-            print(f"[FILE UPLOAD] Waiting to Send File - '{file_name}' to Client {client_socket}'")
-            response = self.pad(f"Sending {file_name} {file_size}")
-
-            self.server.sendto(response.encode(FORMAT), client_socket)
-            response, client_socket = self.server.recvfrom(self.packet_size)
-            response = response.decode(FORMAT).lower().strip()
+            file_size = entry.size
+            self.log.info("FILE UPLOAD", file=file_name, client=client_socket, status="waiting")
+            self.send(client_socket, f"Sending {file_name} {file_size}")
+            response, client_socket = self.recvfrom()
+            response = text(response).lower()
             if response == "waiting":
-                print(f"[FILE UPLOAD] Sending File - '{os.path.basename(file_name)}' to Client {client_socket}")
-                # Read the contents of the file.
-                with open(os.path.join("Server_Send", file_name), 'rb') as file:
-                    while True:
-                        contents = file.read(self.packet_size)
-                        if not contents:
-                            break
-                        # Send Contents to Client
-                        time.sleep(0.1)
-                        self.server.sendto(contents, client_socket)
-                file.close()
-
-            self.server.sendto(self.pad(f"Upload Done").encode(FORMAT), client_socket)
-            response, client_socket = self.server.recvfrom(self.packet_size)
-
-            if response.decode(FORMAT).strip().lower() != "done":
-                print(f"[FILE UPLOAD] '{file_name}' upload is corrupted. Resending the file to Client {client_socket}")
-                self.upload(file_name, client_socket)
+                self.log.info("FILE UPLOAD", file=file_name, client=client_socket, status="sending",
+                              parities=self.fec.parities if fec else 0)
+                buffer = self.blocks.acquire()
+                # Read the contents of the file, a block of as many chunks as a single send takes
+                with self.cache.open(self.catalog.path(file_name), entry.size, entry.mtime) as file:
+                    for block in self.blocks_of(file, buffer, fec):
+                        # Send Contents to Client, paced at the rate however they are sent
+                        chunks = self.sender.send(block, client_socket)
+                        self.traffic.sent(len(block), chunks)
+                    self.file_bytes.inc("sent", file.tell())
+                self.blocks.release(buffer)
+
+            self.send(client_socket, "Upload Done")
+            response, client_socket = self.recvfrom()
+            # Done or Corrupted, followed by the datagrams lost and sent with FEC
+            fields = text(response).lower().split()
+            if fec and len(fields) == 3:
+                self.fec.update(int(fields[1]), int(fields[2]))
+
+            if fields[:1] != ["done"]:
+                self.log.warning("FILE UPLOAD", file=file_name, client=client_socket, status="corrupted")
+                self.transfers.inc(("sent", "corrupted"))
+                self.upload(file_name, client_socket, fec)
             else:
-                print(f"[FILE UPLOAD] '{file_name}' is sent to Client {client_socket}")
+                self.log.info("FILE UPLOAD", file=file_name, client=client_socket, status="sent")
+                self.transfers.inc(("sent", "complete"))
 
-    def download(self, file_name, file_size, client_socket):
+    def blocks_of(self, file, buffer, fec):
+        """
+        :return: generator of memoryview of the next chunks of the file back to back in the buffer, FEC framed and
+                 followed by their parity if asked for
+        """
+        if fec:
+            yield from pack(self.fec.frames(file), buffer, self.packet_size)
+            return
+        block = memoryview(buffer)[:self.packet_size * self.sender.batch]
+        while True:
+            num_bytes = file.readinto(block)
+            if not num_bytes:
+                return
+            yield block[:num_bytes]
+
+    def download(self, file_name, file_size, client_socket, fec=False):
         file = open(os.path.join("Server_Receive", file_name), "wb")
-        response = self.pad("Waiting")
-        self.server.sendto(response.encode(FORMAT), client_socket)
-        print(f"[FILE DOWNLOAD] Client {client_socket} sending file '{file_name}'")
+        # Chunks written where they belong in the file, the lost ones rebuilt from the parity
+        decoder = FecDecoder(file, file_size, self.packet_size) if fec else None
+        # Coalesced receives only for the chunks, the receive loop takes a datagram at a time
+        gro = self.sender.offload and set_gro(self.server, True)
+        self.send(client_socket, "Waiting")
+        self.log.info("FILE DOWNLOAD", file=file_name, client=client_socket, status="receiving")
         bytes_wrote = 0
-        while True:
-            data, client_socket = self.server.recvfrom(self.packet_size)
-            if data.decode(FORMAT).strip().lower() == 'upload done':
-                if bytes_wrote < file_size:
-                    print(f"[FILE DOWNLOAD] {file_name} corrupted. Requesting Client {client_socket} for Resend")
-                    response = self.pad("Corrupted")
-                else:
-                    print(f"[FILE DOWNLOAD] File download '{file_name}' from {client_socket} complete")
-                    response = self.pad("Done")
-
-                self.server.sendto(response.encode(FORMAT), client_socket)
-                break
+        buffer = self.gro_buffer if gro else self.buffers.acquire()
+        done = False
+        while not done:
+            chunks, client_socket = receive_segments(self.server, buffer, gro, self.packet_size)
+            for data in chunks:
+                self.traffic.continued(len(data))
+                # Only a chunk starting like the end marker is decoded
+                if opcode(data) == b"upload" and text(data).lower() == 'upload done':
+                    loss = ''
+                    if decoder is not None:
+                        complete = not decoder.close()
+                        bytes_wrote = decoder.bytes_written
+                        self.file_bytes.inc("received", bytes_wrote)
+                        self.rebuilt.inc(amount=decoder.rebuilt)
+                        # The loss the Client sizes the parity of its next transfer by
+                        lost, expected = decoder.lost()
+                        loss = f" {lost} {expected}"
+                    else:
+                        complete = bytes_wrote >= file_size
+                    if not complete:
+                        self.log.warning("FILE DOWNLOAD", file=file_name, client=client_socket,
+                                         status="corrupted", received=bytes_wrote, size=file_size)
+                        response = "Corrupted"
+                        self.transfers.inc(("received", "corrupted"))
+                    else:
+                        self.log.info("FILE DOWNLOAD", file=file_name, client=client_socket, status="complete",
+                                      size=file_size, rebuilt=decoder.rebuilt if decoder is not None else 0)
+                        response = "Done"
+                        self.transfers.inc(("received", "complete"))
+
+                    self.send(client_socket, response + loss)
+                    done = True
+                    break
 
-            file.write(data)
-            bytes_wrote += len(data)
+                if decoder is not None:
+                    decoder.add(data)
+                    continue
+                file.write(data)
+                bytes_wrote += len(data)
+                self.file_bytes.inc("received", len(data))
 
+        if gro:
+            set_gro(self.server, False)
+        else:
+            self.buffers.release(buffer)
         file.close()
 
-    def pad(self, message):
-        message = message.encode(FORMAT)
-        if len(message) < self.packet_size:
-            message += b' ' * (self.packet_size - len(message))
-        return message.decode(FORMAT)
+    def send(self, client_socket, message):
+        self.sendto(self.framer.frame(message), client_socket)
+
+    def sendto(self, data, client_socket):
+        self.server.sendto(data, client_socket)
+        self.traffic.sent(len(data))
+
+    def recvfrom(self):
+        # Reply read in the middle of a transfer
+        data, client_socket = self.server.recvfrom(self.packet_size)
+        self.traffic.continued(len(data))
+        return data, client_socket
 
 
 if __name__ == '__main__':
@@ -134,6 +290,21 @@ if __name__ == '__main__':
                         help='UDP File Transfer Server Port Number to Port Bind to', default=7776)
     parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE",
                         help='UDP Transfer Packet Size in Bytes', default=4096)
+    parser.add_argument('--offload', action='store_true',
+                        help='Send the file chunks with UDP GSO and receive them with UDP GRO, Linux only - falls back '
+                             'to a datagram per syscall where the kernel has neither')
+    parser.add_argument('--rate', type=float, metavar="MB", default=RATE / MEGA_BYTE,
+                        help='MB per sec the file chunks are sent at, 0 for as fast as the socket takes them')
+    parser.add_argument('--catalog-poll', type=float, metavar="TIME",
+                        help='Poll Server_Send for changes every TIME sec instead of watching it with inotify - it is '
+                             'polled every sec where there is no inotify')
+    parser.add_argument('--cache-size', type=float, metavar="MB", default=CACHE_SIZE / MEGA_BYTE,
+                        help='Most MB of the files sent kept in memory for the next downloads, 0 for none')
+    parser.add_argument('--catalog-hashes', action='store_true',
+                        help='Hash every file served with SHA-256 in the background, shown by List')
+    udp_log.add_arguments(parser)
+    udp_metrics.add_arguments(parser)
+    udp_profile.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -143,5 +314,13 @@ if __name__ == '__main__':
         proto=socket.IPPROTO_UDP
     )[0]
 
-    server = FileTransferServer(address_info=address_info, packet_size=args.size)
+    server = FileTransferServer(address_info=address_info, packet_size=args.size,
+                                log=udp_log.from_arguments(args, packet_events=("MESSAGE RECEIVED",)),
+                                offload=args.offload, rate=args.rate * MEGA_BYTE or None,
+                                catalog=Catalog("Server_Send", hashes=args.catalog_hashes,
+                                                interval=args.catalog_poll or 1.0, watch=args.catalog_poll is None),
+                                cache=BlockCache(int(args.cache_size * MEGA_BYTE)))
+    if args.metrics_port:
+        udp_metrics.serve(server.registry, args.metrics_port)
+    udp_profile.from_arguments(args, server)
     server.client_handler()
@@ -0,0 +1,78 @@
+import io
+import random
+
+import pytest
+
+from fec import HEADER, FecDecoder, FecEncoder, plan
+
+PACKET_SIZE = 64
+PAYLOAD = PACKET_SIZE - HEADER.size
+
+
+@pytest.fixture
+def content():
+    # Three whole groups and a short one, the last chunk padded
+    return random.Random(7).randbytes(PAYLOAD * (3 * 16 + 5) - 11)
+
+
+def encode(content, loss=0.01):
+    encoder = FecEncoder(PACKET_SIZE, loss=loss)
+    # The datagrams share a single buffer, they are copied to be dropped or reordered
+    return encoder, [bytes(frame) for frame in encoder.frames(io.BytesIO(content))]
+
+
+def decode(content, datagrams):
+    file = io.BytesIO()
+    decoder = FecDecoder(file, len(content), PACKET_SIZE)
+    for datagram in datagrams:
+        decoder.add(datagram)
+    return decoder, decoder.close(), file.getvalue()
+
+
+def position(datagram):
+    group, index, _, _ = HEADER.unpack_from(datagram)
+    return group, index
+
+
+def test_lossless_transfer_is_written_as_is(content):
+    _, datagrams = encode(content)
+    decoder, missing, written = decode(content, reversed(datagrams))
+    assert missing == 0
+    assert written == content
+    assert decoder.rebuilt == 0
+    assert decoder.lost() == (0, len(datagrams))
+
+
+def test_a_chunk_lost_per_parity_class_is_rebuilt(content):
+    encoder, datagrams = encode(content)
+    parities = encoder.parities
+    dropped = [datagram for datagram in datagrams if position(datagram)[1] < parities]
+    kept = [datagram for datagram in datagrams if position(datagram)[1] >= parities]
+    decoder, missing, written = decode(content, kept)
+    assert missing == 0
+    assert written == content
+    assert decoder.rebuilt == len(dropped)
+    assert decoder.lost() == (len(dropped), len(datagrams))
+
+
+def test_two_chunks_lost_in_a_class_are_lost_for_good(content):
+    encoder, datagrams = encode(content)
+    # Data chunks 0 and r of the first group are covered by the same parity chunk
+    dropped = {(0, 0), (0, encoder.parities)}
+    kept = [datagram for datagram in datagrams if position(datagram) not in dropped]
+    decoder, missing, written = decode(content, kept)
+    assert missing == 2
+    assert written[2 * PAYLOAD * encoder.parities:] == content[2 * PAYLOAD * encoder.parities:]
+
+
+def test_more_loss_plans_more_parity():
+    parities = [plan(loss) for loss in (0.0001, 0.001, 0.01, 0.05, 0.1, 0.3)]
+    assert parities == sorted(parities)
+    assert parities[0] < parities[-1]
+
+
+def test_reported_loss_moves_the_plan():
+    encoder = FecEncoder(PACKET_SIZE, loss=0.001)
+    before = encoder.parities
+    encoder.update(lost=20, expected=100)
+    assert encoder.parities > before
@@ -0,0 +1,204 @@
+import argparse
+import random
+import time
+
+from match import CALL_MOVE, CHOOSE_MOVE, OVER, PLAY, THROW_MOVE, Match
+
+# Players seen by the bot - whose throws it learns from
+BOWLING, BATTING = 0, 1
+
+
+class RandomBot:
+    """
+    Bot of `handcricket.py` - every throw uniformly random
+
+    Bot Strategy Interface
+      call() -> `odd` / `even`
+      choose() -> `bat` / `ball`
+      throw(batting) -> 0 - 6, batting is None for the toss
+      observe(throw, opponent_batting) - the opponent's throw once the ball is played
+    """
+    __slots__ = ("rng",)
+
+    def __init__(self, rng=None):
+        self.rng = rng or random.Random()
+
+    def call(self):
+        return "even" if self.rng.getrandbits(1) else "odd"
+
+    def choose(self):
+        return "bat" if self.rng.getrandbits(1) else "ball"
+
+    def throw(self, batting):
+        return self.rng.randint(0, 6)
+
+    def observe(self, throw, opponent_batting):
+        pass
+
+
+class MarkovBot(RandomBot):
+    __slots__ = ("order", "modulo", "epsilon", "tables", "frequencies", "contexts", "seen")
+
+    def __init__(self, order=2, epsilon=0.05, rng=None):
+        """
+        Predicts the opponent's next throw from its last `order` throws in the same role
+
+        Counts are updated in O(1) per ball, the context of the last throws is a single rolling base 7 integer
+        :param order: Number of previous throws the prediction depends on, 0 for plain throw frequencies
+        :param epsilon: Probability of a random throw, keeps the bot from being read back
+        :param rng: random.Random to draw from
+        """
+        super().__init__(rng)
+        self.order = order
+        self.modulo = 7 ** order
+        self.epsilon = epsilon
+        # Per opponent role - context -> counts of the throws that followed it
+        self.tables = ({}, {})
+        self.frequencies = ([0] * 7, [0] * 7)
+        self.contexts = [0, 0]
+        self.seen = [0, 0]
+
+    def predict(self, role):
+        """
+        :param role: BOWLING or BATTING - role of the opponent
+        :return: list of 7 counts - how often the opponent threw 0 - 6 in the current context
+        """
+        if self.seen[role] >= self.order:
+            counts = self.tables[role].get(self.contexts[role])
+            if counts is not None:
+                return counts
+        return self.frequencies[role]
+
+    def throw(self, batting):
+        if batting is None or self.rng.random() < self.epsilon:
+            return self.rng.randint(0, 6)
+        if batting:
+            # Most expected runs - the throw times the chance of the opponent not matching it
+            counts = self.predict(BOWLING)
+            total = sum(counts) + 7
+            return max(range(7), key=lambda throw: throw * (total - counts[throw] - 1))
+        # Most likely throw of the batting opponent gets it out
+        counts = self.predict(BATTING)
+        return max(range(7), key=counts.__getitem__)
+
+    def observe(self, throw, opponent_batting):
+        role = BATTING if opponent_batting else BOWLING
+        context = self.contexts[role]
+        counts = self.tables[role].get(context)
+        if counts is None:
+            counts = self.tables[role][context] = [0] * 7
+        counts[throw] += 1
+        self.frequencies[role][throw] += 1
+        self.contexts[role] = (context * 7 + throw) % self.modulo if self.modulo > 1 else 0
+        self.seen[role] += 1
+
+
+class FrequencyBot(MarkovBot):
+    __slots__ = ()
+
+    def __init__(self, epsilon=0.05, rng=None):
+        """
+        Predicts the opponent's next throw from how often it threw each number in the same role
+        """
+        super().__init__(order=0, epsilon=epsilon, rng=rng)
+
+
+BOTS = {
+    "random": RandomBot,
+    "frequency": FrequencyBot,
+    "markov": MarkovBot,
+}
+
+
+class PatternPlayer(RandomBot):
+    __slots__ = ("weights", "pattern", "repeat", "last", "position")
+
+    def __init__(self, weights=None, pattern=None, repeat=0.0, rng=None):
+        """
+        Scripted stand in for a human, for the benchmark
+        :param weights: Relative weights of throwing 0 - 6
+        :param pattern: Sequence of throws cycled through, overrides the weights
+        :param repeat: Probability of throwing the previous throw again
+        """
+        super().__init__(rng)
+        self.weights = weights or [1] * 7
+        self.pattern = pattern
+        self.repeat = repeat
+        self.last = None
+        self.position = 0
+
+    def throw(self, batting):
+        if self.pattern:
+            self.position = (self.position + 1) % len(self.pattern)
+            return self.pattern[self.position]
+        if self.last is None or self.rng.random() >= self.repeat:
+            self.last = self.rng.choices(range(7), self.weights)[0]
+        return self.last
+
+
+OPPONENTS = {
+    "uniform": lambda rng: PatternPlayer(rng=rng),
+    "likes_six": lambda rng: PatternPlayer(weights=[1, 1, 1, 1, 2, 3, 5], rng=rng),
+    "cycle": lambda rng: PatternPlayer(pattern=[1, 2, 3, 4, 5, 6], rng=rng),
+    "sticky": lambda rng: PatternPlayer(repeat=0.5, rng=rng),
+}
+
+
+def play_match(bot, opponent):
+    """
+    Plays a Match on the Server's state machine, the bot in seat 0
+    :return: Seat that won, None on a draw
+    """
+    match = Match(0, (None, None))
+    players = (bot, opponent)
+    while match.state != OVER:
+        batting = match.batting
+        throws = {}
+        for seat, player in enumerate(players):
+            move = match.expects(seat)
+            if move == CALL_MOVE:
+                match.move(seat, move, player.call())
+            elif move == CHOOSE_MOVE:
+                match.move(seat, move, player.choose())
+            elif move == THROW_MOVE:
+                throws[seat] = player.throw((seat == batting) if match.state == PLAY else None)
+        played_ball = match.state == PLAY and len(throws) == 2
+        for seat, throw in throws.items():
+            match.move(seat, THROW_MOVE, throw)
+        if played_ball:
+            for seat, player in enumerate(players):
+                player.observe(throws[1 - seat], (1 - seat) == batting)
+    return match.winner()
+
+
+def benchmark(matches, decisions, seed):
+    rng = random.Random(seed)
+    print(f"{'Bot':>10} {'Decision':>10}", ' '.join(f"{name:>10}" for name in OPPONENTS))
+    for name, bot_type in BOTS.items():
+        # Decision Latency - a throw and the observation of the opponent's
+        bot = bot_type(rng=random.Random(seed))
+        started = time.perf_counter()
+        for decision in range(decisions):
+            batting = decision & 1 == 0
+            bot.observe(bot.throw(batting) % 7, not batting)
+        latency = (time.perf_counter() - started) / decisions * 1e6
+
+        win_rates = []
+        for opponent_type in OPPONENTS.values():
+            bot = bot_type(rng=random.Random(rng.random()))
+            opponent = opponent_type(random.Random(rng.random()))
+            # The same bot and opponent over all the matches, as against a player that stays
+            wins = sum(play_match(bot, opponent) == 0 for _ in range(matches))
+            win_rates.append(wins / matches)
+        print(f"{name:>10} {latency:>8.2f}us", ' '.join(f"{rate:>10.1%}" for rate in win_rates))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Decision Latency and Win Rate of the Hand Cricket Bots',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--matches', type=int, help='Matches against every scripted opponent', default=2000)
+    parser.add_argument('-d', '--decisions', type=int, help='Decisions timed per bot', default=200000)
+    parser.add_argument('--seed', type=int, help='Random Seed for reproducible runs', default=1)
+
+    args = parser.parse_args()
+    benchmark(args.matches, args.decisions, args.seed)
@@ -1,59 +1,66 @@
 import argparse
+import os
+import queue
+import secrets
 import socket
+import sys
 import threading
-import time
 from tkinter import *
 
-FORMAT = "iso-8859-1"
+from lockstep import commitment
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT, Framer, create_socket
+import udp_profile
 
 # Dark Background Themes
 BG_COLOUR = ["#282828", "#383838", "#001122", "#102a44"]
 FG_COLOUR = ["#FFFFFF", "#8BADC1"]
 FONT_STYLE = "Lucida Console"
 
+# Score Box refresh interval in ms
+FRAME_INTERVAL = 16
+
 
-class UDPChatClient:
+class HandCricketClient:
     def __init__(self, packet_size, address_info, username, server_socket):
         """
-        UDP based Chat Client
+        UDP based Hand Cricket Client, the Server runs the Match and this only shows it
         :param packet_size: Amount of Information sent per message in Bytes
         :param address_info: Address Info got from the `socket.getAddrInfo` for Server
         :param username: Username of the Client
         :param server_socket: (IP, Port) of the server
         """
         # Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
-        # SOCK_DGRAM - Socket Type - UDP
-        self.client = socket.socket(address_info[0], socket.SOCK_DGRAM)
+        self.client = create_socket(address_info[0])
         self.server_socket = server_socket
         self.packet_size = packet_size
+        # Sends happen on both the receiver and the Tk Main Loop, every message is padded into Bytes of its own
+        self.framer = Framer(packet_size)
         self.username = username
-        self.dest_username = ''
-
-        # Main Chat Window
+        self.opponent = ''
+        # Commit-Reveal Matches - (throw, nonce) committed to and not revealed yet
+        self.commit_reveal = False
+        self.pending_throw = None
+        # Receiver Thread -> Tk Main Loop
+        self.inbox = queue.SimpleQueue()
+
+        # Main Match Window
         self.window = Tk()
-        # At the Moment Hide, Open when recipient configured
+        # At the Moment Hide, Open when the Match starts
         self.window.withdraw()
 
     def server_handler(self):
         """"
-        Starts the Interaction with the Server for Chat
+        Starts the Interaction with the Server for a Match
         """
         # Sign in
         self.sign_in()
         print()
 
-        # Change Packet Size
-        if self.packet_size != 1024:
-            print(f"[PACKET SIZE] Requesting Server {self.server_socket} for changing size to {self.packet_size}")
-            message = self.pad(f"Size {self.packet_size}")
-            self.client.sendto(message.encode(FORMAT), self.server_socket)
-            # Receive message from server
-            response, self.server_socket = self.client.recvfrom(self.packet_size)
-            print(f"[PACKET SIZE] '{response.decode(FORMAT).strip()}' from {self.server_socket}")
-
-        # Chat
-        self._get_recipient()
-        receiver = threading.Thread(target=self.receive)
+        # Match
+        self._get_opponent()
+        receiver = threading.Thread(target=self.receive, daemon=True)
         receiver.start()
         self.gui_run()
         self.disconnect()
@@ -65,8 +72,7 @@ class UDPChatClient:
         If username already taken, repeats the process
         """
         while True:
-            message = self.pad(f"User {self.username}")
-            self.client.sendto(message.encode(FORMAT), self.server_socket)
+            self.client.sendto(self.framer.pad(f"User {self.username}"), self.server_socket)
             response, self.server_socket = self.client.recvfrom(self.packet_size)
             response = response.decode(FORMAT).strip()
             if response.lower()[:5] == "taken":
@@ -76,133 +82,172 @@ class UDPChatClient:
                 print(f"[SIGN IN] Successfully Signed in to Server {self.server_socket}")
                 break
 
-    def _get_recipient(self):
+    def _get_opponent(self):
         """
-        Interacts with Server to connect with the Recipient
-
-        Repeats until given an active username
+        Challenges an Opponent (or the bot), or joins the Matchmaking Queue, until a Match starts
         """
         while True:
-            dest_username = input("Enter the Username of the Recipient : ")
-            message = self.pad(f"Chat {dest_username}")
-            self.client.sendto(message.encode(FORMAT), self.server_socket)
-            response, self.server_socket = self.client.recvfrom(self.packet_size)
-            response = response.decode(FORMAT).strip()
-            if response.lower()[:2] == "no":
-                print(f"[USERNAME ERROR] Username '{dest_username}' not found, please provide another one")
-            else:
-                print(f"[CHAT ROOM] Successfully entered the chatroom with {dest_username}")
-                self.dest_username = dest_username
-                break
+            opponent = input("Enter the Username of the Opponent (bot for the bot, blank for anyone) : ").strip()
+            self.client.sendto(self.framer.pad(f"Play {opponent}".strip()), self.server_socket)
+            while True:
+                response, self.server_socket = self.client.recvfrom(self.packet_size)
+                response = response.decode(FORMAT).strip()
+                if response.lower()[:7] == "waiting":
+                    print(f"[MATCH] Waiting for {opponent} to accept the challenge")
+                elif response.lower()[:6] == "queued":
+                    print("[MATCH] Waiting for an Opponent")
+                elif response.lower()[:9] == "challenge":
+                    print(f"[MATCH] {response.split()[1]} challenged you")
+                else:
+                    break
+            if response.lower()[:5] == "match":
+                self.opponent = response.split()[2]
+                self.commit_reveal = response.split()[-1].lower() == "commit" and len(response.split()) > 3
+                print(f"[MATCH] Match #{response.split()[1]} against {self.opponent}")
+                return
+            print(f"[MATCH ERROR] '{response}', please provide another Opponent")
 
     def disconnect(self):
         # Disconnect Message
         print(f"[SIGN OUT] Disconnecting from Server {self.server_socket}")
-        self.client.sendto(self.pad("Disconnect").encode(FORMAT), self.server_socket)
+        self.client.sendto(self.framer.pad("Disconnect"), self.server_socket)
         exit(0)
 
-    def send(self):
+    def send(self, event=None):
         """
-        Takes the message from Tkinter Message Box on Send Button
-
-        Sends the message to Server
-
-        Inserts the message onto the Tkinter Chat Box
+        Takes the move from the Tkinter Move Box and sends it to Server
+          odd / even - Toss Call
+          bat / ball - Choice after winning the Toss
+          0 - 6      - Throw, only committed to first in Commit-Reveal Matches
         """
-        message = self.message_box.get()
-        if message.lower() == "disconnect":
+        move = self.move_box.get().strip().lower()
+        self.move_box.delete(0, END)
+        if move == "disconnect":
             self.disconnect()
-
-        # Insert the Message on Chat Box
-        self.chat_box.insert(END, f"You : {message}")
-        # Send Message To Server
-        message = self.pad(f"Chat {self.dest_username} " + message)
-        self.client.sendto(message.encode(FORMAT), self.server_socket)
-
-    def sender_thread(self):
-        sender = threading.Thread(target=self.send)
-        sender.start()
+        elif move in ("o", "e", "odd", "even"):
+            message = f"Call {'even' if move[0] == 'e' else 'odd'}"
+        elif move in ("bat", "ball"):
+            message = f"Choose {move}"
+        elif move.isdigit() and self.commit_reveal:
+            nonce = secrets.token_hex(8)
+            self.pending_throw = (move, nonce)
+            message = f"Commit {commitment(move, nonce)}"
+        elif move.isdigit():
+            message = f"Throw {move}"
+        else:
+            self.inbox.put("Type odd / even, bat / ball or a throw [0 - 6]")
+            return
+        self.client.sendto(self.framer.pad(message), self.server_socket)
 
     def receive(self):
         """
-        Receives messages from Server, processes and inserts on Tkinter Chat Box
+        Receives the Match updates from Server and hands them over to the Tk Main Loop
         """
         while True:
             response, self.server_socket = self.client.recvfrom(self.packet_size)
             response = response.decode(FORMAT).strip()
-            if response.lower() == f"no {self.dest_username} found":
-                message = f"{self.dest_username} disconnected from Server"
-                self.disconnect()
-                break
-            elif response.lower() == "disconnected":
+            if response.lower() == "disconnected":
                 break
-            else:
-                response = response.split()
-                message = f"{response[1]} : {' '.join(response[2:])}"
-            # Insert the message on Chat Box
-            time.sleep(0.1)
-            self.chat_box.insert(END, message)
-
-    def pad(self, message):
+            # Both committed, the throw can be shown now
+            if response.lower() == "reveal" and self.pending_throw is not None:
+                throw, nonce = self.pending_throw
+                self.pending_throw = None
+                self.client.sendto(self.framer.pad(f"Reveal {throw} {nonce}"), self.server_socket)
+                continue
+            self.inbox.put(self.describe(response))
+
+    def describe(self, response):
+        """
+        :param response: Stripped Server Message
+        :return: string - Human readable Match Update
         """
-        Pads the given message upto Packet Size Amount
-        :param message:
-        :return: string - Padded String
+        fields = response.split()
+        kind = fields[0].lower()
+        if kind == "call":
+            return "Call the toss - (o)dd or (e)ven"
+        if kind == "wait":
+            return f"{self.opponent} is calling the toss"
+        if kind == "toss" and fields[1].lower() in ("odd", "even"):
+            return f"Toss called {fields[1]} - throw [0 - 6]"
+        if kind == "toss":
+            return "You won the toss - bat or ball" if fields[1].lower() == "won" else \
+                f"{self.opponent} won the toss"
+        if kind == "innings":
+            target = f", target {fields[3]}" if len(fields) > 3 else ""
+            return f"Innings {fields[1]} - You {fields[2]}{target}"
+        if kind in ("ball", "out"):
+            prefix = "HOWZATTT!!! " if kind == "out" else ""
+            return f"{prefix}You {fields[1]} - {self.opponent} {fields[2]} : Score {fields[3]}"
+        if kind == "result" and fields[1].lower() == "draw":
+            return f"Draw. Both scored {fields[2]}"
+        if kind == "result" and fields[2].lower() == "forfeit":
+            return f"{self.opponent} left. You Won" if fields[1].lower() == "won" else "You Forfeited"
+        if kind == "late":
+            self.pending_throw = None
+            return f"Too slow - {fields[1]} {fields[2]} played for you"
+        if kind == "result":
+            return f"You {fields[1]} By {fields[2]}"
+        if kind == "invalid":
+            return f"Not now, expected : {fields[1]}"
+        return response
+
+    def drain_inbox(self):
         """
-        message = message.encode(FORMAT)
-        if len(message) < self.packet_size:
-            message += b' ' * (self.packet_size - len(message))
-        return message.decode(FORMAT)
+        Runs on the Tk Main Loop every frame, inserts the updates received since the last frame at once
+        """
+        updates = []
+        try:
+            while True:
+                updates.append(self.inbox.get_nowait())
+        except queue.Empty:
+            pass
+        if updates:
+            self.score_box.insert(END, *updates)
+            self.score_box.see(END)
+        self.window.after(FRAME_INTERVAL, self.drain_inbox)
 
     def gui_run(self):
         """
-        Runs the Tkinter Chat Window
+        Runs the Tkinter Match Window
         """
         self._window_layout()
         self.window.mainloop()
 
     def _window_layout(self):
         """
-        Chat Window Layout
+        Match Window Layout
         """
         # Open Window Now
         self.window.deiconify()
-        # Main Skeleton of the Chat Window
-        self.window.title(self.username)
+        # Main Skeleton of the Match Window
+        self.window.title(f"{self.username} vs {self.opponent}")
         self.window.resizable(width=False, height=False)
-        self.window.configure(width=300, height=500, bg=BG_COLOUR[0])
-        # self.window.iconbitmap("Chat_Icon.ico")
-
-        # Message Entry Box
-        message = StringVar()
-        self.message_box = Entry(self.window, textvariable=message, border=2, width=32)
-        self.message_box.configure(background=BG_COLOUR[1], foreground=FG_COLOUR,
-                                   font=(FONT_STYLE, 10, "bold"))
-        self.message_box.place(x=10, y=440)
-
-        # create a Send Button - Self.image So no Garbage Collection
-        self.button_image = PhotoImage(file="Send_Button.png")
-        # button_image = button_image.subsample(2)
-        send_button = Button(self.window, image=self.button_image,
-                             command=self.sender_thread, borderwidth=0)
-        send_button.configure(background=BG_COLOUR[0], highlightbackground=BG_COLOUR[1], highlightthickness=0)
-        # Place the Send Button in the Chat Window
-        send_button.place(x=250, y=430)
-
-        # Chat Box
-        self.chat_box = Listbox(self.window, height=30, width=38)
-        self.chat_box.configure(background=BG_COLOUR[1],  foreground=FG_COLOUR)
-        # Place the Chat Box Inside thw Window
-        self.chat_box.place(x=15, y=20)
-        # Place the scroll bar on Chat Box
-        scroll_bar = Scrollbar(self.chat_box)
+        self.window.configure(width=300, height=500, bg=BG_COLOUR[2])
+
+        # Move Entry Box - Enter sends the move
+        move = StringVar()
+        self.move_box = Entry(self.window, textvariable=move, border=2, width=32)
+        self.move_box.configure(background=BG_COLOUR[3], foreground=FG_COLOUR[0],
+                                font=(FONT_STYLE, 10, "bold"))
+        self.move_box.place(x=10, y=440)
+        self.move_box.bind("<Return>", self.send)
+
+        # Score Box
+        self.score_box = Listbox(self.window, height=30, width=38)
+        self.score_box.configure(background=BG_COLOUR[3], foreground=FG_COLOUR[1])
+        # Place the Score Box Inside the Window
+        self.score_box.place(x=15, y=20)
+        # Place the scroll bar on Score Box
+        scroll_bar = Scrollbar(self.score_box)
         scroll_bar.place(relheight=1, relx=0.974)
 
-        scroll_bar.config(command=self.chat_box.yview)
+        scroll_bar.config(command=self.score_box.yview)
+
+        self.drain_inbox()
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='UDP Hand Cricket Client - Built over UDP Echo Client',
+    parser = argparse.ArgumentParser(description='UDP Hand Cricket Client - Built over UDP Chat Client',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-v', '--version', action='version', version='v1.0')
     parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS/DOMAIN_NAME",
@@ -210,10 +255,11 @@ if __name__ == '__main__':
                         default=socket.gethostbyname(socket.gethostname()))
     parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER",
                         help='UDP Hand Cricket Server Port Number to connect to', default=7776)
-    parser.add_argument('-s', '--size', type=int, help='UDP Hand Cricket Packet Size in Bytes', default=20,
+    parser.add_argument('-s', '--size', type=int, help='UDP Hand Cricket Packet Size in Bytes', default=64,
                         metavar="PACKET_SIZE")
     parser.add_argument('-u', '--username', help='Username Client Wants to use',
                         metavar="USER_NAME", required=True)
+    udp_profile.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -225,11 +271,12 @@ if __name__ == '__main__':
     )[0]
 
     # Instantiate Client
-    client = UDPChatClient(
+    client = HandCricketClient(
         username=args.username,
         packet_size=args.size,
         address_info=address_info,
         server_socket=(address_info[4][0], address_info[4][1])
     )
 
+    udp_profile.from_arguments(args, client)
     client.server_handler()
@@ -1,22 +1,49 @@
 from random import randint, getrandbits
 import sys
 
-toss = 'e' == input('(o)dd or (e)ven: ')
-throw = lambda: int(input('throw [0 - 6]: ')) % 7
+
+def bot_throw():
+    return randint(0, 6)
 
 
 def botchoice():
-    c = randint(0, 6)
+    c = bot_throw()
     print(f'bot threw      {c}')
     return c
 
 
-isfirstplayer = toss == ((throw() + botchoice()) % 2 == 0)
-if isfirstplayer:
-    firstbat = 't' == input('Player won the toss. Ba(t) or Bal(l): ')
-else:
-    firstbat = bool(getrandbits(1))
-    print("Bot won the toss and it chose to " + f"{'Bat' if not firstbat else 'Ball'}")
+def toss(call_even, throw_one, throw_two):
+    """
+    :param call_even: True if the caller called even
+    :return: True if the caller won the toss
+    """
+    return call_even == ((throw_one + throw_two) % 2 == 0)
+
+
+def ball(score, bat, bowl, target=sys.maxsize):
+    """
+    Plays a single ball
+    :param score: Score of the batting side before the ball
+    :param bat: Throw of the batting side
+    :param bowl: Throw of the bowling side
+    :param target: Score to beat, sys.maxsize in the first innings
+    :return: (score, innings over)
+    """
+    if bat == bowl:
+        return score, True
+    score += bat
+    return score, score > target
+
+
+def result(first, second):
+    """
+    :param first: Score of the side batting first
+    :param second: Score of the side batting second
+    :return: (0 if the side batting first won, 1 if the other, None on a draw), margin
+    """
+    if first == second:
+        return None, 0
+    return (0 if first > second else 1), abs(first - second)
 
 
 def Innings(inn, target=sys.maxsize):
@@ -27,23 +54,37 @@ def Innings(inn, target=sys.maxsize):
         if p == b:
             print('HOWZATTT!!!')
             break
-        s += p if inn else b
-        if s > target:
+        s, over = ball(s, p if inn else b, b if inn else p, target)
+        if over:
             break
     print(f'Score: {s}')
     return s
 
 
-print('\n\nFirst Innings ....\n')
-f = Innings(firstbat)
+throw = lambda: int(input('throw [0 - 6]: ')) % 7
+
+
+if __name__ == '__main__':
+    call_even = 'e' == input('(o)dd or (e)ven: ')
+
+    isfirstplayer = toss(call_even, throw(), botchoice())
+    if isfirstplayer:
+        firstbat = 't' == input('Player won the toss. Ba(t) or Bal(l): ')
+    else:
+        firstbat = bool(getrandbits(1))
+        print("Bot won the toss and it chose to " + f"{'Bat' if not firstbat else 'Ball'}")
+
+    print('\n\nFirst Innings ....\n')
+    f = Innings(firstbat)
 
-print('\n\nSecond Innings ....\n')
-l = Innings(not firstbat, f)
+    print('\n\nSecond Innings ....\n')
+    l = Innings(not firstbat, f)
 
-if f != l:
-    res = 'You Won' if firstbat == (f > l) else 'You Lost'
-    res += f" By {abs(f - l)}"
-else:
-    res = f'Draw. Both scored {f}'
+    winner, margin = result(f, l)
+    if winner is not None:
+        res = 'You Won' if firstbat == (winner == 0) else 'You Lost'
+        res += f" By {margin}"
+    else:
+        res = f'Draw. Both scored {f}'
 
-print(res)
+    print(res)
@@ -0,0 +1,254 @@
+import argparse
+import os
+import random
+import time
+
+# Levels of the Skip List, enough for 2 ** 32 players
+MAX_LEVEL = 32
+
+
+class Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level):
+        self.key = key
+        self.next = [None] * level
+        # Positions skipped by following next on each level
+        self.width = [1] * level
+
+
+class SkipList:
+    def __init__(self, rng=None):
+        """
+        Indexable Skip List - a sorted sequence of keys with O(log n) insert, remove, rank and index lookup
+
+        Every link also stores how many positions it skips, so the position of a key is summed up on the
+        way down instead of counted at the bottom
+        :param rng: random.Random deciding the level of the inserted nodes
+        """
+        self.rng = rng or random.Random()
+        self.head = Node(None, MAX_LEVEL)
+        self.size = 0
+        # Highest level any node reached, the ones above are only the head's empty links
+        self.level = 1
+
+    def _level(self):
+        level = 1
+        while level < MAX_LEVEL and self.rng.getrandbits(1):
+            level += 1
+        return level
+
+    def _chain(self, key):
+        """
+        :return: (last node before the key on every level, its position - the head being 0)
+        """
+        chain = [self.head] * MAX_LEVEL
+        positions = [0] * MAX_LEVEL
+        node, position = self.head, 0
+        for level in reversed(range(self.level)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+            chain[level], positions[level] = node, position
+        return chain, positions
+
+    def insert(self, key):
+        chain, positions = self._chain(key)
+        # Position the new node takes
+        position = positions[0] + 1
+        node = Node(key, self._level())
+        # The head's link on a new level skips the whole list
+        for level in range(self.level, len(node.next)):
+            self.head.width[level] = self.size + 1
+        self.level = max(self.level, len(node.next))
+        for level in range(len(node.next)):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            node.width[level] = previous.width[level] - (position - positions[level]) + 1
+            previous.width[level] = position - positions[level]
+        for level in range(len(node.next), self.level):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._chain(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self.level):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        """
+        :return: 0 based position of the key, None if not present
+        """
+        chain, positions = self._chain(key)
+        node = chain[0].next[0]
+        return positions[0] if node is not None and node.key == key else None
+
+    def slice(self, start, count):
+        """
+        :return: Generator of upto count keys from the 0 based position start on
+        """
+        node, remaining = self.head, start + 1
+        for level in reversed(range(self.level)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        # On the key before start if it is past the end
+        if remaining:
+            return
+        while node is not None and count > 0:
+            yield node.key
+            node = node.next[0]
+            count -= 1
+
+    def __len__(self):
+        return self.size
+
+
+class Leaderboard:
+    def __init__(self, path=None, k_factor=32, initial=1500.0, snapshot_interval=60):
+        """
+        Elo Ratings of the players, ranked by a Skip List ordered by (-rating, username)
+
+        A result, a rank lookup and the first entry of a top k are all O(log n). The ratings are written to a
+        snapshot in rank order, so a restart only reads them back in
+        :param path: Snapshot File, None to keep the ratings only in memory
+        :param k_factor: Largest change of a rating in a single Match
+        :param initial: Rating of a new player
+        :param snapshot_interval: Time in sec between snapshots, taken only if a rating changed
+        """
+        self.path = path
+        self.k_factor = k_factor
+        self.initial = initial
+        self.snapshot_interval = snapshot_interval
+        # Username -> [Rating, Wins, Losses, Draws]
+        self.players = {}
+        self.order = SkipList()
+        self.dirty = False
+        self.next_snapshot = time.monotonic() + snapshot_interval
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as snapshot:
+            for line in snapshot:
+                fields = line.split()
+                if len(fields) != 5:
+                    continue
+                player = [float(fields[1])] + [int(count) for count in fields[2:]]
+                self.players[fields[0]] = player
+                self.order.insert((-player[0], fields[0]))
+
+    def _player(self, name):
+        player = self.players.get(name)
+        if player is None:
+            player = self.players[name] = [self.initial, 0, 0, 0]
+            self.order.insert((-player[0], name))
+        return player
+
+    def record(self, first, second, score):
+        """
+        Updates the ratings of both players of a Match
+        :param first: Username of one player
+        :param second: Username of the other
+        :param score: 1 if first won, 0 if it lost, 0.5 on a draw
+        :return: (new rating of first, new rating of second)
+        """
+        player_a, player_b = self._player(first), self._player(second)
+        expected = 1 / (1 + 10 ** ((player_b[0] - player_a[0]) / 400))
+        change = self.k_factor * (score - expected)
+        for name, player, delta, outcome in ((first, player_a, change, score), (second, player_b, -change,
+                                                                                  1 - score)):
+            self.order.remove((-player[0], name))
+            player[0] += delta
+            self.order.insert((-player[0], name))
+            player[1 if outcome == 1 else 2 if outcome == 0 else 3] += 1
+        self.dirty = True
+        return player_a[0], player_b[0]
+
+    def rank(self, name):
+        """
+        :return: (1 based Rank, Rating) of the player, None if it never played
+        """
+        player = self.players.get(name)
+        if player is None:
+            return None
+        return self.order.rank((-player[0], name)) + 1, player[0]
+
+    def top(self, count, start=1):
+        """
+        :return: list of (Username, Rating) of upto count players from the 1 based rank start on
+        """
+        return [(name, -rating) for rating, name in self.order.slice(start - 1, count)]
+
+    def poll(self, now=None):
+        """
+        Takes a snapshot once every interval if a rating changed since the last one
+        """
+        now = time.monotonic() if now is None else now
+        if now < self.next_snapshot:
+            return
+        self.next_snapshot = now + self.snapshot_interval
+        if self.dirty:
+            self.snapshot()
+
+    def snapshot(self):
+        """
+        Writes the ratings in rank order to a temporary file and swaps it in, a crash keeps the previous one
+        """
+        if self.path is None:
+            return
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as snapshot:
+            for rating, name in self.order.slice(0, len(self.order)):
+                _, wins, losses, draws = self.players[name]
+                snapshot.write(f"{name} {-rating!r} {wins} {losses} {draws}\n")
+            snapshot.flush()
+            os.fsync(snapshot.fileno())
+        os.replace(temporary, self.path)
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.players)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Timing of the Hand Cricket Leaderboard operations',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--players', type=int, help='Number of rated players', default=100000)
+    parser.add_argument('-m', '--matches', type=int, help='Results recorded', default=200000)
+    parser.add_argument('--seed', type=int, help='Random Seed for reproducible runs', default=1)
+
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    leaderboard = Leaderboard()
+    leaderboard.order.rng = rng
+    names = [f"player{player}" for player in range(args.players)]
+
+    started = time.perf_counter()
+    for _ in range(args.matches):
+        first, second = rng.sample(names, 2)
+        leaderboard.record(first, second, rng.choice((0, 0.5, 1)))
+    record_time = (time.perf_counter() - started) / args.matches
+
+    started = time.perf_counter()
+    for name in names:
+        leaderboard.rank(name)
+    rank_time = (time.perf_counter() - started) / len(names)
+
+    started = time.perf_counter()
+    for start in range(1, 1001):
+        leaderboard.top(10, rng.randint(1, len(leaderboard)))
+    top_time = (time.perf_counter() - started) / 1000
+
+    print(f"[LEADERBOARD] {len(leaderboard)} players - record {record_time * 1e6:.1f}us, "
+          f"rank {rank_time * 1e6:.1f}us, top 10 {top_time * 1e6:.1f}us")
+    print("[TOP]", ' '.join(f"{name}:{rating:.0f}" for name, rating in leaderboard.top(5)))
@@ -0,0 +1,218 @@
+import hashlib
+import heapq
+import itertools
+import time
+from collections import deque
+
+from match import OVER
+
+
+def commitment(throw, nonce):
+    """
+    :param throw: Throw 0 - 6
+    :param nonce: Random string chosen by the Client for this throw only
+    :return: string - Hex Digest the Client commits to before any throw of the ball is revealed
+    """
+    return hashlib.sha256(f"{throw}:{nonce}".encode()).hexdigest()[:32]
+
+
+class DeadlineScheduler:
+    def __init__(self):
+        """
+        Single min-heap of deadlines for all the Matches
+
+        Re-arming or cancelling a key does not touch the heap, the stale entries are skipped when they come up
+        """
+        self.heap = []
+        # Key -> its only live deadline
+        self.deadlines = {}
+        self.counter = itertools.count()
+
+    def schedule(self, key, delay, now=None):
+        now = time.monotonic() if now is None else now
+        deadline = now + delay
+        self.deadlines[key] = deadline
+        heapq.heappush(self.heap, (deadline, next(self.counter), key))
+        # Mostly stale entries - rebuild from the live ones
+        if len(self.heap) > 2 * len(self.deadlines) + 64:
+            self.heap = [(deadline, next(self.counter), key) for key, deadline in self.deadlines.items()]
+            heapq.heapify(self.heap)
+
+    def cancel(self, key):
+        self.deadlines.pop(key, None)
+
+    def expire(self, now=None):
+        """
+        :return: list of keys whose deadline passed, they are no longer scheduled
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self.heap)
+            if self.deadlines.get(key) == deadline:
+                del self.deadlines[key]
+                expired.append(key)
+        return expired
+
+    def __len__(self):
+        return len(self.deadlines)
+
+
+class Turn:
+    __slots__ = ("opened_at", "commits", "revealing", "strikes")
+
+    def __init__(self):
+        self.opened_at = 0.0
+        # Digest committed per seat for the current throw, None until committed
+        self.commits = [None, None]
+        self.revealing = False
+        # Deadlines missed in a row per seat
+        self.strikes = [0, 0]
+
+
+class Lockstep:
+    def __init__(self, turn_timeout=30, commit_reveal=False, max_strikes=3, history=1024):
+        """
+        Paces the Matches - every move has a deadline, and with commit-reveal every throw of a ball is first
+        committed to by both seats and only then revealed, so nobody can wait to see the other's throw
+
+        All the deadlines are kept in a single DeadlineScheduler polled by the Server's receive loop
+        :param turn_timeout: Time in sec a seat has for a move (or each of commit and reveal), None for no deadline
+        :param commit_reveal: True to have the throws committed to before they are revealed
+        :param max_strikes: Deadlines a seat may miss in a row, a default move is made for it until then,
+                            after that it forfeits
+        :param history: Number of recent ball resolution times kept for the percentiles
+        """
+        self.turn_timeout = turn_timeout
+        self.commit_reveal = commit_reveal
+        self.max_strikes = max_strikes
+        self.scheduler = DeadlineScheduler()
+        # Match -> Turn
+        self.turns = {}
+        self.resolve_times = deque(maxlen=history)
+        self.late = 0
+        self.forfeits = 0
+
+    def start(self, match):
+        self.turns[match] = Turn()
+        self.open(match)
+
+    def end(self, match):
+        self.turns.pop(match, None)
+        self.scheduler.cancel(match)
+
+    def open(self, match, now=None):
+        """
+        Starts the next turn of the Match, after a move that did not leave a throw waiting for its pair
+        """
+        turn = self.turns.get(match)
+        if turn is None or match.state == OVER:
+            return
+        turn.opened_at = time.monotonic() if now is None else now
+        turn.commits = [None, None]
+        turn.revealing = False
+        self.arm(match, turn.opened_at)
+
+    def arm(self, match, now=None):
+        if self.turn_timeout is not None:
+            self.scheduler.schedule(match, self.turn_timeout, now)
+
+    def armed(self, match):
+        return match in self.scheduler.deadlines
+
+    def resolved(self, match, now=None):
+        """
+        A ball (or the toss) was played, records how long it took and opens the next turn
+        """
+        turn = self.turns.get(match)
+        if turn is None:
+            return
+        now = time.monotonic() if now is None else now
+        self.resolve_times.append(now - turn.opened_at)
+        self.open(match, now)
+
+    def on_time(self, match, seat):
+        turn = self.turns.get(match)
+        if turn is not None:
+            turn.strikes[seat] = 0
+
+    def strike(self, match, seat):
+        """
+        Counts a missed deadline of the seat
+        :return: True if the seat has to forfeit
+        """
+        turn = self.turns[match]
+        turn.strikes[seat] += 1
+        if turn.strikes[seat] > self.max_strikes:
+            self.forfeits += 1
+            return True
+        self.late += 1
+        return False
+
+    def commit(self, match, seat, digest):
+        """
+        :return: True if every seat that still has to throw has now committed
+        """
+        turn = self.turns[match]
+        turn.commits[seat] = digest
+        return self.all_committed(match)
+
+    def all_committed(self, match):
+        # The bot's throw is made on the Server, it is in before anyone commits
+        return all(match.players[seat] is None or match.throws[seat] >= 0 or self.turns[match].commits[seat]
+                   for seat in (0, 1))
+
+    def start_reveal(self, match):
+        """
+        :return: list of the seats that have to reveal now
+        """
+        turn = self.turns[match]
+        turn.revealing = True
+        self.arm(match)
+        return [seat for seat in (0, 1) if turn.commits[seat] is not None and match.throws[seat] < 0]
+
+    def verify(self, match, seat, throw, nonce):
+        """
+        :return: True if the revealed throw is the one the seat committed to
+        """
+        turn = self.turns[match]
+        return turn.revealing and turn.commits[seat] is not None and commitment(throw, nonce) == turn.commits[seat]
+
+    def late_seats(self, match):
+        """
+        :return: list of the seats whose move is overdue
+        """
+        turn = self.turns[match]
+        late = []
+        for seat in (0, 1):
+            if match.players[seat] is None or match.expects(seat) is None:
+                continue
+            # With commit-reveal a seat that committed is only late once the reveal is overdue
+            if self.commit_reveal and turn.commits[seat] is not None and not turn.revealing:
+                continue
+            late.append(seat)
+        return late
+
+    def expire(self, now=None):
+        """
+        :return: list of the Matches whose turn is overdue
+        """
+        return [match for match in self.scheduler.expire(now) if match in self.turns]
+
+    def percentiles(self, points=(50, 90, 99)):
+        """
+        :return: dict - Percentile -> Ball Resolution Time in sec over the recent balls
+        """
+        if not self.resolve_times:
+            return {point: 0.0 for point in points}
+        ordered = sorted(self.resolve_times)
+        return {point: ordered[min(len(ordered) - 1, point * len(ordered) // 100)] for point in points}
+
+    def stats(self):
+        """
+        :return: dict - Late moves, Forfeits, armed Deadlines and Ball Resolution Time Percentiles in ms
+        """
+        stats = {"late": self.late, "forfeits": self.forfeits, "deadlines": len(self.scheduler)}
+        for point, resolve_time in self.percentiles().items():
+            stats[f"ball_p{point}_ms"] = round(resolve_time * 1000, 2)
+        return stats
@@ -0,0 +1,153 @@
+import sys
+
+from handcricket import ball, result, toss
+
+# Match States
+CALL, TOSS, CHOOSE, PLAY, OVER = range(5)
+STATE_NAMES = ("Call", "Toss", "Choose", "Play", "Over")
+
+# Moves
+CALL_MOVE, THROW_MOVE, CHOOSE_MOVE = "call", "throw", "choose"
+
+
+class Match:
+    # Thousands of matches live in a single Server, no per instance __dict__
+    __slots__ = ("match_id", "players", "state", "call_even", "throws", "batting", "innings", "score",
+                 "first_score")
+
+    def __init__(self, match_id, players):
+        """
+        Authoritative state machine of a single Hand Cricket Match, the rules are the ones of `handcricket.py`
+
+        Seat 0 calls the toss. The moves return the messages to send instead of sending them,
+        so the same Match is driven by the Server, the Simulator or a Replay
+        :param match_id: Identifier of the Match
+        :param players: (Player of seat 0, Player of seat 1), None for a bot
+        """
+        self.match_id = match_id
+        self.players = players
+        self.state = CALL
+        self.call_even = False
+        # Throws of the current ball (or toss) per seat, -1 until thrown
+        self.throws = [-1, -1]
+        # Seat batting, the toss winner while choosing
+        self.batting = 0
+        self.innings = 1
+        self.score = 0
+        self.first_score = 0
+
+    def start(self):
+        """
+        :return: list of (seat, message)
+        """
+        return [(0, "Call"), (1, "Wait Call")]
+
+    def expects(self, seat):
+        """
+        :return: Move expected from the seat, None if it has to wait
+        """
+        if self.state == CALL:
+            return CALL_MOVE if seat == 0 else None
+        if self.state == CHOOSE:
+            return CHOOSE_MOVE if seat == self.batting else None
+        if self.state in (TOSS, PLAY):
+            return THROW_MOVE if self.throws[seat] < 0 else None
+        return None
+
+    def move(self, seat, move, value):
+        """
+        Applies a move of a seat
+        :param seat: 0 or 1
+        :param move: One of `call`, `throw` or `choose`
+        :param value: `odd`/`even` for call, 0 - 6 for throw, `bat`/`ball` for choose
+        :return: list of (seat, message) to be sent
+        """
+        expected = self.expects(seat)
+        if move != expected:
+            return [(seat, f"Invalid {expected or 'Wait'}")]
+
+        if move == CALL_MOVE:
+            if value not in ("odd", "even"):
+                return [(seat, "Invalid Call")]
+            self.call_even = value == "even"
+            self.state = TOSS
+            return [(0, f"Toss {value}"), (1, f"Toss {value}")]
+
+        if move == CHOOSE_MOVE:
+            if value not in ("bat", "ball"):
+                return [(seat, "Invalid Choose")]
+            self.batting = seat if value == "bat" else 1 - seat
+            self.state = PLAY
+            return self._innings_messages()
+
+        if not str(value).isdigit() or not 0 <= int(value) <= 6:
+            return [(seat, "Invalid Throw")]
+        self.throws[seat] = int(value)
+        if min(self.throws) < 0:
+            return []
+        throws = self.throws
+        self.throws = [-1, -1]
+        if self.state == TOSS:
+            return self._toss(throws)
+        return self._ball(throws)
+
+    def _toss(self, throws):
+        winner = 0 if toss(self.call_even, throws[0], throws[1]) else 1
+        self.batting = winner
+        self.state = CHOOSE
+        return [(winner, "Toss Won"), (1 - winner, "Toss Lost")]
+
+    def _innings_messages(self):
+        target = f" {self.first_score + 1}" if self.innings == 2 else ""
+        return [(self.batting, f"Innings {self.innings} Bat{target}"),
+                (1 - self.batting, f"Innings {self.innings} Ball{target}")]
+
+    def _ball(self, throws):
+        bat, bowl = throws[self.batting], throws[1 - self.batting]
+        target = self.first_score if self.innings == 2 else sys.maxsize
+        self.score, over = ball(self.score, bat, bowl, target)
+        outcome = "Out" if bat == bowl else "Ball"
+        messages = [(seat, f"{outcome} {throws[seat]} {throws[1 - seat]} {self.score}") for seat in (0, 1)]
+        if not over:
+            return messages
+
+        if self.innings == 1:
+            self.first_score = self.score
+            self.innings = 2
+            self.batting = 1 - self.batting
+            self.score = 0
+            return messages + self._innings_messages()
+
+        self.state = OVER
+        first_batting = 1 - self.batting
+        winner, margin = result(self.first_score, self.score)
+        if winner is None:
+            return messages + [(seat, f"Result Draw {self.score}") for seat in (0, 1)]
+        winner = first_batting if winner == 0 else self.batting
+        return messages + [(winner, f"Result Won {margin}"), (1 - winner, f"Result Lost {margin}")]
+
+    def winner(self):
+        """
+        :return: Seat that won, None on a draw or if the Match is not over
+        """
+        if self.state != OVER:
+            return None
+        winner, _ = result(self.first_score, self.score)
+        if winner is None:
+            return None
+        return 1 - self.batting if winner == 0 else self.batting
+
+    def bot_move(self, seat, bot):
+        """
+        :param seat: Seat of the bot
+        :param bot: Bot Strategy, see `bots.RandomBot`
+        :return: (move, value) the bot makes for the seat, None if the seat has to wait
+        """
+        move = self.expects(seat)
+        if move == CALL_MOVE:
+            return move, bot.call()
+        if move == CHOOSE_MOVE:
+            return move, bot.choose()
+        if move == THROW_MOVE:
+            return move, bot.throw(seat == self.batting if self.state == PLAY else None)
+        return None
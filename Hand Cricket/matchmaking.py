@@ -0,0 +1,89 @@
+import time
+from collections import OrderedDict, deque
+
+
+class MatchQueue:
+    def __init__(self, bot_timeout=10, history=1024):
+        """
+        First come first served Matchmaking Queue, indexed by player
+
+        Joining, leaving and pairing are O(1) - the queue is an ordered dict, so a player leaving is removed by key
+        and the longest waiting player is always at the front
+        :param bot_timeout: Time in sec after which a waiting player is given the bot, None to wait forever
+        :param history: Number of recent waiting times kept for the percentiles
+        """
+        self.bot_timeout = bot_timeout
+        # Player -> time.monotonic() it joined at
+        self.waiting = OrderedDict()
+        self.wait_times = deque(maxlen=history)
+        self.paired = 0
+        self.bot_paired = 0
+        self.left = 0
+
+    def join(self, player):
+        """
+        Pairs the player with the longest waiting one, or queues it if nobody is waiting
+        :param player: Hashable Player
+        :return: Opponent, None if the player has been queued
+        """
+        now = time.monotonic()
+        if player in self.waiting:
+            return None
+        if not self.waiting:
+            self.waiting[player] = now
+            return None
+        opponent, joined = self.waiting.popitem(last=False)
+        self.wait_times.append(now - joined)
+        self.wait_times.append(0.0)
+        self.paired += 1
+        return opponent
+
+    def leave(self, player):
+        """
+        :return: True if the player was waiting
+        """
+        if self.waiting.pop(player, None) is None:
+            return False
+        self.left += 1
+        return True
+
+    def expire(self, now=None):
+        """
+        Removes the players that waited for longer than the bot timeout
+        :return: list of players to be given the bot
+        """
+        if self.bot_timeout is None:
+            return []
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self.waiting:
+            player, joined = next(iter(self.waiting.items()))
+            if now - joined < self.bot_timeout:
+                break
+            self.waiting.popitem(last=False)
+            self.wait_times.append(now - joined)
+            self.bot_paired += 1
+            expired.append(player)
+        return expired
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def percentiles(self, points=(50, 90, 99)):
+        """
+        :return: dict - Percentile -> Waiting Time in sec over the recent pairings
+        """
+        if not self.wait_times:
+            return {point: 0.0 for point in points}
+        ordered = sorted(self.wait_times)
+        return {point: ordered[min(len(ordered) - 1, point * len(ordered) // 100)] for point in points}
+
+    def stats(self):
+        """
+        :return: dict - Queue Depth, Pairings and Waiting Time Percentiles in ms
+        """
+        stats = {"depth": len(self.waiting), "paired": self.paired, "bot_paired": self.bot_paired,
+                 "left": self.left}
+        for point, wait in self.percentiles().items():
+            stats[f"wait_p{point}_ms"] = round(wait * 1000, 2)
+        return stats
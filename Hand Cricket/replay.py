@@ -0,0 +1,149 @@
+import argparse
+import os
+import struct
+import sys
+
+from match import CALL_MOVE, CHOOSE_MOVE, THROW_MOVE, Match
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT
+
+# Record Header - Match ID, Timestamp the Match ended, Names Length, Number of Events
+HEADER = struct.Struct("<IdHI")
+
+# Event - a single byte per move, the move in bits 4 - 5, the seat in bit 3 and the value in the low 3 bits
+MOVES = (CALL_MOVE, CHOOSE_MOVE, THROW_MOVE)
+VALUES = {CALL_MOVE: ("odd", "even"), CHOOSE_MOVE: ("bat", "ball")}
+
+
+def encode_event(seat, move, value):
+    """
+    :param seat: 0 or 1
+    :param move: One of `call`, `throw` or `choose`
+    :param value: Valid value of the move, see `Match.move`
+    :return: int - Event Byte
+    """
+    value = int(value) if move == THROW_MOVE else VALUES[move].index(value)
+    return MOVES.index(move) << 4 | seat << 3 | value
+
+
+def decode_event(event):
+    """
+    :return: (seat, move, value) of an Event Byte
+    """
+    move = MOVES[event >> 4]
+    value = event & 7
+    return (event >> 3) & 1, move, value if move == THROW_MOVE else VALUES[move][value]
+
+
+def replay(events, match=None):
+    """
+    Drives a Match with logged Events
+    :param events: Event Bytes
+    :param match: Match to continue from (a spectator's snapshot), a new one if None
+    :return: (Match, list of (seat, message) lists - one per Event)
+    """
+    match = Match(0, (None, None)) if match is None else match
+    return match, [match.move(*decode_event(event)) for event in events]
+
+
+class ReplayLog:
+    def __init__(self, path):
+        """
+        Append-only Log of finished Matches, one record per Match holding its Events - a byte per move,
+        two per ball
+
+        Only the location of every Match is kept in memory, the Events stay on disk until replayed
+        :param path: Path of the Log File
+        """
+        self.path = path
+        # Match ID -> (offset of the names, names length, number of events)
+        self.index = {}
+        self.size = 0
+        self.file = None
+        self.recover()
+
+    def recover(self):
+        """
+        Rebuilds the in-memory index by scanning only the Record Headers
+        """
+        if os.path.exists(self.path):
+            log_size = os.path.getsize(self.path)
+            with open(self.path, "rb") as log:
+                while True:
+                    header = log.read(HEADER.size)
+                    if len(header) < HEADER.size:
+                        break
+                    match_id, _, names_length, num_events = HEADER.unpack(header)
+                    end = self.size + HEADER.size + names_length + num_events
+                    if end > log_size:
+                        break
+                    # Skip the Names and Events, only their location is needed
+                    log.seek(end)
+                    self.index[match_id] = (self.size + HEADER.size, names_length, num_events)
+                    self.size = end
+            # Torn write at the end of the Log is cut off
+            if log_size != self.size:
+                with open(self.path, "r+b") as torn_log:
+                    torn_log.truncate(self.size)
+        self.file = open(self.path, "ab")
+
+    def append(self, match_id, names, events, timestamp):
+        """
+        :param match_id: Identifier of the Match
+        :param names: (Username of seat 0, Username of seat 1)
+        :param events: Event Bytes of the whole Match
+        :param timestamp: Time the Match ended at
+        """
+        names = '\t'.join(names).encode(FORMAT)
+        self.file.write(HEADER.pack(match_id, timestamp, len(names), len(events)) + names + bytes(events))
+        self.file.flush()
+        self.index[match_id] = (self.size + HEADER.size, len(names), len(events))
+        self.size += HEADER.size + len(names) + len(events)
+
+    def read(self, match_id):
+        """
+        :return: ((Username of seat 0, Username of seat 1), Event Bytes), None if the Match is not logged
+        """
+        location = self.index.get(match_id)
+        if location is None:
+            return None
+        offset, names_length, num_events = location
+        with open(self.path, "rb") as log:
+            log.seek(offset)
+            names = log.read(names_length).decode(FORMAT).split('\t')
+            return tuple(names), log.read(num_events)
+
+    def __contains__(self, match_id):
+        return match_id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def close(self):
+        self.file.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replays a logged Hand Cricket Match ball by ball',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('match_id', type=int, nargs='?', help='Match to replay, lists the logged ones if not given')
+    parser.add_argument('-l', '--log', type=str, metavar="FILE", help='Replay Log of the Server', default="Replays.log")
+
+    args = parser.parse_args()
+    replay_log = ReplayLog(args.log)
+    if args.match_id is None:
+        print(' '.join(str(match_id) for match_id in sorted(replay_log.index)))
+    elif args.match_id not in replay_log:
+        print(f"[REPLAY ERROR] Match #{args.match_id} not in {args.log}")
+    else:
+        names, events = replay_log.read(args.match_id)
+        print(f"[REPLAY] Match #{args.match_id} {names[0]} vs {names[1]} - {len(events)} events")
+        # Seat 0's view of the Match
+        _, updates = replay(events)
+        for messages in updates:
+            for seat, message in messages:
+                if seat == 0:
+                    print(f"  {names[0]} : {message}")
+    replay_log.close()
@@ -1,54 +1,244 @@
 import argparse
+import os
 import socket
+import sys
+import time
 
-FORMAT = "iso-8859-1"
+from bots import BOTS, RandomBot
+from leaderboard import Leaderboard
+from lockstep import Lockstep
+from match import Match, OVER, PLAY, THROW_MOVE
+from matchmaking import MatchQueue
+from replay import ReplayLog
+from spectators import SpectatorFeed
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import BufferPool, Dispatcher, Framer, create_socket, opcode, receive, text
+import udp_log
+import udp_metrics
+import udp_profile
 
-class UDPChatServer:
-    def __init__(self, address_info, packet_size):
+BOT = "bot"
+
+
+class HandCricketServer:
+    def __init__(self, address_info, packet_size, bot_timeout=10, tick=0.1, bot="markov", replay_log=None,
+                 leaderboard=None, turn_timeout=30, commit_reveal=False, max_strikes=3, log=None,
+                 registry=None):
+        """
+        Authoritative UDP Hand Cricket Server
+
+        Every Match is a small state machine, all of them are driven from a single receive loop
+        :param address_info: Address Info got from the `socket.getAddrInfo` for Server
+        :param packet_size: Amount of Information sent per message in Bytes
+        :param bot_timeout: Time in sec a player waits in the Matchmaking Queue before being given the bot
+        :param tick: Time in sec the receive loop waits before checking the timers
+        :param bot: Name of the Bot Strategy in `bots.BOTS` playing against lone players
+        :param replay_log: ReplayLog every finished Match is appended to, None to not keep them
+        :param leaderboard: Leaderboard rating the players, an in-memory one if None
+        :param turn_timeout: Time in sec a player has for each move, None for no deadline
+        :param commit_reveal: True to have the players commit to every throw before revealing it
+        :param max_strikes: Deadlines a player may miss in a row before forfeiting, a default move is made till then
+        :param log: udp_log.Logger of the Server, one logging at INFO to stdout if None
+        :param registry: udp_metrics.Registry the Server counters are added to, a private one if None
+        """
         self.server = None
+        self.log = log or udp_log.Logger()
+        self.registry = registry or udp_metrics.Registry()
         self.socket = (address_info[4][0], address_info[4][1])
         self.packet_size = packet_size
         self.address_info = address_info
+        # Username -> (IP, Port)
         self.active_clients = {}
+        # (IP, Port) -> [Username, Match, Seat]
+        self.players = {}
+        # Username -> Username it challenged
+        self.challenges = {}
+        # Players looking for any opponent
+        self.lobby = MatchQueue(bot_timeout=bot_timeout)
+        self.bot_type = BOTS[bot]
+        # Match -> Bot Strategy playing in it, learning from its opponent ball by ball
+        self.bots = {}
+        # Plays the default moves of the players missing a deadline
+        self.default_bot = RandomBot()
+        self.lockstep = Lockstep(turn_timeout=turn_timeout, commit_reveal=commit_reveal, max_strikes=max_strikes)
+        self.tick = tick
+        self.num_matches = 0
+        self.live_matches = 0
+        self.replay_log = replay_log
+        # Match IDs carry on from the Matches logged by earlier runs, so a new Match never takes the ID of a replay
+        self.first_match_id = max(replay_log.index, default=0) if replay_log is not None else 0
+        self.leaderboard = Leaderboard() if leaderboard is None else leaderboard
+        self.buffers = BufferPool(packet_size)
+        self.framer = Framer(packet_size)
+        # Commands of the signed in Clients
+        self.commands = Dispatcher()
+        for command, handler in (("play", self.on_play), ("leave", self.on_leave), ("watch", self.on_watch),
+                                 ("unwatch", self.on_unwatch), ("live", self.on_live), ("top", self.on_top),
+                                 ("rank", self.on_rank), ("stats", self.on_stats), ("disconnect", self.on_disconnect)):
+            self.commands.register(command, handler)
+        for move in ("call", "throw", "choose", "commit", "reveal"):
+            self.commands.register(move, self.on_move)
+        self.traffic = udp_metrics.TrafficMetrics(self.registry, set(self.commands.handlers) | {b"user"})
         self.initiate_server()
+        # What the Replay Log and the Leaderboard recovered is logged here, with the Server's own settings
+        if replay_log is not None:
+            self.log.info("REPLAY LOG", matches=len(replay_log.index), path=replay_log.path)
+        if self.leaderboard.path is not None:
+            self.log.info("LEADERBOARD", ratings=len(self.leaderboard), path=self.leaderboard.path)
+        # Spectators get the played balls once every tick
+        self.spectators = SpectatorFeed(self.sendto, packet_size, interval=tick)
+        self.add_metrics()
 
     def initiate_server(self):
         # Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
-        # SOCK_DGRAM - Socket Type - UDP
-        self.server = socket.socket(self.address_info[0], socket.SOCK_DGRAM)
-        # Port Bind the socket to the port
-        self.server.bind(self.socket)
-        print(f'[SERVER INITIATED] UDP File Transfer Server on {self.socket}')
+        # Port Bind the socket to the port, waking up every tick even when idle to run the timers
+        self.server = create_socket(self.address_info[0], self.socket, timeout=self.tick)
+        self.log.info("SERVER INITIATED", server="UDP Hand Cricket", address=self.socket)
+
+    def add_metrics(self):
+        """
+        Registers the Matchmaking and Match counters, all read on scrape only
+        """
+        udp_metrics.add_socket(self.registry, lambda: self.server)
+        udp_metrics.add_log(self.registry, self.log)
+        self.registry.gauge("hand_cricket_players", "Signed in players", function=lambda: len(self.players))
+        self.registry.gauge("hand_cricket_lobby_depth", "Players waiting for an opponent",
+                            function=lambda: len(self.lobby))
+        self.registry.counter("hand_cricket_pairings_total", "Matchmaking Queue outcomes", ("outcome",),
+                              function=lambda: {"paired": self.lobby.paired, "bot": self.lobby.bot_paired,
+                                                "left": self.lobby.left})
+        self.registry.gauge("hand_cricket_live_matches", "Matches being played", function=lambda: self.live_matches)
+        self.registry.counter("hand_cricket_matches_total", "Matches started", function=lambda: self.num_matches)
+        self.registry.gauge("hand_cricket_deadlines", "Armed move Deadlines",
+                            function=lambda: len(self.lockstep.scheduler))
+        self.registry.counter("hand_cricket_missed_deadlines_total", "Deadlines missed by outcome", ("outcome",),
+                              function=lambda: {"default_move": self.lockstep.late, "forfeit": self.lockstep.forfeits})
 
     def client_handler(self):
         """
         Handles all the interactions with Client(s)
         """
-
         while True:
-            data, client_socket = self.server.recvfrom(self.packet_size)
-            data = data.decode(FORMAT)
-            if data:
-                print(f"[MESSAGE RECEIVED] '{data.strip()}' from {client_socket} : bytes = {len(data)}")
-                if data.lower()[:4] == "user":
-                    self.new_client(user_name=data.split()[1], client_socket=client_socket)
-
-                # Message
-                elif data.lower()[:4] == "chat":
-                    dest_username = data.split()[1]
-                    message = ' '.join(data.split()[2:]) if len(data.split()) > 2 else ''
-                    self.send_message(self.find_user_by_socket(client_socket), dest_username, message)
-
-                # Packet Size Change
-                elif data.lower()[:4] == "size":
-                    self.packet_size = int(data.split()[1])
-                    response = self.pad(f"New Size - {self.packet_size}")
-                    print(f"[PACKET SIZE] - New Packet Size - {self.packet_size}")
-                    self.server.sendto(response.encode(FORMAT), client_socket)
-
-                elif data.lower().strip() == "disconnect":
-                    self.disconnect(self.find_user_by_socket(client_socket))
+            buffer = self.buffers.acquire()
+            try:
+                data, client_socket = receive(self.server, buffer, self.packet_size)
+            except socket.timeout:
+                data = None
+            if data is not None:
+                self.handle_datagram(data, client_socket)
+            self.buffers.release(buffer)
+            self.run_timers()
+
+    def run_timers(self):
+        """
+        Gives the bot to the players waiting in the Matchmaking Queue for too long, makes the moves of the
+        players that missed their deadline, flushes the spectator feeds and snapshots the Leaderboard
+        """
+        for client_socket in self.lobby.expire():
+            self.log.info("LOBBY", user=self.players[client_socket][0], status="bot")
+            self.start_match(client_socket, None)
+        for match in self.lockstep.expire():
+            self.turn_expired(match)
+        self.spectators.poll()
+        self.leaderboard.poll()
+
+    def handle_datagram(self, data, client_socket):
+        """
+        Counts and dispatches a single datagram from a Client
+        :param data: Received Bytes
+        :param client_socket: (IP, Port) of the Client
+        """
+        command = opcode(data)
+        if not command:
+            return
+        started = self.traffic.received(command, len(data))
+        self.dispatch(command, data, client_socket)
+        self.traffic.handled(started)
+
+    def dispatch(self, command, data, client_socket):
+        # Only `User` is taken before signing in
+        if self.log.enabled(udp_log.DEBUG):
+            self.log.debug("MESSAGE RECEIVED", command=command, client=client_socket, bytes=len(data))
+        fields = text(data).split()
+        if command == b"user" and len(fields) > 1:
+            self.new_client(fields[1], client_socket)
+            return
+        player = self.players.get(client_socket)
+        if player is None:
+            self.send(client_socket, "Sign In")
+            return
+        self.commands.handler(command)(fields, player, client_socket)
+
+    def on_play(self, fields, player, client_socket):
+        if len(fields) > 1:
+            self.challenge(player, fields[1])
+        # Matchmaking - Play against the next free player
+        else:
+            self.join_lobby(client_socket)
+
+    def on_leave(self, fields, player, client_socket):
+        if self.lobby.leave(client_socket):
+            self.send(client_socket, "Left")
+
+    def on_watch(self, fields, player, client_socket):
+        if len(fields) > 1 and (not fields[1].isdigit() or not self.spectators.watch(int(fields[1]), client_socket)):
+            self.send(client_socket, f"No Match {fields[1]}")
+
+    def on_unwatch(self, fields, player, client_socket):
+        self.spectators.unwatch(client_socket)
+
+    def on_live(self, fields, player, client_socket):
+        # IDs of the live Matches, as many as fit in a packet
+        live = "Live"
+        for match_id in self.spectators.live():
+            if len(live) + len(str(match_id)) + 1 > self.packet_size:
+                break
+            live += f" {match_id}"
+        self.send(client_socket, live)
+
+    def on_top(self, fields, player, client_socket):
+        # Leaderboard from a 1 based rank on, as many as fit in a packet
+        start = max(int(fields[1]), 1) if len(fields) > 1 and fields[1].isdigit() else 1
+        top = f"Top {start}"
+        for name, rating in self.leaderboard.top(self.packet_size // 8, start):
+            if len(top) + len(name) + len(f"{rating:.0f}") + 2 > self.packet_size:
+                break
+            top += f" {name}:{rating:.0f}"
+        self.send(client_socket, top)
+
+    def on_rank(self, fields, player, client_socket):
+        name = fields[1] if len(fields) > 1 else player[0]
+        rank = self.leaderboard.rank(name)
+        self.send(client_socket, f"Rank {name} {rank[0]} {rank[1]:.0f}" if rank else f"Unrated {name}")
+
+    def on_stats(self, fields, player, client_socket):
+        stats = ' '.join(f"{key}={value}" for key, value in self.stats().items())
+        self.send(client_socket, f"Stats {stats}")
+
+    def on_move(self, fields, player, client_socket):
+        """
+        `Call`, `Throw`, `Choose`, `Commit` or `Reveal` of the Client's Match
+        """
+        if len(fields) < 2:
+            return
+        move, value = fields[0].lower(), fields[1].lower()
+        if player[1] is None:
+            self.send(client_socket, "No Match")
+        elif move == "commit":
+            self.commit(player[1], player[2], value)
+        elif move == "reveal":
+            # The nonce is hashed as sent
+            if len(fields) > 2:
+                self.reveal(player[1], player[2], value, fields[2])
+        elif move == "throw" and self.lockstep.commit_reveal:
+            self.send(client_socket, "Invalid Commit")
+        # Only a valid move clears the missed deadlines, junk must not stall the Match forever
+        elif self.play(player[1], player[2], move, value):
+            self.lockstep.on_time(player[1], player[2])
+
+    def on_disconnect(self, fields, player, client_socket):
+        self.disconnect(client_socket)
 
     def new_client(self, user_name, client_socket):
         """
@@ -56,77 +246,296 @@ class UDPChatServer:
         :param user_name: Username of the Client
         :param client_socket: (IP, Port) of the Client
         """
-        response = ""
-        if self.active_clients.get(user_name):
-            print(f"[SIGN IN] Username already taken")
-            response = self.pad(f"Taken - {user_name}")
+        if user_name in self.active_clients or user_name.lower() == BOT:
+            self.log.info("SIGN IN", user=user_name, client=client_socket, status="taken")
+            self.send(client_socket, f"Taken - {user_name}")
+            return
+        self.active_clients[user_name] = client_socket
+        self.players[client_socket] = [user_name, None, 0]
+        self.log.info("SIGN IN", user=user_name, client=client_socket)
+        self.send(client_socket, "Signed In")
+
+    def challenge(self, player, opponent):
+        """
+        Starts a Match once both the players challenged each other, or at once against the bot
+        :param player: [Username, Match, Seat] of the challenging Client
+        :param opponent: Username of the Opponent or `bot`
+        """
+        user_name = player[0]
+        client_socket = self.active_clients[user_name]
+        if player[1] is not None:
+            self.send(client_socket, "Busy")
+            return
+        if opponent == user_name:
+            self.send(client_socket, "Invalid Opponent")
+            return
+
+        if opponent.lower() == BOT:
+            self.lobby.leave(client_socket)
+            self.start_match(client_socket, None)
+            return
+
+        opponent_socket = self.active_clients.get(opponent)
+        if opponent_socket is None:
+            self.send(client_socket, f"No {opponent} found")
+            return
+        if self.players[opponent_socket][1] is not None:
+            self.send(client_socket, f"Busy {opponent}")
+            return
+
+        if self.challenges.get(opponent) == user_name:
+            self.challenges.pop(opponent)
+            self.lobby.leave(client_socket)
+            self.lobby.leave(opponent_socket)
+            # The one challenged first calls the toss
+            self.start_match(opponent_socket, client_socket)
         else:
-            self.active_clients[user_name] = client_socket
-            print(f"[SIGN IN] Client {user_name} - {client_socket} signed in to Server")
-        self.server.sendto(response.encode(FORMAT), client_socket)
+            self.challenges[user_name] = opponent
+            self.send(client_socket, f"Waiting {opponent}")
+            self.send(opponent_socket, f"Challenge {user_name}")
 
-    def disconnect(self, user_name):
+    def join_lobby(self, client_socket):
         """
-        Disconnects a Client from Server
-        :param user_name: Username of the Client
+        Pairs the Client with the longest waiting one, or queues it
+        :param client_socket: (IP, Port) of the Client
         """
-        print(f"[SIGN OUT] {user_name} - {self.active_clients[user_name]} disconnected")
-        response = self.pad("Disconnected")
-        self.server.sendto(response.encode(FORMAT), self.active_clients[user_name])
-        self.active_clients.pop(user_name)
+        if self.players[client_socket][1] is not None:
+            self.send(client_socket, "Busy")
+            return
+        opponent_socket = self.lobby.join(client_socket)
+        if opponent_socket is None:
+            self.send(client_socket, "Queued")
+            return
+        # The one waiting longer calls the toss
+        self.start_match(opponent_socket, client_socket)
 
-    def find_user_by_socket(self, client_socket):
-        for username, active_socket in self.active_clients.items():
-            if client_socket == active_socket:
-                return username
-        return None
+    def stats(self):
+        """
+        :return: dict - Matchmaking and Match Counters
+        """
+        return dict(self.lobby.stats(), players=len(self.players), live_matches=self.live_matches,
+                    matches=self.num_matches, rated=len(self.leaderboard), **self.lockstep.stats(), **self.log.stats())
 
-    def send_message(self, source_username, dest_username, message):
+    def start_match(self, first_socket, second_socket):
         """
-        Sends Messages from Source Client to Destination Client
-        :param source_username: Username of the Source Client
-        :param dest_username: Username of the Destination Client
-        :param message: Message to be sent
+        :param first_socket: (IP, Port) of the Client in seat 0
+        :param second_socket: (IP, Port) of the Client in seat 1, None for the bot
         """
-        # If provided destination not in registered clients
-        if dest_username not in self.active_clients.keys():
-            print(f"[USER ERROR] {dest_username} not found or inactive")
-            response = self.pad(f"No {dest_username} found")
-            self.server.sendto(response.encode(FORMAT), self.active_clients[source_username])
+        self.num_matches += 1
+        self.live_matches += 1
+        match = Match(self.first_match_id + self.num_matches, (first_socket, second_socket))
+        if second_socket is None:
+            self.bots[match] = self.bot_type()
+        names = []
+        for seat, player_socket in enumerate(match.players):
+            if player_socket is None:
+                names.append(BOT)
+                continue
+            player = self.players[player_socket]
+            player[1], player[2] = match, seat
+            self.challenges.pop(player[0], None)
+            names.append(player[0])
+        self.spectators.start(match, names)
+        self.lockstep.start(match)
+        self.log.info("MATCH", match=match.match_id, seat0=names[0], seat1=names[1])
+        # The players are told if their throws have to be committed to first
+        mode = " Commit" if self.lockstep.commit_reveal else ""
+        for seat, player_socket in enumerate(match.players):
+            if player_socket is not None:
+                self.send(player_socket, f"Match {match.match_id} {names[1 - seat]}{mode}")
+        self.deliver(match, match.start())
+        self.bot_turns(match)
 
-        # Send message to destination
-        else:
-            print(f"[CHAT] Sending message from {self.active_clients[source_username]} to "
-                  f"{self.active_clients[dest_username]}")
-            if message != '':
-                response = self.pad(f"Chat {source_username} {message}")
+    def play(self, match, seat, move, value):
+        """
+        Applies a move on the Match and lets the bot answer if it is the opponent
+        :return: True if the move was valid
+        """
+        bot = self.bots.get(match)
+        # The bot throws first every ball, it only sees the player's throw once the ball is played
+        observe = bot is not None and move == THROW_MOVE and match.state == PLAY
+        batting = match.batting == seat
+        messages = self.apply(match, seat, move, value)
+        if observe and messages and messages[0][1].split()[0] in ("Ball", "Out"):
+            bot.observe(int(value), batting)
+        self.bot_turns(match)
+        if match.state == OVER:
+            self.end_match(match)
+        return not messages or messages[0][1].split()[0] != "Invalid"
+
+    def bot_turns(self, match):
+        """
+        Makes the moves of the bot seat, if any, until it has to wait for the player
+        """
+        bot = self.bots.get(match)
+        for bot_seat, player_socket in enumerate(match.players):
+            if player_socket is not None:
+                continue
+            bot_move = match.bot_move(bot_seat, bot)
+            while bot_move is not None:
+                self.apply(match, bot_seat, *bot_move)
+                bot_move = match.bot_move(bot_seat, bot)
+
+    def commit(self, match, seat, digest):
+        """
+        Takes the commitment of a seat to its next throw, once every seat is committed they are asked to reveal
+        :param digest: `lockstep.commitment` of the throw
+        """
+        if not self.lockstep.commit_reveal or match.expects(seat) != THROW_MOVE or \
+                self.lockstep.turns[match].revealing:
+            self.send(match.players[seat], "Invalid Commit")
+            return
+        self.lockstep.on_time(match, seat)
+        if self.lockstep.commit(match, seat, digest):
+            self.start_reveal(match)
+
+    def start_reveal(self, match):
+        for seat in self.lockstep.start_reveal(match):
+            self.send(match.players[seat], "Reveal")
+
+    def reveal(self, match, seat, throw, nonce):
+        """
+        Plays a revealed throw, a throw other than the committed one forfeits the Match
+        """
+        # A duplicate or late Reveal has no commitment pending, it is only refused
+        turn = self.lockstep.turns.get(match)
+        if turn is None or not turn.revealing or turn.commits[seat] is None or match.throws[seat] >= 0:
+            self.send(match.players[seat], "Invalid Reveal")
+            return
+        if not self.lockstep.verify(match, seat, throw, nonce):
+            self.send(match.players[seat], "Invalid Reveal")
+            self.log.warning("MATCH", match=match.match_id, seat=seat, status="bad reveal")
+            self.forfeit(match, seat)
+            return
+        if self.play(match, seat, THROW_MOVE, throw):
+            self.lockstep.on_time(match, seat)
+
+    def turn_expired(self, match):
+        """
+        Makes a default move for every seat that missed its deadline, or forfeits it after too many in a row
+        """
+        for seat in self.lockstep.late_seats(match):
+            if self.lockstep.strike(match, seat):
+                self.log.info("MATCH", match=match.match_id, seat=seat, status="missed deadlines")
+                self.forfeit(match, seat)
+                return
+            move, value = match.bot_move(seat, self.default_bot)
+            self.send(match.players[seat], f"Late {move} {value}")
+            self.play(match, seat, move, value)
+            if match.state == OVER:
+                return
+        # Still waiting on a seat that committed in time
+        if not self.lockstep.armed(match):
+            if self.lockstep.commit_reveal and self.lockstep.all_committed(match):
+                self.start_reveal(match)
             else:
-                response = self.pad(f"Chat {source_username}")
-            self.server.sendto(response.encode(FORMAT), self.active_clients[dest_username])
+                self.lockstep.arm(match)
+
+    def apply(self, match, seat, move, value):
+        """
+        Makes a move on the Match, sends its outcome to the players and feeds it to the spectators
+        :return: list of (seat, message) sent
+        """
+        messages = match.move(seat, move, value)
+        # An invalid move only gets an `Invalid` back to its seat
+        if not messages or messages[0][1].split()[0] != "Invalid":
+            self.spectators.record(match, seat, move, value)
+            # Next turn, unless a throw waits for its pair
+            if match.throws == [-1, -1]:
+                if move == THROW_MOVE:
+                    self.lockstep.resolved(match)
+                else:
+                    self.lockstep.open(match)
+        self.deliver(match, messages)
+        return messages
+
+    def deliver(self, match, messages):
+        for seat, message in messages:
+            player_socket = match.players[seat]
+            if player_socket is not None:
+                self.send(player_socket, message)
+
+    def end_match(self, match, forfeit_seat=None):
+        """
+        :param forfeit_seat: Seat that left before the Match was over, None if it was played out
+        """
+        self.live_matches -= 1
+        self.bots.pop(match, None)
+        self.lockstep.end(match)
+        names, events = self.spectators.end(match)
+        if self.replay_log is not None:
+            self.replay_log.append(match.match_id, names, events, time.time())
+        winner = match.winner() if forfeit_seat is None else 1 - forfeit_seat
+        self.leaderboard.record(names[0], names[1], 0.5 if winner is None else 1 - winner)
+        for player_socket in match.players:
+            player = self.players.get(player_socket)
+            if player is not None and player[1] is match:
+                player[1] = None
+        self.log.info("MATCH", match=match.match_id, status="over", live=self.live_matches)
 
-    def pad(self, message):
+    def disconnect(self, client_socket):
         """
-        Pads the given message upto Packet Size Amount
-        :param message:
-        :return: string - Padded String
+        Disconnects a Client from Server, forfeiting its Match if any
+        :param client_socket: (IP, Port) of the Client
         """
-        message = message.encode(FORMAT)
-        if len(message) < self.packet_size:
-            message += b' ' * (self.packet_size - len(message))
-        return message.decode(FORMAT)
+        user_name, match, seat = self.players.pop(client_socket)
+        self.active_clients.pop(user_name)
+        self.challenges.pop(user_name, None)
+        self.lobby.leave(client_socket)
+        self.spectators.unwatch(client_socket)
+        if match is not None and match.state != OVER:
+            self.forfeit(match, seat)
+        self.log.info("SIGN OUT", user=user_name, client=client_socket)
+        self.send(client_socket, "Disconnected")
+
+    def forfeit(self, match, seat):
+        """
+        Ends the Match in favour of the other seat
+        """
+        match.state = OVER
+        for player_seat, result in ((1 - seat, "Won"), (seat, "Lost")):
+            # A player that left is not told
+            if match.players[player_seat] in self.players:
+                self.send(match.players[player_seat], f"Result {result} Forfeit")
+        self.end_match(match, forfeit_seat=seat)
+
+    def send(self, client_socket, message):
+        self.sendto(self.framer.frame(message), client_socket)
+
+    def sendto(self, data, client_socket):
+        self.server.sendto(data, client_socket)
+        self.traffic.sent(len(data))
 
 
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser(description='UDP Chat Server',
+    parser = argparse.ArgumentParser(description='UDP Hand Cricket Server',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-v', '--version', action='version', version='v1.0')
     parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS/DOMAIN_NAME",
-                        help='UDP Chat Server Local IP (IPv4 or IPv6) Address or Domain Name to Port Bind to',
+                        help='UDP Hand Cricket Server Local IP (IPv4 or IPv6) Address or Domain Name to Port Bind to',
                         default=socket.gethostbyname(socket.gethostname()))
     parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER",
-                        help='UDP Chat Server Port Number to Port Bind to', default=7776)
+                        help='UDP Hand Cricket Server Port Number to Port Bind to', default=7776)
     parser.add_argument('-s', '--size', type=int, metavar="PACKET_SIZE",
-                        help='UDP Chat Packet Size in Bytes', default=1024)
+                        help='UDP Hand Cricket Packet Size in Bytes', default=64)
+    parser.add_argument('-b', '--bot-timeout', type=float, metavar="TIME",
+                        help='Time in sec a player waits for an opponent before playing the bot', default=10)
+    parser.add_argument('--bot', choices=BOTS, help='Bot Strategy playing against lone players', default="markov")
+    parser.add_argument('--replays', type=str, metavar="FILE",
+                        help='Replay Log every finished Match is appended to', default="Replays.log")
+    parser.add_argument('--no-replays', dest='replays', action='store_const', const=None,
+                        help='Do not keep the finished Matches')
+    parser.add_argument('--ratings', type=str, metavar="FILE",
+                        help='Snapshot File of the Leaderboard', default="Ratings.txt")
+    parser.add_argument('-t', '--turn-timeout', type=float, metavar="TIME",
+                        help='Time in sec a player has for each move, 0 for no deadline', default=30)
+    parser.add_argument('--strikes', type=int,
+                        help='Deadlines a player may miss in a row before forfeiting', default=3)
+    parser.add_argument('--commit-reveal', action='store_true',
+                        help='Players commit to a hash of every throw before revealing it')
+    udp_log.add_arguments(parser)
+    udp_metrics.add_arguments(parser)
+    udp_profile.add_arguments(parser)
 
     args = parser.parse_args()
 
@@ -136,6 +545,16 @@ if __name__ == '__main__':
         proto=socket.IPPROTO_UDP
     )[0]
 
+    replay_log = ReplayLog(args.replays) if args.replays else None
+    leaderboard = Leaderboard(args.ratings)
+
     # instantiates server
-    server = UDPChatServer(address_info=address_info, packet_size=args.size)
+    server = HandCricketServer(address_info=address_info, packet_size=args.size, bot_timeout=args.bot_timeout,
+                               bot=args.bot, replay_log=replay_log, leaderboard=leaderboard,
+                               turn_timeout=args.turn_timeout or None, commit_reveal=args.commit_reveal,
+                               max_strikes=args.strikes,
+                               log=udp_log.from_arguments(args, packet_events=("MESSAGE RECEIVED",)))
+    if args.metrics_port:
+        udp_metrics.serve(server.registry, args.metrics_port)
+    udp_profile.from_arguments(args, server)
     server.client_handler()
@@ -0,0 +1,164 @@
+import argparse
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Throw Strategies - relative weights of throwing 0 - 6, the bot of `handcricket.py` is uniform
+STRATEGIES = {
+    "uniform": [1, 1, 1, 1, 1, 1, 1],
+    "high": [1, 1, 1, 2, 3, 4, 5],
+    "low": [5, 4, 3, 2, 1, 1, 1],
+    "no_zero": [0, 1, 1, 1, 1, 1, 1],
+    "sixes": [1, 1, 1, 1, 1, 1, 6],
+}
+
+# Balls drawn at once for every innings still being played
+CHUNK = 16
+
+
+def throw_cdf(weights):
+    weights = np.asarray(weights, dtype=np.float64)
+    cdf = np.cumsum(weights / weights.sum())
+    cdf[-1] = 1.0
+    return cdf
+
+
+def draw(rng, cdf, shape):
+    """
+    :return: array of throws 0 - 6 drawn from the cumulative distribution
+    """
+    return np.searchsorted(cdf, rng.random(shape), side='right')
+
+
+def simulate_innings(rng, n, bat_cdf, bowl_cdf, target=None):
+    """
+    Plays n innings at once with the rules of `Innings` - out when both throw the same,
+    else the batting throw is scored, the chase ends once the target is beaten
+    :param rng: numpy Generator
+    :param n: Number of innings
+    :param bat_cdf: Throw distribution of the batting side
+    :param bowl_cdf: Throw distribution of the bowling side
+    :param target: Score to beat per innings (or for all), None in the first innings
+    :return: (scores, balls faced) arrays of length n
+    """
+    scores = np.zeros(n, dtype=np.int64)
+    balls = np.zeros(n, dtype=np.int64)
+    if target is None:
+        target = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    target = np.broadcast_to(np.asarray(target, dtype=np.int64), (n,))
+
+    active = np.arange(n)
+    while active.size:
+        rows = active.size
+        bat = draw(rng, bat_cdf, (rows, CHUNK))
+        bowl = draw(rng, bowl_cdf, (rows, CHUNK))
+        out = bat == bowl
+        # Runs only count until the first wicket, the wicket ball itself scores nothing
+        alive = np.cumsum(out, axis=1) == 0
+        total = scores[active, None] + np.cumsum(np.where(alive, bat, 0), axis=1)
+        ended = out | (total > target[active, None])
+
+        finished = ended.any(axis=1)
+        last_ball = np.where(finished, ended.argmax(axis=1), CHUNK - 1)
+        scores[active] = total[np.arange(rows), last_ball]
+        balls[active] += last_ball + 1
+        active = active[~finished]
+    return scores, balls
+
+
+def simulate_matches(seed, n, strategy_a, strategy_b, a_bats_first=0.5):
+    """
+    Plays n matches of strategy A against strategy B
+
+    The toss is a fair coin whatever the throws, its winner bats first with the given probability
+    :param seed: Seed (or SeedSequence) of the numpy Generator
+    :param n: Number of matches
+    :param strategy_a: Throw weights of A
+    :param strategy_b: Throw weights of B
+    :param a_bats_first: Probability of A batting first
+    :return: dict - wins_a, wins_b, draws and the score histograms of A and B
+    """
+    rng = np.random.default_rng(seed)
+    cdf_a, cdf_b = throw_cdf(strategy_a), throw_cdf(strategy_b)
+    a_first = rng.random(n) < a_bats_first
+    n_a_first = int(a_first.sum())
+
+    # A bats first
+    a_scores_first, _ = simulate_innings(rng, n_a_first, cdf_a, cdf_b)
+    b_scores_second, _ = simulate_innings(rng, n_a_first, cdf_b, cdf_a, a_scores_first)
+    # B bats first
+    b_scores_first, _ = simulate_innings(rng, n - n_a_first, cdf_b, cdf_a)
+    a_scores_second, _ = simulate_innings(rng, n - n_a_first, cdf_a, cdf_b, b_scores_first)
+
+    a_scores = np.concatenate((a_scores_first, a_scores_second))
+    b_scores = np.concatenate((b_scores_second, b_scores_first))
+    return {
+        "wins_a": int((a_scores > b_scores).sum()),
+        "wins_b": int((b_scores > a_scores).sum()),
+        "draws": int((a_scores == b_scores).sum()),
+        "scores_a": np.bincount(a_scores),
+        "scores_b": np.bincount(b_scores),
+    }
+
+
+def merge(results):
+    """
+    Adds up the results of several simulate_matches calls
+    """
+    merged = {"wins_a": 0, "wins_b": 0, "draws": 0, "scores_a": np.zeros(1, np.int64),
+              "scores_b": np.zeros(1, np.int64)}
+    for result in results:
+        for key in ("wins_a", "wins_b", "draws"):
+            merged[key] += result[key]
+        for key in ("scores_a", "scores_b"):
+            size = max(len(merged[key]), len(result[key]))
+            merged[key] = np.pad(merged[key], (0, size - len(merged[key]))) + \
+                np.pad(result[key], (0, size - len(result[key])))
+    return merged
+
+
+def run(n, strategy_a, strategy_b, processes=1, seed=None, a_bats_first=0.5):
+    """
+    Plays n matches, split over a Process Pool if asked for, every worker with an independent random stream
+    """
+    if processes <= 1:
+        return simulate_matches(np.random.SeedSequence(seed), n, strategy_a, strategy_b, a_bats_first)
+    seeds = np.random.SeedSequence(seed).spawn(processes)
+    sizes = [n // processes + (worker < n % processes) for worker in range(processes)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = pool.map(simulate_matches, seeds, sizes, itertools.repeat(strategy_a),
+                           itertools.repeat(strategy_b), itertools.repeat(a_bats_first))
+        return merge(results)
+
+
+def percentile(histogram, point):
+    cumulative = np.cumsum(histogram)
+    return int(np.searchsorted(cumulative, cumulative[-1] * point / 100))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Monte Carlo Simulator of Hand Cricket Matches between Bots',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('-n', '--matches', type=int, help='Matches per pair of Strategies', default=1000000)
+    parser.add_argument('-s', '--strategies', nargs='+', choices=STRATEGIES, help='Throw Strategies to compare',
+                        default=list(STRATEGIES))
+    parser.add_argument('-j', '--processes', type=int, help='Worker Processes, 1 to run in process', default=1)
+    parser.add_argument('--seed', type=int, help='Random Seed for reproducible runs', default=None)
+
+    args = parser.parse_args()
+
+    print(f"{'Strategy A':>10} {'Strategy B':>10} {'A Wins':>8} {'B Wins':>8} {'Draws':>7} "
+          f"{'A Mean':>7} {'A p50/p90/p99':>14} {'Time':>8}")
+    for name_a, name_b in itertools.combinations_with_replacement(args.strategies, 2):
+        started = time.perf_counter()
+        outcome = run(args.matches, STRATEGIES[name_a], STRATEGIES[name_b], args.processes, args.seed)
+        elapsed = time.perf_counter() - started
+        scores_a = outcome["scores_a"]
+        mean_a = (scores_a * np.arange(len(scores_a))).sum() / scores_a.sum()
+        spread = '/'.join(str(percentile(scores_a, point)) for point in (50, 90, 99))
+        print(f"{name_a:>10} {name_b:>10} {outcome['wins_a'] / args.matches:>8.2%} "
+              f"{outcome['wins_b'] / args.matches:>8.2%} {outcome['draws'] / args.matches:>7.2%} "
+              f"{mean_a:>7.2f} {spread:>14} {elapsed:>7.2f}s")
@@ -0,0 +1,229 @@
+import argparse
+import os
+import socket
+import sys
+import time
+
+from match import Match
+from replay import encode_event, replay
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_core import FORMAT
+
+
+class MatchFeed:
+    __slots__ = ("match", "names", "events", "resolved", "published", "spectators")
+
+    def __init__(self, match, names):
+        self.match = match
+        self.names = names
+        # Event Bytes of every move so far, see `replay.encode_event`
+        self.events = bytearray()
+        # Events upto the last played ball, the ones after are throws the opponent has not answered yet
+        self.resolved = 0
+        # Events already sent to the spectators
+        self.published = 0
+        self.spectators = set()
+
+
+class SpectatorFeed:
+    def __init__(self, sendto, packet_size, interval=0.1):
+        """
+        Fan-out of the live Matches to their spectators
+
+        A spectator joining late gets a snapshot of the Match, then only the Events played after it.
+        Every interval the Events resolved since the last flush are sent to all the spectators of a Match
+        in as few datagrams as possible, a byte per move - so the cost per ball does not grow with the audience
+        :param sendto: `socket.sendto` of the Server
+        :param packet_size: Amount of Information sent per message in Bytes
+        :param interval: Time in sec between flushes
+        """
+        self.sendto = sendto
+        self.packet_size = packet_size
+        self.interval = interval
+        self.next_flush = time.monotonic() + interval
+        # Match ID -> MatchFeed
+        self.feeds = {}
+        # (IP, Port) of a spectator -> Match ID it watches
+        self.watching = {}
+
+    def start(self, match, names):
+        """
+        :param names: (Username of seat 0, Username of seat 1)
+        """
+        self.feeds[match.match_id] = MatchFeed(match, names)
+
+    def record(self, match, seat, move, value):
+        """
+        Appends a valid move of the Match to its feed
+        """
+        feed = self.feeds[match.match_id]
+        feed.events.append(encode_event(seat, move, value))
+        # A throw is only shown once the other seat threw too, the spectators may be talking to the opponent
+        if match.throws == [-1, -1]:
+            feed.resolved = len(feed.events)
+
+    def watch(self, match_id, spectator):
+        """
+        Subscribes a spectator, sending it the snapshot of the Match upto the last played ball
+        :param match_id: Match to watch
+        :param spectator: (IP, Port) of the spectator
+        :return: True if the Match is live
+        """
+        feed = self.feeds.get(match_id)
+        if feed is None:
+            return False
+        self.unwatch(spectator)
+        feed.spectators.add(spectator)
+        self.watching[spectator] = match_id
+        match = feed.match
+        # Only the pending throws are left out of a snapshot, the rest of the Match is as of the last played ball
+        self.send(spectator, f"Snap {match_id} {feed.resolved} {match.state} {match.innings} {match.batting} "
+                             f"{match.score} {match.first_score} {int(match.call_even)} {' '.join(feed.names)}")
+        return True
+
+    def unwatch(self, spectator):
+        """
+        :return: True if the spectator was watching a Match
+        """
+        match_id = self.watching.pop(spectator, None)
+        if match_id is None:
+            return False
+        self.feeds[match_id].spectators.discard(spectator)
+        return True
+
+    def poll(self, now=None):
+        """
+        Flushes all the feeds once every interval
+        """
+        now = time.monotonic() if now is None else now
+        if now < self.next_flush:
+            return
+        self.next_flush = now + self.interval
+        for feed in self.feeds.values():
+            self.flush(feed)
+
+    def flush(self, feed):
+        """
+        Sends the Events resolved since the last flush as `Feed <Match ID> <first Event number> <hex Events>`
+        """
+        if feed.published == feed.resolved:
+            return
+        if feed.spectators:
+            sequence = feed.published
+            while sequence < feed.resolved:
+                prefix = f"Feed {feed.match.match_id} {sequence} "
+                count = min(feed.resolved - sequence, max(1, (self.packet_size - len(prefix)) // 2))
+                datagram = self.pad(prefix + feed.events[sequence:sequence + count].hex())
+                for spectator in feed.spectators:
+                    self.sendto(datagram, spectator)
+                sequence += count
+        feed.published = feed.resolved
+
+    def end(self, match):
+        """
+        Sends the last Events of a finished Match and lets its spectators go
+        :return: ((Username of seat 0, Username of seat 1), Event Bytes) of the whole Match
+        """
+        feed = self.feeds.pop(match.match_id)
+        feed.resolved = len(feed.events)
+        self.flush(feed)
+        for spectator in feed.spectators:
+            self.watching.pop(spectator, None)
+            self.send(spectator, f"Ended {match.match_id}")
+        return feed.names, feed.events
+
+    def live(self):
+        """
+        :return: list of the IDs of the live Matches
+        """
+        return list(self.feeds)
+
+    def send(self, spectator, message):
+        self.sendto(self.pad(message), spectator)
+
+    def pad(self, message):
+        return message.encode(FORMAT).ljust(self.packet_size)
+
+
+def snapshot(fields):
+    """
+    :param fields: Split `Snap` message
+    :return: (Match as of the snapshot, number of Events it covers, names)
+    """
+    match = Match(int(fields[1]), (None, None))
+    match.state, match.innings, match.batting, match.score, match.first_score = map(int, fields[3:8])
+    match.call_even = fields[8] == "1"
+    return match, int(fields[2]), tuple(fields[9:11])
+
+
+def spectate(client, server_socket, packet_size, match_id):
+    """
+    Watches a live Match, printing seat 0's view of every move as it is played
+    """
+    client.sendto(f"Watch {match_id}".encode(FORMAT).ljust(packet_size), server_socket)
+    match, applied, names = None, 0, ('', '')
+    while True:
+        fields = client.recvfrom(packet_size)[0].decode(FORMAT).split()
+        kind = fields[0].lower() if fields else ''
+        if kind == "snap":
+            match, applied, names = snapshot(fields)
+            print(f"[WATCH] Match #{match_id} {names[0]} vs {names[1]} - innings {match.innings}, "
+                  f"score {match.score}")
+        elif kind == "feed" and match is not None:
+            sequence, events = int(fields[2]), bytes.fromhex(fields[3])
+            if sequence > applied:
+                # Lost a datagram, start over from a new snapshot
+                print(f"[WATCH] Missed events {applied} - {sequence - 1}, resyncing")
+                client.sendto(f"Watch {match_id}".encode(FORMAT).ljust(packet_size), server_socket)
+                match = None
+                continue
+            # Events already covered by the snapshot are skipped
+            _, updates = replay(events[applied - sequence:], match)
+            applied = max(applied, sequence + len(events))
+            for messages in updates:
+                for seat, message in messages:
+                    if seat == 0:
+                        print(f"  {names[0]} : {message}")
+        elif kind == "ended":
+            print(f"[WATCH] Match #{match_id} over")
+            return
+        elif kind == "no":
+            print(f"[WATCH ERROR] No live Match #{match_id}")
+            return
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UDP Hand Cricket Spectator - watches a live Match',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS/DOMAIN_NAME",
+                        help='UDP Hand Cricket Server IP (IPv4 or IPv6) Address or Domain Name to connect to',
+                        default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER",
+                        help='UDP Hand Cricket Server Port Number to connect to', default=7776)
+    parser.add_argument('-s', '--size', type=int, help='UDP Hand Cricket Packet Size in Bytes', default=64,
+                        metavar="PACKET_SIZE")
+    parser.add_argument('-u', '--username', help='Username of the Spectator', metavar="USER_NAME", required=True)
+    parser.add_argument('-m', '--match', type=int, help='Match to watch, lists the live ones if not given')
+
+    args = parser.parse_args()
+
+    address_info = socket.getaddrinfo(
+        args.ip,
+        args.port,
+        proto=socket.IPPROTO_UDP
+    )[0]
+    server_socket = (address_info[4][0], address_info[4][1])
+
+    with socket.socket(address_info[0], socket.SOCK_DGRAM) as client:
+        client.sendto(f"User {args.username}".encode(FORMAT).ljust(args.size), server_socket)
+        response = client.recvfrom(args.size)[0].decode(FORMAT).strip()
+        if response.lower()[:6] != "signed":
+            print(f"[SIGN IN ERROR] {response}")
+        elif args.match is None:
+            client.sendto(b"Live".ljust(args.size), server_socket)
+            print(f"[LIVE] {client.recvfrom(args.size)[0].decode(FORMAT).strip()}")
+        else:
+            spectate(client, server_socket, args.size, args.match)
+        client.sendto(b"Disconnect".ljust(args.size), server_socket)
@@ -0,0 +1,205 @@
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from lockstep import commitment
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from udp_swarm import HeadlessClient, Report, print_report, run_worker, server_stats
+
+# Stages timed by the swarm
+STAGES = ("sign_in", "matchmaking", "ball")
+
+
+async def play_session(client, username, matches, opponent, rng, timeout, report):
+    """
+    Scripted player - signs in, plays the matches with random calls, choices and throws and disconnects
+    :param opponent: Username to challenge, `bot`, or '' for the Matchmaking Queue
+    """
+    sent_at = time.perf_counter()
+    client.send(f"User {username}")
+    response = await client.recv(timeout)
+    if response.lower()[:6] != "signed":
+        report.errors["sign_in"] += 1
+        return
+    report.latencies["sign_in"].append(time.perf_counter() - sent_at)
+
+    # Commit-Reveal Matches - (throw, nonce) committed to and not revealed yet
+    commit_reveal, pending = False, None
+
+    def throw():
+        nonlocal pending
+        value = rng.randint(0, 6)
+        if not commit_reveal:
+            client.send(f"Throw {value}")
+            return
+        pending = (value, f"{rng.getrandbits(64):x}")
+        client.send(f"Commit {commitment(*pending)}")
+
+    for _ in range(matches):
+        queued_at = time.perf_counter()
+        client.send(f"Play {opponent}".strip())
+        # Target of the chase, None in the first innings
+        target = None
+        while True:
+            response = await client.recv(timeout)
+            fields = response.split()
+            kind = fields[0].lower() if fields else ''
+            if kind in ("queued", "waiting", "challenge", "wait"):
+                continue
+            if kind == "match":
+                report.latencies["matchmaking"].append(time.perf_counter() - queued_at)
+                commit_reveal = fields[-1].lower() == "commit" and len(fields) > 3
+            elif kind == "reveal" and pending is not None:
+                client.send(f"Reveal {pending[0]} {pending[1]}")
+                pending = None
+            elif kind == "late":
+                report.errors["late"] += 1
+            elif kind == "call":
+                client.send(f"Call {rng.choice(('odd', 'even'))}")
+            elif kind == "toss" and fields[1].lower() == "won":
+                client.send(f"Choose {rng.choice(('bat', 'ball'))}")
+            elif kind == "toss" and fields[1].lower() in ("odd", "even"):
+                throw()
+            elif kind == "innings":
+                target = int(fields[3]) if len(fields) > 3 else None
+                sent_at = time.perf_counter()
+                throw()
+            elif kind in ("ball", "out"):
+                report.latencies["ball"].append(time.perf_counter() - sent_at)
+                report.counters["balls"] += 1
+                # After a wicket the next Innings or the Result follows, a chase ends once the target is reached
+                if kind == "ball" and (target is None or int(fields[3]) < target):
+                    sent_at = time.perf_counter()
+                    throw()
+            elif kind == "result":
+                report.counters["matches"] += 1
+                break
+            elif kind != "toss":
+                report.errors[kind or "empty"] += 1
+
+    client.send("Disconnect")
+    await client.recv(timeout)
+
+
+async def swarm(first, players, server_socket, packet_size, matches, opponent, seed, timeout, ramp, family):
+    """
+    Runs the virtual players first ... first + players - 1 on a single asyncio loop
+    :param ramp: Time in sec over which the players are started, so they do not all sign in at once
+    :return: Report
+    """
+    report = Report(STAGES)
+    rng = random.Random(seed)
+
+    async def player(player_id):
+        await asyncio.sleep(ramp * (player_id - first) / players)
+        client = await HeadlessClient.connect(packet_size, server_socket, family=family)
+        try:
+            await play_session(client, f"swarm{player_id}", matches, opponent, random.Random(rng.random()),
+                               timeout, report)
+        except asyncio.TimeoutError:
+            report.errors["timeout"] += 1
+        finally:
+            report.counters["sent"] += client.sent
+            report.counters["received"] += client.received
+            client.close()
+
+    await asyncio.gather(*(player(player_id) for player_id in range(first, first + players)))
+    return report
+
+
+def run(players, server_socket, packet_size, matches=1, opponent='', processes=1, seed=None, timeout=5, ramp=1.0,
+        family=socket.AF_INET):
+    """
+    Drives the Server with virtual players, split over a Process Pool if asked for
+    :return: (Report, elapsed time in sec)
+    """
+    seed = random.randrange(1 << 32) if seed is None else seed
+    started = time.perf_counter()
+    if processes <= 1:
+        report = run_worker(swarm, 0, players, server_socket, packet_size, matches, opponent, seed, timeout, ramp,
+                            family)
+    else:
+        sizes = [players // processes + (worker < players % processes) for worker in range(processes)]
+        firsts = [sum(sizes[:worker]) for worker in range(processes)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(run_worker, swarm, firsts[worker], sizes[worker], server_socket, packet_size,
+                                   matches, opponent, seed + worker, timeout, ramp, family)
+                       for worker in range(processes)]
+            report = Report(STAGES)
+            for future in futures:
+                report.merge(future.result())
+    return report, time.perf_counter() - started
+
+
+def print_swarm(report, elapsed, players):
+    # Both players of a Match count it, and every ball it had
+    print_report(report, [
+        f"[SWARM] {players} players played {report.counters['matches']} matches and faced "
+        f"{report.counters['balls']} balls in {elapsed:.2f}s",
+        f"[THROUGHPUT] {report.counters['matches'] / elapsed:.1f} matches/s, "
+        f"{report.counters['balls'] / elapsed:.1f} balls/s, "
+        f"{(report.counters['sent'] + report.counters['received']) / elapsed:.0f} datagrams/s"
+    ], players, "players")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless Load Test of the UDP Hand Cricket Server',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS/DOMAIN_NAME",
+                        help='UDP Hand Cricket Server IP (IPv4 or IPv6) Address or Domain Name to connect to',
+                        default=socket.gethostbyname(socket.gethostname()))
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER",
+                        help='UDP Hand Cricket Server Port Number to connect to', default=7776)
+    parser.add_argument('-s', '--size', type=int, help='UDP Hand Cricket Packet Size in Bytes', default=64,
+                        metavar="PACKET_SIZE")
+    parser.add_argument('-n', '--players', type=int, help='Number of virtual players', default=1000)
+    parser.add_argument('-m', '--matches', type=int, help='Matches played by every player', default=3)
+    parser.add_argument('-o', '--opponent', type=str, help="Opponent to challenge, 'bot' for the bot, "
+                                                            "'' for the Matchmaking Queue", default='')
+    parser.add_argument('-j', '--processes', type=int, help='Worker Processes, 1 to run in process', default=1)
+    parser.add_argument('-t', '--timeout', type=float, help='Time in sec a player waits for a reply', default=5)
+    parser.add_argument('-r', '--ramp', type=float, help='Time in sec over which the players start', default=1)
+    parser.add_argument('--seed', type=int, help='Random Seed for reproducible runs', default=None)
+    parser.add_argument('--spawn', action='store_true', help='Start a Server on the given address for the run')
+    parser.add_argument('--commit-reveal', action='store_true', help='Start the Server with Commit-Reveal throws')
+
+    args = parser.parse_args()
+
+    address_info = socket.getaddrinfo(
+        args.ip,
+        args.port,
+        proto=socket.IPPROTO_UDP
+    )[0]
+    server_socket = (address_info[4][0], address_info[4][1])
+
+    server_process = None
+    if args.spawn:
+        server_process = subprocess.Popen([sys.executable, "server.py", "-i", args.ip, "-p", str(args.port),
+                                           "-s", str(args.size), "--no-replays"] +
+                                          (["--commit-reveal"] if args.commit_reveal else []),
+                                          stdout=subprocess.DEVNULL)
+        # Let the Server bind
+        time.sleep(0.5)
+    try:
+        before = server_stats(server_socket, args.size, address_info[0], "swarm_stats")
+        report, elapsed = run(args.players, server_socket, args.size, args.matches, args.opponent, args.processes,
+                              args.seed, args.timeout, args.ramp, address_info[0])
+        after = server_stats(server_socket, args.size, address_info[0], "swarm_stats")
+    finally:
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+    print_swarm(report, elapsed, args.players)
+    if before and after:
+        played = int(after["matches"]) - int(before["matches"])
+        print(f"[SERVER] {played / elapsed:.1f} matches/s started,",
+              ' '.join(f"{key}={value}" for key, value in after.items()))
@@ -0,0 +1,68 @@
+import random
+
+import pytest
+
+from leaderboard import Leaderboard, SkipList
+
+
+def test_skip_list_matches_a_sorted_list():
+    rng = random.Random(7)
+    skip_list, expected = SkipList(rng=random.Random(1)), []
+    for _ in range(2000):
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            skip_list.remove(key)
+            expected.remove(key)
+        else:
+            key = (rng.randint(0, 500), rng.random())
+            skip_list.insert(key)
+            expected.append(key)
+            expected.sort()
+    assert len(skip_list) == len(expected)
+    assert list(skip_list.slice(0, len(expected))) == expected
+    for position in rng.sample(range(len(expected)), 50):
+        assert skip_list.rank(expected[position]) == position
+        assert list(skip_list.slice(position, 5)) == expected[position:position + 5]
+
+
+def test_skip_list_lookups_past_the_end():
+    skip_list = SkipList(rng=random.Random(1))
+    for key in range(10):
+        skip_list.insert(key)
+    assert skip_list.rank(42) is None
+    assert list(skip_list.slice(10, 5)) == []
+    with pytest.raises(KeyError):
+        skip_list.remove(42)
+
+
+def test_a_result_moves_both_ratings_by_the_same_amount():
+    leaderboard = Leaderboard(k_factor=32, initial=1500)
+    first, second = leaderboard.record("alice", "bob", 1)
+    assert first == pytest.approx(1516)
+    assert second == pytest.approx(1484)
+    # A draw between unequal players pulls them together
+    first, second = leaderboard.record("alice", "bob", 0.5)
+    assert 1500 < first < 1516 and 1484 < second < 1500
+    assert first + second == pytest.approx(3000)
+
+
+def test_rank_and_top_follow_the_ratings():
+    leaderboard = Leaderboard()
+    for winner, loser in (("alice", "bob"), ("alice", "carol"), ("bob", "carol")):
+        leaderboard.record(winner, loser, 1)
+    assert [name for name, _ in leaderboard.top(3)] == ["alice", "bob", "carol"]
+    assert [name for name, _ in leaderboard.top(2, start=2)] == ["bob", "carol"]
+    assert leaderboard.rank("carol")[0] == 3
+    assert leaderboard.rank("dave") is None
+
+
+def test_ratings_survive_a_restart(tmp_path):
+    path = str(tmp_path / "Ratings.txt")
+    leaderboard = Leaderboard(path)
+    leaderboard.record("alice", "bob", 1)
+    leaderboard.record("carol", "bob", 0.5)
+    leaderboard.snapshot()
+
+    restored = Leaderboard(path)
+    assert restored.top(3) == leaderboard.top(3)
+    assert restored.players == leaderboard.players
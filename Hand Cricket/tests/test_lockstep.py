@@ -0,0 +1,153 @@
+import socket
+
+import pytest
+
+from lockstep import DeadlineScheduler, Lockstep, commitment
+from match import Match
+from server import HandCricketServer
+import udp_log
+
+PACKET_SIZE = 128
+
+
+def test_commitment_binds_the_throw_and_the_nonce():
+    assert commitment(4, "abc") == commitment(4, "abc")
+    assert commitment(4, "abc") != commitment(5, "abc")
+    assert commitment(4, "abc") != commitment(4, "abd")
+
+
+def test_deadlines_expire_in_order():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule("late", 2.0, now=0.0)
+    scheduler.schedule("early", 1.0, now=0.0)
+    assert scheduler.expire(now=0.5) == []
+    assert scheduler.expire(now=1.0) == ["early"]
+    assert scheduler.expire(now=5.0) == ["late"]
+    assert len(scheduler) == 0
+
+
+def test_rearmed_or_cancelled_deadline_does_not_fire():
+    scheduler = DeadlineScheduler()
+    scheduler.schedule("rearmed", 1.0, now=0.0)
+    scheduler.schedule("rearmed", 3.0, now=0.0)
+    scheduler.schedule("cancelled", 1.0, now=0.0)
+    scheduler.cancel("cancelled")
+    assert scheduler.expire(now=2.0) == []
+    assert scheduler.expire(now=3.0) == ["rearmed"]
+
+
+def test_seat_forfeits_past_its_strikes():
+    lockstep = Lockstep(max_strikes=2)
+    match = Match(1, ("alice", "bob"))
+    lockstep.start(match)
+    assert not lockstep.strike(match, 0)
+    assert not lockstep.strike(match, 0)
+    lockstep.on_time(match, 0)
+    assert not lockstep.strike(match, 0)
+    assert not lockstep.strike(match, 0)
+    assert lockstep.strike(match, 0)
+    assert lockstep.stats()["forfeits"] == 1
+
+
+def test_reveal_is_checked_against_the_commitment():
+    lockstep = Lockstep(commit_reveal=True)
+    match = Match(1, ("alice", "bob"))
+    lockstep.start(match)
+    lockstep.commit(match, 0, commitment(3, "nonce"))
+    # Nothing is revealed before every seat has committed
+    assert not lockstep.verify(match, 0, 3, "nonce")
+    assert lockstep.commit(match, 1, commitment(5, "other"))
+    assert lockstep.start_reveal(match) == [0, 1]
+    assert lockstep.verify(match, 0, 3, "nonce")
+    assert not lockstep.verify(match, 1, 6, "other")
+
+
+@pytest.fixture
+def against_bot():
+    """
+    Commit-reveal Server stepped by hand, with a signed in Client in a Match against the bot waiting to call the toss
+    """
+    address_info = socket.getaddrinfo("127.0.0.1", 0, proto=socket.IPPROTO_UDP)[0]
+    server = HandCricketServer(address_info, PACKET_SIZE, commit_reveal=True,
+                               log=udp_log.Logger(level=udp_log.ERROR, background=False))
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.bind(("127.0.0.1", 0))
+    client.settimeout(1)
+    request(server, client, "User alice")
+    request(server, client, "Play bot")
+    assert replies(client) == ["Signed In", "Match 1 bot Commit", "Call"]
+    yield server, client
+    client.close()
+    server.server.close()
+
+
+def request(server, client, message):
+    server.handle_datagram(message.encode().ljust(PACKET_SIZE), client.getsockname())
+
+
+def replies(client):
+    """
+    :return: list of every reply waiting on the Client socket
+    """
+    messages = []
+    client.setblocking(False)
+    try:
+        while True:
+            messages.append(client.recv(PACKET_SIZE).decode().strip())
+    except BlockingIOError:
+        pass
+    finally:
+        client.settimeout(1)
+    return messages
+
+
+def commit_and_reveal(server, client, throw, nonce):
+    request(server, client, f"Commit {commitment(throw, nonce)}")
+    assert replies(client) == ["Reveal"]
+    request(server, client, f"Reveal {throw} {nonce}")
+
+
+def test_duplicate_reveal_is_refused_without_forfeit(against_bot):
+    server, client = against_bot
+    request(server, client, "Call even")
+    assert replies(client) == ["Toss even"]
+    commit_and_reveal(server, client, 3, "nonce")
+    assert {"Toss Won", "Toss Lost"} & set(replies(client))
+
+    request(server, client, "Reveal 3 nonce")
+    assert replies(client) == ["Invalid Reveal"]
+    assert server.players[client.getsockname()][1] is not None
+
+
+def test_reveal_before_committing_is_refused_without_forfeit(against_bot):
+    server, client = against_bot
+    request(server, client, "Call even")
+    replies(client)
+    request(server, client, "Reveal 3 nonce")
+    assert replies(client) == ["Invalid Reveal"]
+    assert server.players[client.getsockname()][1] is not None
+
+
+def test_wrong_reveal_forfeits(against_bot):
+    server, client = against_bot
+    request(server, client, "Call even")
+    replies(client)
+    request(server, client, f"Commit {commitment(3, 'nonce')}")
+    replies(client)
+    request(server, client, "Reveal 4 nonce")
+    assert replies(client)[0] == "Invalid Reveal"
+    assert server.players[client.getsockname()][1] is None
+
+
+def test_junk_move_does_not_clear_the_strikes(against_bot):
+    server, client = against_bot
+    match = server.players[client.getsockname()][1]
+    turn = server.lockstep.turns[match]
+    turn.strikes[0] = 2
+    request(server, client, "Call junk")
+    assert replies(client) == ["Invalid Call"]
+    assert turn.strikes[0] == 2
+
+    request(server, client, "Call even")
+    replies(client)
+    assert turn.strikes[0] == 0
@@ -0,0 +1,29 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APPS = ("Chat", "Echo", "File Transfer", "Hand Cricket")
+
+sys.path.insert(0, ROOT)
+
+
+def pytest_collectstart(collector):
+    """
+    The apps import their own modules by bare name, as their scripts are run from the app folder - so the folder of
+    the app a test module belongs to goes first on the path, and a module of the same name imported from another app
+    (server, client, swarm) is dropped to be imported afresh
+    """
+    path = getattr(collector, "path", None)
+    if path is None or not str(path).endswith(".py"):
+        return
+    app = os.path.relpath(str(path), ROOT).split(os.sep)[0]
+    if app not in APPS:
+        return
+    folder = os.path.join(ROOT, app)
+    if sys.path[0] != folder:
+        sys.path.insert(0, folder)
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, "__file__", None)
+        if module_file and os.path.dirname(os.path.abspath(module_file)) != folder \
+                and os.path.exists(os.path.join(folder, f"{name}.py")):
+            del sys.modules[name]
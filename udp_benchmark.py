@@ -0,0 +1,354 @@
+import argparse
+import json
+import os
+import platform
+import random
+import selectors
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# App -> (Folder, Server Options besides the address and Packet Size, what a latency sample times)
+APPS = {
+    "echo": ("Echo", [], "echo rtt"),
+    "chat": ("Chat", ["--no-store", "-t", "60"], "chat delivery"),
+    "file_transfer": ("File Transfer", [], "upload"),
+    "hand_cricket": ("Hand Cricket", ["--no-replays", "--ratings", "Ratings.txt", "-t", "0"], "ball"),
+}
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """
+    :return: dict - Percentile -> Sample, nearest rank
+    """
+    if not samples:
+        return {point: 0.0 for point in points}
+    ordered = sorted(samples)
+    return {point: ordered[min(len(ordered) - 1, point * len(ordered) // 100)] for point in points}
+
+
+def drive_echo(server_socket, packet_size, clients, options):
+    """
+    Closed loop Echo Clients - each keeps a single request in flight for the duration, a lost one is resent
+    :return: dict - Latency samples in sec, Operations and Errors
+    """
+    selector = selectors.DefaultSelector()
+    message = b"benchmark".ljust(packet_size)
+    sent_at = {}
+    for _ in range(clients):
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client.setblocking(False)
+        selector.register(client, selectors.EVENT_READ)
+        client.sendto(message, server_socket)
+        sent_at[client] = time.perf_counter()
+    latencies, lost = [], 0
+    deadline = time.perf_counter() + options["duration"]
+    while time.perf_counter() < deadline:
+        events = selector.select(0.1)
+        now = time.perf_counter()
+        for key, _ in events:
+            key.fileobj.recv(packet_size)
+            latencies.append(now - sent_at[key.fileobj])
+            key.fileobj.sendto(message, server_socket)
+            sent_at[key.fileobj] = time.perf_counter()
+        if not events:
+            for client, at in sent_at.items():
+                if now - at > 0.5:
+                    lost += 1
+                    client.sendto(message, server_socket)
+                    sent_at[client] = time.perf_counter()
+    for client in sent_at:
+        selector.unregister(client)
+        client.close()
+    return {"latencies": latencies, "operations": len(latencies), "errors": {"lost": lost} if lost else {}}
+
+
+def drive_chat(server_socket, packet_size, clients, options):
+    """
+    Chat swarm - the chatters chat in pairs at a fixed rate
+    """
+    # The swarm of the app folder put on the path by `drive`
+    import swarm
+    messages = max(1, int(options["rate"] * options["duration"]))
+    report, _ = swarm.run(max(2, clients), server_socket, packet_size, messages=messages, rate=options["rate"],
+                          timeout=1, ramp=0.1)
+    return {"latencies": report.latencies["chat"], "operations": report.counters["delivered"],
+            "errors": dict(report.errors)}
+
+
+def drive_hand_cricket(server_socket, packet_size, clients, options):
+    """
+    Hand Cricket swarm - every player plays its matches against the bot, seeded
+    """
+    import swarm
+    report, _ = swarm.run(clients, server_socket, packet_size, matches=options["matches"], opponent="bot",
+                          seed=options["seed"], timeout=2, ramp=0.1)
+    return {"latencies": report.latencies["ball"], "operations": report.counters["balls"],
+            "errors": dict(report.errors)}
+
+
+def drive_file_transfer(server_socket, packet_size, clients, options):
+    """
+    Uploads a file of random Bytes as fast as the socket takes it, the server handles one transfer at a time
+    """
+    content = random.Random(options["seed"]).randbytes(options["file_size"])
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(5)
+    latencies, errors = [], {}
+    for transfer in range(options["transfers"]):
+        began = time.perf_counter()
+        client.sendto(f"Upload benchmark{transfer}.bin {len(content)}".encode().ljust(packet_size), server_socket)
+        client.recvfrom(packet_size)
+        view = memoryview(content)
+        for offset in range(0, len(content), packet_size):
+            client.sendto(view[offset:offset + packet_size], server_socket)
+        client.sendto(b"Upload Done".ljust(packet_size), server_socket)
+        response = client.recvfrom(packet_size)[0].strip().lower()
+        latencies.append(time.perf_counter() - began)
+        if response != b"done":
+            errors["corrupted"] = errors.get("corrupted", 0) + 1
+    client.close()
+    return {"latencies": latencies, "operations": options["transfers"], "errors": errors}
+
+
+DRIVERS = {"echo": drive_echo, "chat": drive_chat, "file_transfer": drive_file_transfer,
+           "hand_cricket": drive_hand_cricket}
+
+
+def drive(app, server_socket, packet_size, clients, options):
+    """
+    Entry point of the driver process, which imports the swarm of the app - every app has its own `server` and
+    `swarm` modules, so each run gets a fresh process
+    :return: dict - Driver results along with the elapsed time in sec
+    """
+    sys.path.insert(0, os.path.join(ROOT, APPS[app][0]))
+    began = time.perf_counter()
+    result = DRIVERS[app](server_socket, packet_size, clients, options)
+    result["elapsed"] = time.perf_counter() - began
+    return result
+
+
+def process_usage(pid):
+    """
+    :return: (CPU Time in sec, Peak RSS in MB) of the process from /proc, (None, None) where there is none
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            fields = stat.read().rsplit(')', 1)[1].split()
+        with open(f"/proc/{pid}/status") as status:
+            peak = next((int(line.split()[1]) for line in status if line.startswith("VmHWM")), 0)
+    except OSError:
+        return None, None
+    # utime and stime, the 14th and 15th fields
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK"), peak / 1024
+
+
+def scrape(metrics_port, timeout=1.0):
+    """
+    :return: dict - Metric Name -> Sum over its labels, from the Server's metrics endpoint
+    """
+    totals = {}
+    with urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=timeout) as response:
+        for line in response.read().decode().splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                name = name.split('{', 1)[0]
+                totals[name] = totals.get(name, 0) + float(value)
+    return totals
+
+
+def start_server(app, port, metrics_port, packet_size, directory):
+    """
+    Starts the Server of the app as a subprocess logging WARNING and above, in a scratch directory
+    :return: subprocess.Popen, once its metrics endpoint answers
+    """
+    folder, server_options, _ = APPS[app]
+    os.makedirs(os.path.join(directory, "Server_Receive"), exist_ok=True)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, folder, "server.py"), "-i", "127.0.0.1",
+                               "-p", str(port), "-s", str(packet_size), "--metrics-port", str(metrics_port),
+                               "--log-level", "warning", "--log-file", "server.log"] + server_options,
+                              cwd=directory, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            scrape(metrics_port, timeout=0.2)
+            return server
+        except OSError:
+            if server.poll() is not None or time.monotonic() > deadline:
+                server.kill()
+                raise RuntimeError(f"{app} server did not start, see {directory}/server.log")
+            time.sleep(0.05)
+
+
+def start_proxy(port, server_port, impair):
+    """
+    Starts udp_impair.py between the driver and the Server
+    :param impair: Impairment options of the proxy, as given on its command line
+    :return: subprocess.Popen
+    """
+    proxy = subprocess.Popen([sys.executable, os.path.join(ROOT, "udp_impair.py"), "-i", "127.0.0.1", "-p", str(port),
+                              "--server-port", str(server_port)] + shlex.split(impair),
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Bound well before the driver process is up, checked for a bad option
+    time.sleep(0.3)
+    if proxy.poll() is not None:
+        raise RuntimeError(f"udp_impair.py did not start with '{impair}'")
+    return proxy
+
+
+def run(app, packet_size, clients, port, options):
+    """
+    Benchmarks one app at one Packet Size and Client count on a fresh Server, through the impairment proxy on the
+    third port if asked for
+    :return: dict - Result of the run
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(app, port, port + 1, packet_size, directory)
+        proxy = None
+        try:
+            target = port
+            if options["impair"] is not None:
+                proxy = start_proxy(port + 2, port, options["impair"])
+                target = port + 2
+            before = scrape(port + 1)
+            cpu_before, _ = process_usage(server.pid)
+            with ProcessPoolExecutor(max_workers=1) as driver:
+                result = driver.submit(drive, app, ("127.0.0.1", target), packet_size, clients, options).result()
+            after = scrape(port + 1)
+            cpu_after, peak_rss = process_usage(server.pid)
+        finally:
+            for process in (proxy, server):
+                if process is not None:
+                    process.terminate()
+                    process.wait()
+
+    def delta(name):
+        return int(after.get(name, 0) - before.get(name, 0))
+
+    elapsed = result["elapsed"]
+    datagrams = delta("udp_packets_received_total") + delta("udp_packets_sent_total")
+    data_bytes = delta("udp_bytes_received_total") + delta("udp_bytes_sent_total")
+    cpu = None if cpu_before is None else cpu_after - cpu_before
+    return {
+        "app": app,
+        "packet_size": packet_size,
+        "clients": clients,
+        "elapsed_s": round(elapsed, 3),
+        "operations": result["operations"],
+        "operations_per_sec": round(result["operations"] / elapsed, 1),
+        "datagrams": datagrams,
+        "datagrams_per_sec": round(datagrams / elapsed, 1),
+        "mb_per_sec": round(data_bytes / elapsed / 1e6, 3),
+        "latency": APPS[app][2],
+        "latency_ms": {f"p{point}": round(value * 1000, 3)
+                       for point, value in percentiles(result["latencies"]).items()},
+        "server_cpu_s": None if cpu is None else round(cpu, 3),
+        "cpu_us_per_datagram": None if cpu is None or not datagrams else round(cpu / datagrams * 1e6, 2),
+        "server_peak_rss_mb": None if peak_rss is None else round(peak_rss, 1),
+        "kernel_drops": delta("udp_socket_drops_total"),
+        "errors": result["errors"],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_run(result):
+    print(f"{result['app']:>14} {result['packet_size']:>6} {result['clients']:>7} "
+          f"{result['datagrams_per_sec']:>11.0f} {result['mb_per_sec']:>8.2f} "
+          f"{result['latency_ms']['p50']:>8.2f} {result['latency_ms']['p99']:>8.2f} "
+          f"{result['cpu_us_per_datagram'] if result['cpu_us_per_datagram'] is not None else '-':>9} "
+          f"{result['server_peak_rss_mb'] if result['server_peak_rss_mb'] is not None else '-':>7} "
+          f"{sum(result['errors'].values()) + result['kernel_drops']:>6}")
+
+
+def compare(base_path, new_path):
+    """
+    Prints the change of every run found in both result files
+    """
+    with open(base_path) as base_file, open(new_path) as new_file:
+        base, new = json.load(base_file), json.load(new_file)
+    print(f"{base['commit']} -> {new['commit']}")
+    print(f"{'App':>14} {'Size':>6} {'Clients':>7} {'Datagrams/s':>12} {'p99 ms':>8} {'CPU us/dgram':>13}")
+    base_runs = {(result["app"], result["packet_size"], result["clients"]): result for result in base["runs"]}
+
+    def change(old, value):
+        return f"{(value - old) / old:+.1%}" if old and value is not None else "-"
+
+    for result in new["runs"]:
+        old = base_runs.get((result["app"], result["packet_size"], result["clients"]))
+        if old is None:
+            continue
+        print(f"{result['app']:>14} {result['packet_size']:>6} {result['clients']:>7} "
+              f"{change(old['datagrams_per_sec'], result['datagrams_per_sec']):>12} "
+              f"{change(old['latency_ms']['p99'], result['latency_ms']['p99']):>8} "
+              f"{change(old['cpu_us_per_datagram'], result['cpu_us_per_datagram']):>13}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Loopback Benchmark of the Echo, Chat, File Transfer and Hand '
+                                                 'Cricket Servers',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('-a', '--apps', nargs='+', choices=APPS, help='Apps to benchmark', default=list(APPS))
+    parser.add_argument('-s', '--sizes', nargs='+', type=int, metavar="PACKET_SIZE",
+                        help='Packet Sizes in Bytes', default=[64, 1024])
+    parser.add_argument('-n', '--clients', nargs='+', type=int,
+                        help='Client counts, File Transfer always runs a single Client', default=[2, 32])
+    parser.add_argument('-d', '--duration', type=float, help='Time in sec an Echo or Chat run lasts', default=3)
+    parser.add_argument('-r', '--rate', type=float, help='Messages per sec of every chatter', default=100)
+    parser.add_argument('-m', '--matches', type=int, help='Matches every Hand Cricket player plays', default=3)
+    parser.add_argument('-f', '--file-size', type=float, metavar="MEGA_BYTES", help='Size of the uploaded file',
+                        default=4)
+    parser.add_argument('--transfers', type=int, help='Uploads per File Transfer run', default=3)
+    parser.add_argument('--seed', type=int, help='Random Seed of the File contents and the Hand Cricket players',
+                        default=7)
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER",
+                        help='First Port to use, every run takes three fresh ones', default=19000)
+    parser.add_argument('-o', '--output', type=str, metavar="FILE",
+                        help='JSON File the results are written to, benchmark-<commit>.json if not given')
+    parser.add_argument('--impair', type=str, metavar="OPTIONS",
+                        help='Run through udp_impair.py with these options, e.g. "--loss 0.01 --delay 5"')
+    parser.add_argument('--compare', nargs=2, metavar=("BASE", "NEW"),
+                        help='Compare two result files instead of running')
+
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    run_options = {"duration": args.duration, "rate": args.rate, "matches": args.matches, "seed": args.seed,
+                   "file_size": int(args.file_size * (1 << 20)), "transfers": args.transfers,
+                   "impair": args.impair}
+    commit = git_commit()
+    results = {"commit": commit, "started": time.strftime('%Y-%m-%dT%H:%M:%S'), "python": platform.python_version(),
+               "platform": platform.platform(), "cpus": os.cpu_count(), "options": run_options, "runs": []}
+    print(f"{'App':>14} {'Size':>6} {'Clients':>7} {'Datagrams/s':>11} {'MB/s':>8} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'CPU us/dg':>9} {'RSS MB':>7} {'Errors':>6}")
+    next_port = args.port
+    for app in args.apps:
+        for size in args.sizes:
+            for count in ([1] if app == "file_transfer" else args.clients):
+                outcome = run(app, size, count, next_port, run_options)
+                # Fresh ports every run, the sockets of the previous run may linger
+                next_port += 3
+                results["runs"].append(outcome)
+                print_run(outcome)
+
+    output = args.output or f"benchmark-{commit}.json"
+    with open(output, "w") as result_file:
+        json.dump(results, result_file, indent=2)
+    print(f"[BENCHMARK] {len(results['runs'])} runs written to {output}")
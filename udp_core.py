@@ -0,0 +1,337 @@
+import socket
+import struct
+import time
+
+FORMAT = "iso-8859-1"
+
+# Kernel Send and Receive Buffer asked for, capped by net.core.rmem_max / wmem_max on Linux
+SOCKET_BUFFER = 1 << 22
+
+# Longest opcode looked at, the rest of a datagram is never copied to find it
+MAX_OPCODE = 16
+
+# Linux UDP Generic Segmentation and Receive Offload options of linux/udp.h, the socket module has no names for them
+UDP_SEGMENT = 103
+UDP_GRO = 104
+SOL_UDP = getattr(socket, "SOL_UDP", socket.IPPROTO_UDP)
+# Most datagrams and Bytes the kernel segments out of a single send - the largest IPv4 payload
+MAX_SEGMENTS = 64
+MAX_OFFLOAD = 65507
+# Room for the segment size the kernel hands along with a coalesced receive
+GRO_CONTROL = socket.CMSG_SPACE(4) if hasattr(socket, "CMSG_SPACE") else 0
+# Linux kernel receive timestamp option of asm-generic/socket.h, handed along as a struct timespec
+SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+TIMESPEC = struct.Struct("@ll")
+TIMESTAMP_CONTROL = socket.CMSG_SPACE(TIMESPEC.size) if hasattr(socket, "CMSG_SPACE") else 0
+# Received and Sent Times in ns of an Echo Stamp reply, after its `Stamped ` opcode
+STAMP = struct.Struct("!QQ")
+STAMPED = b"Stamped "
+STAMP_HEADER = len(STAMPED) + STAMP.size
+
+
+def create_socket(family, address=None, timeout=None, buffer_size=SOCKET_BUFFER, reuse_port=False,
+                  dual_stack=True):
+    """
+    UDP Socket tuned for bursts - large kernel buffers so a busy receive loop does not drop datagrams
+
+    :param family: Address Family - AF_INET - IPv4 , AF_INET6 - IPv6
+    :param address: (IP, Port) to Port Bind to, None for a Client left to the ephemeral port
+    :param timeout: Time in sec a receive waits, None to block
+    :param buffer_size: Kernel Send and Receive Buffer Size in Bytes, None to keep the system default
+    :param reuse_port: True to let several processes bind the same port, the kernel spreads the Clients over them
+    :param dual_stack: True for an IPv6 socket to also take IPv4 Clients as mapped addresses
+    :return: socket.socket
+    """
+    udp_socket = socket.socket(family, socket.SOCK_DGRAM)
+    if buffer_size is not None:
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                udp_socket.setsockopt(socket.SOL_SOCKET, option, buffer_size)
+            except OSError:
+                pass
+    if reuse_port and hasattr(socket, "SO_REUSEPORT"):
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if family == socket.AF_INET6 and hasattr(socket, "IPV6_V6ONLY"):
+        try:
+            udp_socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0 if dual_stack else 1)
+        except OSError:
+            pass
+    if address is not None:
+        udp_socket.bind(address)
+    udp_socket.settimeout(timeout)
+    return udp_socket
+
+
+class BufferPool:
+    def __init__(self, buffer_size, count=4):
+        """
+        Free list of equally sized bytearrays, received into and read into instead of allocating per datagram
+        :param buffer_size: Size of every buffer in Bytes
+        :param count: Buffers kept on the free list, more are allocated on demand and dropped on release
+        """
+        self.buffer_size = buffer_size
+        self.count = count
+        self.free = [bytearray(buffer_size) for _ in range(count)]
+
+    def acquire(self):
+        return self.free.pop() if self.free else bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        # Buffers of a previous size are left to the garbage collector
+        if len(buffer) == self.buffer_size and len(self.free) < self.count:
+            self.free.append(buffer)
+
+    def resize(self, buffer_size):
+        """
+        Switches the pool to a new buffer size, the buffers handed out before are dropped once released
+        """
+        if buffer_size != self.buffer_size:
+            self.buffer_size = buffer_size
+            self.free = [bytearray(buffer_size) for _ in range(self.count)]
+
+
+def receive(udp_socket, buffer, size=None):
+    """
+    Receives a datagram into the buffer
+    :param size: Most Bytes taken from the datagram, the whole buffer if None
+    :return: (memoryview of the datagram - valid until the buffer is reused, (IP, Port) of the sender)
+    """
+    num_bytes, address = udp_socket.recvfrom_into(buffer, size or len(buffer))
+    return memoryview(buffer)[:num_bytes], address
+
+
+def offload_supported(udp_socket):
+    """
+    :return: True if the kernel has UDP GSO and GRO - Linux 5.0 and later
+    """
+    if not hasattr(udp_socket, "sendmsg") or not GRO_CONTROL:
+        return False
+    try:
+        udp_socket.getsockopt(SOL_UDP, UDP_SEGMENT)
+        udp_socket.getsockopt(SOL_UDP, UDP_GRO)
+    except OSError:
+        return False
+    return True
+
+
+def set_gro(udp_socket, enabled):
+    """
+    Lets the kernel coalesce the equally sized datagrams of a flow into a single receive, see `receive_segments`.
+    Only for a loop receiving with `receive_segments` into a buffer of MAX_OFFLOAD Bytes, anything else would
+    truncate a coalesced receive
+    :return: True if it was set
+    """
+    try:
+        udp_socket.setsockopt(SOL_UDP, UDP_GRO, 1 if enabled else 0)
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+def set_timestamps(udp_socket, enabled):
+    """
+    Has the kernel stamp every datagram with the time it was received, see `receive_timestamped`
+    :return: True if it was set
+    """
+    if not TIMESTAMP_CONTROL:
+        return False
+    try:
+        udp_socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1 if enabled else 0)
+    except OSError:
+        return False
+    return True
+
+
+def receive_timestamped(udp_socket, buffer, size=None):
+    """
+    Receives a datagram into the buffer, along with the time the kernel received it
+    :param size: Most Bytes taken from the datagram, the whole buffer if None
+    :return: (memoryview of the datagram - valid until the buffer is reused, (IP, Port) of the sender,
+              Time in ns since the epoch on the clock of time.time_ns - None where the kernel gave none)
+    """
+    view = memoryview(buffer)[:size or len(buffer)]
+    num_bytes, control, _, address = udp_socket.recvmsg_into([view], TIMESTAMP_CONTROL)
+    for level, kind, value in control:
+        if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(value) >= TIMESPEC.size:
+            seconds, nanoseconds = TIMESPEC.unpack_from(value)
+            return view[:num_bytes], address, seconds * 1_000_000_000 + nanoseconds
+    return view[:num_bytes], address, None
+
+
+def receive_segments(udp_socket, buffer, gro=True, size=None):
+    """
+    Receives a datagram, or the datagrams the kernel coalesced, into the buffer
+    :param gro: False for a socket without UDP GRO, a single `recvfrom_into`
+    :param size: Most Bytes taken from a datagram without UDP GRO, the whole buffer if None
+    :return: (list of memoryview of the datagrams - valid until the buffer is reused, (IP, Port) of the sender)
+    """
+    if not gro:
+        data, address = receive(udp_socket, buffer, size)
+        return [data], address
+    num_bytes, control, _, address = udp_socket.recvmsg_into([buffer], GRO_CONTROL)
+    view = memoryview(buffer)[:num_bytes]
+    segment_size = num_bytes
+    for level, kind, value in control:
+        if level == SOL_UDP and kind == UDP_GRO:
+            segment_size = struct.unpack("=i", value[:4])[0]
+    if not segment_size or segment_size >= num_bytes:
+        return [view], address
+    return [view[offset:offset + segment_size] for offset in range(0, num_bytes, segment_size)], address
+
+
+class SegmentSender:
+    def __init__(self, udp_socket, segment_size, offload=True, rate=None):
+        """
+        Sends a block of equally sized datagrams - all of them in a single syscall with UDP GSO, the kernel
+        splits the block, or a `sendto` per datagram where there is none
+
+        A first GSO send the route refuses - a device without the offload, a segment above its MTU - switches the
+        sender to `sendto` for good. The blocks are paced by their Bytes, so a block of many datagrams waits as long
+        as the same datagrams sent one by one would
+        :param segment_size: Size of every datagram but the last in Bytes
+        :param offload: False to always send a datagram per `sendto`
+        :param rate: Bytes per sec the blocks are paced at, None for as fast as the socket takes them
+        """
+        self.udp_socket = udp_socket
+        self.offload = offload and offload_supported(udp_socket)
+        self.segment_size = segment_size
+        self.rate = rate
+        self.paced_until = 0.0
+        self.syscalls = 0
+
+    @property
+    def batch(self):
+        """
+        :return: int - Datagrams worth sending as a single block
+        """
+        if not self.offload:
+            return 1
+        return max(1, min(MAX_SEGMENTS, MAX_OFFLOAD // self.segment_size))
+
+    def send(self, block, address):
+        """
+        :param block: Bytes-like of upto `batch` datagrams back to back
+        :return: int - Datagrams sent
+        """
+        if self.rate:
+            self.pace(len(block))
+        size = self.segment_size
+        if self.offload and len(block) > size:
+            try:
+                self.udp_socket.sendmsg([block], [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", size))], 0, address)
+                self.syscalls += 1
+                return -(-len(block) // size)
+            except OSError:
+                self.offload = False
+        block = memoryview(block)
+        for offset in range(0, len(block), size):
+            self.udp_socket.sendto(block[offset:offset + size], address)
+            self.syscalls += 1
+        return -(-len(block) // size) if block else 0
+
+    def pace(self, num_bytes):
+        """
+        Waits until the Bytes sent so far are due at the rate, a late send does not pile up a burst after it
+        """
+        now = time.monotonic()
+        self.paced_until = max(self.paced_until, now) + num_bytes / self.rate
+        if self.paced_until - now > 0.001:
+            time.sleep(self.paced_until - now)
+
+
+def opcode(data):
+    """
+    :param data: Bytes, bytearray or memoryview of a datagram
+    :return: bytes - Lower cased first word of the datagram, b'' if it is blank
+    """
+    head = bytes(data[:MAX_OPCODE]).split(None, 1)
+    return head[0].lower() if head else b''
+
+
+def text(data):
+    """
+    :return: string - Datagram decoded without its padding
+    """
+    return str(data, FORMAT).strip()
+
+
+class Framer:
+    def __init__(self, packet_size):
+        """
+        Space padded framing of the text messages
+
+        A message is encoded straight into a scratch packet, of which only the Bytes the previous message dirtied
+        are blanked again - no concatenation and no decode / encode round trip
+        :param packet_size: Size every message is padded upto in Bytes
+        """
+        self.packet_size = packet_size
+
+    @property
+    def packet_size(self):
+        return self._packet_size
+
+    @packet_size.setter
+    def packet_size(self, packet_size):
+        self._packet_size = packet_size
+        self.blank = memoryview(b' ' * packet_size)
+        self.scratch = memoryview(bytearray(packet_size))
+        self.scratch[:] = self.blank
+        self.dirty = 0
+
+    def frame(self, message):
+        """
+        Pads the message in the scratch packet, not thread safe
+        :param message: String or Bytes
+        :return: memoryview (or Bytes if the message is longer than the Packet Size) - valid until the next frame
+        """
+        if isinstance(message, str):
+            message = message.encode(FORMAT)
+        length = len(message)
+        if length >= self._packet_size:
+            return message
+        self.scratch[:length] = message
+        if self.dirty > length:
+            self.scratch[length:self.dirty] = self.blank[length:self.dirty]
+        self.dirty = length
+        return self.scratch
+
+    def pad(self, message):
+        """
+        :return: bytes - Padded message of its own, to be kept or handed to another thread
+        """
+        if isinstance(message, str):
+            message = message.encode(FORMAT)
+        return message.ljust(self._packet_size)
+
+    def send(self, udp_socket, message, address):
+        udp_socket.sendto(self.frame(message), address)
+
+
+class Dispatcher:
+    def __init__(self, default=None):
+        """
+        Table of the handlers of a protocol, looked up by the opcode of a datagram - its first word
+        :param default: Handler of the unknown opcodes, None to ignore them
+        """
+        self.handlers = {}
+        self.default = default or self.ignore
+
+    def register(self, command, handler):
+        """
+        :param command: Opcode, any case
+        :param handler: Callable taking the datagram and the extra arguments of `dispatch`
+        """
+        self.handlers[command.lower().encode(FORMAT)] = handler
+
+    def handler(self, command):
+        """
+        :param command: Opcode from `opcode`
+        """
+        return self.handlers.get(command, self.default)
+
+    def dispatch(self, data, *args):
+        return self.handlers.get(opcode(data), self.default)(data, *args)
+
+    @staticmethod
+    def ignore(*_):
+        return None
@@ -0,0 +1,352 @@
+import argparse
+import heapq
+import itertools
+import random
+import selectors
+import socket
+import sys
+import time
+
+from udp_core import create_socket
+import udp_metrics
+
+DISTRIBUTIONS = ("uniform", "normal", "exponential", "pareto")
+
+# Shape of the Pareto delay, heavy tailed - its variance is infinite below 2
+PARETO_SHAPE = 1.5
+
+# Datagrams read off a socket before the others get their turn
+BATCH = 64
+
+# Largest UDP payload
+MAX_DATAGRAM = 65535
+
+OUTCOMES = ("forwarded", "lost", "duplicated", "reordered", "overflow")
+
+
+class GilbertElliott:
+    def __init__(self, rng, enter, leave, loss_good=0.0, loss_bad=1.0):
+        """
+        Two state loss model of bursty links - a Good state losing few datagrams and a Bad state losing most,
+        switched between per datagram. The mean burst lasts 1 / leave datagrams, and 1 / enter ones pass between
+        bursts
+        :param rng: random.Random of the direction
+        :param enter: Probability of going from Good to Bad
+        :param leave: Probability of going from Bad to Good
+        :param loss_good: Loss Probability in the Good state
+        :param loss_bad: Loss Probability in the Bad state
+        """
+        self.rng = rng
+        self.enter = enter
+        self.leave = leave
+        self.loss_good = loss_good
+        self.loss_bad = loss_bad
+        self.bad = False
+
+    def lost(self):
+        random_value = self.rng.random
+        if self.bad:
+            if random_value() < self.leave:
+                self.bad = False
+        elif random_value() < self.enter:
+            self.bad = True
+        loss = self.loss_bad if self.bad else self.loss_good
+        return loss > 0 and random_value() < loss
+
+
+class Impairment:
+    def __init__(self, seed=None, loss=0.0, burst=None, delay=0.0, jitter=0.0, distribution="uniform", rate=None,
+                 queue=1 << 20, reorder=0.0, reorder_gap=0.001, duplicate=0.0):
+        """
+        Impairments of one direction of the proxy, applied in the order of netem - loss, duplication, the bandwidth
+        cap, then the delay
+
+        Every decision is drawn from a Random of its own, so a seed gives the same datagrams lost, duplicated and
+        delayed by the same amounts on every run - given the same datagrams in the same order
+        :param seed: Random Seed, None for a fresh one
+        :param loss: Loss Probability of a datagram, the Good state loss when bursty
+        :param burst: (enter, leave, loss in the Bad state) of the Gilbert-Elliott model, None for independent loss
+        :param delay: Base one way Delay in sec
+        :param jitter: Spread of the Delay in sec - the half width for uniform, the standard deviation for normal,
+                       the mean added for exponential and pareto
+        :param distribution: Delay Distribution, one of DISTRIBUTIONS
+        :param rate: Bandwidth cap in Bytes per sec, None for none
+        :param queue: Most Bytes waiting for the bandwidth cap, the datagrams over it are dropped as overflow
+        :param reorder: Probability of a datagram being held back so the ones behind it overtake it
+        :param reorder_gap: Time in sec a reordered datagram is held back by
+        :param duplicate: Probability of a datagram being sent twice
+        """
+        self.rng = random.Random(seed)
+        self.loss = loss
+        self.burst = GilbertElliott(self.rng, burst[0], burst[1], loss, burst[2]) if burst else None
+        self.delay = delay
+        self.jitter = jitter
+        self.distribution = distribution
+        self.rate = rate
+        self.queue = queue
+        self.reorder = reorder
+        self.reorder_gap = reorder_gap
+        self.duplicate = duplicate
+        # Time the bandwidth capped link is done sending what it was given
+        self.link_free = 0.0
+        self.stats = dict.fromkeys(OUTCOMES, 0)
+        # Nothing to hold a datagram back for, it is forwarded at once without a copy
+        self.immediate = not (delay or jitter or rate or reorder)
+        # Nothing to decide either, not a single draw per datagram
+        self.clean = self.immediate and not (loss or burst or duplicate)
+
+    def lost(self):
+        if self.burst is not None:
+            return self.burst.lost()
+        return self.loss > 0 and self.rng.random() < self.loss
+
+    def copies(self):
+        """
+        :return: int - Times the datagram is sent, 0 if lost
+        """
+        if self.lost():
+            self.stats["lost"] += 1
+            return 0
+        if self.duplicate and self.rng.random() < self.duplicate:
+            self.stats["duplicated"] += 1
+            return 2
+        return 1
+
+    def latency(self):
+        """
+        :return: float - Delay in sec drawn from the distribution, never below 0
+        """
+        if not self.jitter:
+            return self.delay
+        if self.distribution == "normal":
+            extra = self.rng.gauss(0, self.jitter)
+        elif self.distribution == "exponential":
+            extra = self.rng.expovariate(1 / self.jitter)
+        elif self.distribution == "pareto":
+            # Scaled so the mean added is the jitter
+            extra = self.jitter * (PARETO_SHAPE - 1) * (self.rng.paretovariate(PARETO_SHAPE) - 1)
+        else:
+            extra = self.rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.delay + extra)
+
+    def departure(self, now, size):
+        """
+        :param now: Arrival time of the datagram, time.monotonic
+        :param size: Datagram Size in Bytes
+        :return: Time the datagram is due to leave the proxy, None if it overflows the bandwidth cap queue
+        """
+        due = now
+        if self.rate:
+            start = max(now, self.link_free)
+            if (start - now) * self.rate + size > self.queue:
+                self.stats["overflow"] += 1
+                return None
+            self.link_free = start + size / self.rate
+            due = self.link_free
+        due += self.latency()
+        if self.reorder and self.rng.random() < self.reorder:
+            self.stats["reordered"] += 1
+            due += self.reorder_gap
+        return due
+
+
+class ImpairmentProxy:
+    def __init__(self, address_info, server_info, upstream, downstream):
+        """
+        UDP Proxy between the Clients and a Server impairing the datagrams each way
+
+        Every Client gets an upstream socket of its own, so the Server tells the Clients apart by their proxy port
+        as it would by their own. A single thread reads every socket in batches, sends what is due at once straight
+        from the receive buffer and keeps the held back datagrams on a heap ordered by their departure time
+        :param address_info: getaddrinfo entry of the Port the Clients send to
+        :param server_info: getaddrinfo entry of the Server
+        :param upstream: Impairment of the Client to Server direction
+        :param downstream: Impairment of the Server to Client direction
+        """
+        self.socket = (address_info[4][0], address_info[4][1])
+        self.server_socket = (server_info[4][0], server_info[4][1])
+        self.server_family = server_info[0]
+        self.listener = create_socket(address_info[0], self.socket)
+        self.listener.setblocking(False)
+        self.upstream = upstream
+        self.downstream = downstream
+        self.buffer = bytearray(MAX_DATAGRAM)
+        # Client (IP, Port) -> its upstream socket, and the way back
+        self.sockets = {}
+        self.clients = {}
+        # (Departure time, sequence, socket, datagram, address) of the held back datagrams
+        self.pending = []
+        self.sequence = itertools.count()
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.running = True
+
+    def upstream_socket(self, client_socket):
+        udp_socket = self.sockets.get(client_socket)
+        if udp_socket is None:
+            udp_socket = create_socket(self.server_family)
+            udp_socket.setblocking(False)
+            self.sockets[client_socket] = udp_socket
+            self.clients[udp_socket] = client_socket
+            self.selector.register(udp_socket, selectors.EVENT_READ)
+        return udp_socket
+
+    def forward(self, impairment, data, out_socket, address):
+        if impairment.clean:
+            self.send(impairment, out_socket, data, address)
+            return
+        copies = impairment.copies()
+        if impairment.immediate:
+            for _ in range(copies):
+                self.send(impairment, out_socket, data, address)
+            return
+        now = time.monotonic()
+        for _ in range(copies):
+            due = impairment.departure(now, len(data))
+            if due is not None:
+                heapq.heappush(self.pending, (due, next(self.sequence), out_socket, bytes(data), address))
+
+    @staticmethod
+    def send(impairment, out_socket, data, address):
+        try:
+            out_socket.sendto(data, address)
+            impairment.stats["forwarded"] += 1
+        except (BlockingIOError, InterruptedError):
+            # Full kernel send buffer
+            impairment.stats["overflow"] += 1
+        except OSError:
+            # Unreachable peer
+            impairment.stats["lost"] += 1
+
+    def drain(self, in_socket):
+        """
+        Reads upto a batch of datagrams off the socket and forwards them
+        """
+        buffer = self.buffer
+        view = memoryview(buffer)
+        if in_socket is self.listener:
+            impairment, address_to = self.upstream, self.server_socket
+        else:
+            impairment, out_socket, address_to = self.downstream, self.listener, self.clients[in_socket]
+        for _ in range(BATCH):
+            try:
+                num_bytes, address = in_socket.recvfrom_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # ICMP Port Unreachable of a previous send to a Server that is down
+                continue
+            if impairment is self.upstream:
+                out_socket = self.sockets.get(address) or self.upstream_socket(address)
+            self.forward(impairment, view[:num_bytes], out_socket, address_to)
+
+    def run(self):
+        pending = self.pending
+        while self.running:
+            timeout = max(0.0, pending[0][0] - time.monotonic()) if pending else 0.5
+            for key, _ in self.selector.select(timeout):
+                self.drain(key.fileobj)
+            now = time.monotonic()
+            while pending and pending[0][0] <= now:
+                _, _, out_socket, data, address = heapq.heappop(pending)
+                self.send(self.upstream if out_socket is not self.listener else self.downstream, out_socket,
+                          data, address)
+
+    def close(self):
+        self.running = False
+        for udp_socket in (self.listener, *self.clients):
+            self.selector.unregister(udp_socket)
+            udp_socket.close()
+        self.selector.close()
+
+    def add_metrics(self, registry):
+        """
+        Adds the datagram outcomes per direction and the held back datagrams to a udp_metrics Registry
+        """
+        registry.counter("impair_datagrams_total", "Datagrams through the proxy by direction and outcome",
+                         ("direction", "outcome"),
+                         function=lambda: {(direction, outcome): count
+                                           for direction, impairment in (("upstream", self.upstream),
+                                                                         ("downstream", self.downstream))
+                                           for outcome, count in impairment.stats.items()})
+        registry.gauge("impair_pending_datagrams", "Datagrams held back for their departure time",
+                       function=lambda: len(self.pending))
+        registry.gauge("impair_clients", "Clients with an upstream socket", function=lambda: len(self.sockets))
+
+    def summary(self):
+        lines = [f"{'Direction':<12}" + ''.join(f"{outcome:>12}" for outcome in OUTCOMES)]
+        for direction, impairment in (("upstream", self.upstream), ("downstream", self.downstream)):
+            lines.append(f"{direction:<12}" + ''.join(f"{impairment.stats[outcome]:>12}" for outcome in OUTCOMES))
+        return '\n'.join(lines)
+
+
+def impairments(args):
+    """
+    :return: (upstream, downstream) Impairment from the parsed arguments, the one left out by `--direction` clean
+    """
+    def build(impaired, seed):
+        if not impaired:
+            return Impairment(seed=seed)
+        return Impairment(seed=seed, loss=args.loss, burst=args.burst, delay=args.delay / 1000,
+                          jitter=args.jitter / 1000, distribution=args.distribution,
+                          rate=args.rate * 1e6 / 8 if args.rate else None, queue=args.queue,
+                          reorder=args.reorder, reorder_gap=args.reorder_gap / 1000, duplicate=args.duplicate)
+    # Each direction draws from a Random of its own, so the traffic one way does not shift the other's decisions
+    upstream_seed = None if args.seed is None else args.seed * 2
+    downstream_seed = None if args.seed is None else args.seed * 2 + 1
+    return (build(args.direction in ("both", "upstream"), upstream_seed),
+            build(args.direction in ("both", "downstream"), downstream_seed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UDP Impairment Proxy - loss, delay, jitter, bandwidth caps, '
+                                                 'reordering and duplication between the Clients and a Server',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-v', '--version', action='version', version='v1.0')
+    parser.add_argument('-i', '--ip', type=str, metavar="IP_ADDRESS/DOMAIN_NAME",
+                        help='Local IP (IPv4 or IPv6) Address or Domain Name the Clients send to', default="127.0.0.1")
+    parser.add_argument('-p', '--port', type=int, metavar="PORT_NUMBER", help='Port the Clients send to',
+                        default=8777)
+    parser.add_argument('--server-ip', type=str, metavar="IP_ADDRESS/DOMAIN_NAME", help='Server IP or Domain Name',
+                        default="127.0.0.1")
+    parser.add_argument('--server-port', type=int, metavar="PORT_NUMBER", help='Server Port Number', default=7777)
+    parser.add_argument('--direction', choices=("both", "upstream", "downstream"), default="both",
+                        help='Directions impaired - upstream is Client to Server')
+    parser.add_argument('--seed', type=int, help='Random Seed of every decision, a fresh one if not given')
+    parser.add_argument('--loss', type=float, metavar="PROBABILITY", default=0.0,
+                        help='Loss Probability of a datagram, in the Good state with --burst')
+    parser.add_argument('--burst', type=float, nargs=3, metavar=("ENTER", "LEAVE", "LOSS"),
+                        help='Gilbert-Elliott bursty loss - Probability of entering and of leaving the Bad state per '
+                             'datagram, and the Loss Probability in it')
+    parser.add_argument('--delay', type=float, metavar="MILLI_SECONDS", help='One way Delay', default=0.0)
+    parser.add_argument('--jitter', type=float, metavar="MILLI_SECONDS", default=0.0,
+                        help='Delay spread - half width for uniform, standard deviation for normal, mean added for '
+                             'exponential and pareto')
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS, help='Delay Distribution', default="uniform")
+    parser.add_argument('--rate', type=float, metavar="MEGA_BITS", help='Bandwidth cap per direction in Mbit/s')
+    parser.add_argument('--queue', type=int, metavar="BYTES", default=1 << 20,
+                        help='Most Bytes queued for the bandwidth cap, the rest is dropped')
+    parser.add_argument('--reorder', type=float, metavar="PROBABILITY", default=0.0,
+                        help='Probability of a datagram being held back so the next ones overtake it')
+    parser.add_argument('--reorder-gap', type=float, metavar="MILLI_SECONDS", default=1.0,
+                        help='Time a reordered datagram is held back by')
+    parser.add_argument('--duplicate', type=float, metavar="PROBABILITY", help='Probability of a datagram being '
+                                                                               'sent twice', default=0.0)
+    udp_metrics.add_arguments(parser)
+
+    args = parser.parse_args()
+
+    address_info = socket.getaddrinfo(args.ip, args.port, proto=socket.IPPROTO_UDP)[0]
+    server_info = socket.getaddrinfo(args.server_ip, args.server_port, proto=socket.IPPROTO_UDP)[0]
+    proxy = ImpairmentProxy(address_info, server_info, *impairments(args))
+    if args.metrics_port:
+        registry = udp_metrics.Registry()
+        proxy.add_metrics(registry)
+        udp_metrics.serve(registry, args.metrics_port)
+    print(f"[PROXY] {proxy.socket} -> {proxy.server_socket}, impairing {args.direction}")
+    try:
+        proxy.run()
+    except KeyboardInterrupt:
+        pass
+    proxy.close()
+    print(proxy.summary(), file=sys.stderr)
@@ -0,0 +1,194 @@
+import atexit
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+from udp_core import FORMAT
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {value: name.upper() for name, value in LEVELS.items()}
+
+
+class Logger:
+    def __init__(self, level=INFO, stream=None, json_lines=False, rate=None, sample=None, background=True,
+                 interval=0.05, max_queue=1 << 16):
+        """
+        Structured Log of the servers - every record is an event tag with key = value fields
+
+        The receive loop formats a record and appends the line to a deque, the writes - which block on a slow
+        terminal or disk - happen on a background thread, so they do not slow the Server down. Formatting stays on
+        the caller since a writer busy with it would hold the GIL whenever the receive loop wakes up. Records below
+        the level cost a single comparison, the per datagram ones are DEBUG
+        :param level: Lowest level written
+        :param stream: File the records are written to, stdout if None
+        :param json_lines: True to write a JSON object per line instead of `[EVENT] key=value` text
+        :param rate: Most records per sec of any single event, the burst above is counted and dropped
+        :param sample: dict - Event -> N, only every Nth record of the event is kept
+        :param background: False to write every record at once on the calling thread
+        :param interval: Time in sec between writes of the background thread
+        :param max_queue: Most records waiting to be written, newer ones are dropped
+        """
+        self.level = level
+        self.stream = stream or sys.stdout
+        self.json_lines = json_lines
+        self.rate = rate
+        self.sample = sample or {}
+        self.interval = interval
+        self.max_queue = max_queue
+        # Formatted lines appended to by the receive loop and popped by the writer, both atomic on a deque
+        self.queue = deque()
+        # Event -> [tokens, last refill] for the rate limit, or records seen for the sampling
+        self.buckets = {}
+        self.seen = {}
+        # Whole second -> its formatted clock, most records fall in the same second as the previous one
+        self.second = None
+        self.clock = ''
+        self.written = 0
+        self.dropped = 0
+        self.suppressed = 0
+        self.running = background
+        self.writer = None
+        if background:
+            self.writer = threading.Thread(target=self.write_loop, daemon=True)
+            self.writer.start()
+            atexit.register(self.close)
+
+    def enabled(self, level):
+        return level >= self.level
+
+    def log(self, level, event, **fields):
+        if level < self.level:
+            return
+        every = self.sample.get(event)
+        if every is not None:
+            seen = self.seen[event] = self.seen.get(event, 0) + 1
+            if seen % every:
+                self.suppressed += 1
+                return
+        now = time.time()
+        if self.rate is not None and not self.allow(event, now):
+            self.suppressed += 1
+            return
+        line = self.format(now, level, event, fields)
+        if self.writer is None:
+            self.write([line])
+        elif len(self.queue) < self.max_queue:
+            self.queue.append(line)
+        else:
+            self.dropped += 1
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+    def allow(self, event, now):
+        """
+        Token Bucket per event, refilled at the rate upto a second's worth
+        """
+        bucket = self.buckets.get(event)
+        if bucket is None:
+            bucket = self.buckets[event] = [self.rate, now]
+        bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def write_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Writes every queued record
+        """
+        lines = []
+        try:
+            while True:
+                lines.append(self.queue.popleft())
+        except IndexError:
+            pass
+        if lines:
+            self.write(lines)
+
+    def write(self, lines):
+        self.stream.write(''.join(lines))
+        self.stream.flush()
+        self.written += len(lines)
+
+    def format(self, timestamp, level, event, fields):
+        second = int(timestamp)
+        if second != self.second:
+            self.second, self.clock = second, time.strftime('%H:%M:%S', time.localtime(second))
+        clock = f"{self.clock}.{int(timestamp % 1 * 1000):03d}"
+        if self.json_lines:
+            record = {"time": timestamp, "level": LEVEL_NAMES[level], "event": event}
+            record.update((key, self.value(value)) for key, value in fields.items())
+            return json.dumps(record) + "\n"
+        pairs = ' '.join(f"{key}={self.quote(self.value(value))}" for key, value in fields.items())
+        return f"{clock} {LEVEL_NAMES[level]:<7} [{event}] {pairs}\n"
+
+    @staticmethod
+    def value(value):
+        # (IP, Port) of a Client
+        if isinstance(value, tuple):
+            return f"{value[0]}:{value[1]}"
+        if isinstance(value, bytes):
+            return value.decode(FORMAT)
+        return value
+
+    @staticmethod
+    def quote(value):
+        value = str(value)
+        return json.dumps(value) if not value or ' ' in value or '"' in value else value
+
+    def stats(self):
+        """
+        :return: dict - Records written, dropped on a full queue and suppressed by the sampling or rate limit
+        """
+        return {"log_written": self.written, "log_dropped": self.dropped, "log_suppressed": self.suppressed}
+
+    def close(self):
+        self.running = False
+        if self.writer is not None and self.writer.is_alive() and self.writer is not threading.current_thread():
+            self.writer.join(self.interval * 4)
+        self.flush()
+
+
+def add_arguments(parser):
+    """
+    Adds the logging options shared by the servers to an argparse parser
+    """
+    parser.add_argument('--log-level', choices=LEVELS, default="info",
+                        help='Lowest level logged, debug adds a record per datagram')
+    parser.add_argument('--log-file', type=str, metavar="FILE", help='File the log is appended to, stdout if not given')
+    parser.add_argument('--log-json', action='store_true', help='Log a JSON object per line')
+    parser.add_argument('--log-rate', type=float, metavar="RECORDS",
+                        help='Most records per sec of any single event, 0 for no limit', default=1000)
+    parser.add_argument('--log-sample', type=int, metavar="N",
+                        help='Keep only every Nth record of the per datagram events', default=1)
+
+
+def from_arguments(args, packet_events=()):
+    """
+    :param args: Parsed arguments, see `add_arguments`
+    :param packet_events: Events logged per datagram, sampled by `--log-sample`
+    :return: Logger
+    """
+    stream = open(args.log_file, "a") if args.log_file else None
+    sample = {event: args.log_sample for event in packet_events} if args.log_sample > 1 else None
+    return Logger(level=LEVELS[args.log_level], stream=stream, json_lines=args.log_json, rate=args.log_rate or None,
+                  sample=sample)
@@ -0,0 +1,295 @@
+import bisect
+import http.server
+import os
+import threading
+import time
+
+from udp_core import FORMAT
+
+# Handler latency buckets in sec, 10 us to 1 s
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0)
+
+# Handler latency buckets of the traffic, powers of 2 in ns - 2^13 ns (8 us) to 2^30 ns (1 s) - so an
+# observation finds its bucket from the bit length of the elapsed time instead of a binary search
+FIRST_BIT, LAST_BIT = 13, 30
+BIT_BUCKETS = tuple((1 << bit) / 1e9 for bit in range(FIRST_BIT, LAST_BIT + 1))
+# Bit length of the elapsed ns -> bucket index, the last one past every bound
+BIT_INDEX = [min(max(bit - FIRST_BIT, 0), len(BIT_BUCKETS)) for bit in range(65)]
+
+# Opcode label of the datagrams sent outside of any handler, and of the unknown opcodes
+TIMER = b"timer"
+OTHER = b"other"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, description, labels=(), function=None):
+        """
+        A named series per label value - the label value itself for a single label, a tuple for more
+
+        :param name: Prometheus Metric Name
+        :param description: HELP text
+        :param labels: Label Names
+        :param function: Callable returning the value, or a dict - label value -> value, read on every scrape
+                         instead of being updated on the hot path
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.function = function
+        self.values = {}
+
+    def samples(self):
+        """
+        :return: list of (label value, value)
+        """
+        if self.function is not None:
+            value = self.function()
+            return list(value.items()) if isinstance(value, dict) else [((), value)]
+        # A single C call, safe against the receive loop adding a series meanwhile
+        return list(self.values.items())
+
+    def label_text(self, key, extra=''):
+        keys = key if len(self.labels) > 1 else (key,) if self.labels else ()
+        pairs = [f'{label}="{escape(value)}"' for label, value in zip(self.labels, keys)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.samples():
+            lines.append(f"{self.name}{self.label_text(key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, key=(), amount=1):
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, key=()):
+        self.values[key] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS, function=None):
+        """
+        Fixed bucket Histogram, an observation is a binary search and two additions
+        :param buckets: Sorted upper bounds of the buckets
+        :param function: Callable returning a dict - label value -> (count per bucket, sum), read on every scrape
+        """
+        super().__init__(name, description, labels, function)
+        self.buckets = buckets
+
+    def observe(self, value, key=()):
+        series = self.values.get(key)
+        if series is None:
+            # Count per bucket (the last one past every bound) and Sum
+            series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, total) in self.samples():
+            counts = list(counts)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{self.label_text(key, f'le={chr(34)}{le}{chr(34)}')} {cumulative}")
+            lines.append(f"{self.name}_sum{self.label_text(key)} {total}")
+            lines.append(f"{self.name}_count{self.label_text(key)} {cumulative}")
+        return lines
+
+
+def escape(value):
+    if isinstance(value, bytes):
+        value = value.decode(FORMAT)
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    def __init__(self):
+        """
+        Metrics of a Server, rendered in the Prometheus text format on every scrape
+        """
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, labels=(), function=None):
+        return self.register(Counter(name, description, labels, function))
+
+    def gauge(self, name, description, labels=(), function=None):
+        return self.register(Gauge(name, description, labels, function))
+
+    def histogram(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, description, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class TrafficMetrics:
+    def __init__(self, registry, opcodes):
+        """
+        Datagrams and Bytes in and out plus handler latency, per opcode
+
+        Every opcode has a flat list of its counters allocated upfront, a datagram updates it in place - no dict
+        insert on the receive loop, and a scrape never sees the table change size. A datagram sent is put down to
+        the opcode of the datagram being handled, `timer` outside of a handler
+        :param registry: Registry the metrics are added to
+        :param opcodes: Known opcodes (bytes), the others are counted as `other` to keep the labels bounded
+        """
+        # Opcode -> [Datagrams in, Bytes in, Datagrams out, Bytes out, latency count per bucket, latency sum in ns]
+        self.series = {command: [0, 0, 0, 0, [0] * (len(BIT_BUCKETS) + 1), 0]
+                       for command in (*opcodes, OTHER, TIMER)}
+        self.other = self.series[OTHER]
+        self.current = self.timer = self.series[TIMER]
+        # Nothing is received outside of a handler
+        for name, description, field, timer in (("udp_packets_received_total", "Datagrams received", 0, False),
+                                                ("udp_bytes_received_total", "Bytes received", 1, False),
+                                                ("udp_packets_sent_total", "Datagrams sent", 2, True),
+                                                ("udp_bytes_sent_total", "Bytes sent", 3, True)):
+            registry.counter(name, description, ("opcode",), function=self.field(field, timer))
+        registry.register(Histogram("udp_handler_seconds", "Time spent handling a datagram", ("opcode",), BIT_BUCKETS,
+                                    function=self.latency))
+
+    def field(self, index, timer):
+        return lambda: {command: series[index] for command, series in self.series.items()
+                        if timer or series is not self.timer}
+
+    def latency(self):
+        """
+        :return: dict - Opcode -> (Latency count per bucket, Latency sum in sec)
+        """
+        return {command: (series[4], series[5] / 1e9) for command, series in self.series.items()
+                if series is not self.timer}
+
+    def received(self, command, size):
+        """
+        :param command: Opcode of the datagram, see `udp_core.opcode`
+        :param size: Datagram Size in Bytes
+        :return: Start time to hand to `handled`
+        """
+        series = self.current = self.series.get(command, self.other)
+        series[0] += 1
+        series[1] += size
+        return time.perf_counter_ns()
+
+    def continued(self, size):
+        """
+        Counts a datagram the handler received itself - a file chunk, a reply - under the opcode being handled
+        """
+        series = self.current
+        series[0] += 1
+        series[1] += size
+
+    def handled(self, started):
+        elapsed = time.perf_counter_ns() - started
+        series = self.current
+        series[4][BIT_INDEX[elapsed.bit_length()]] += 1
+        series[5] += elapsed
+        self.current = self.timer
+
+    def sent(self, size, count=1):
+        """
+        :param count: Datagrams of the size in Bytes, more than one for a segmented send
+        """
+        series = self.current
+        series[2] += count
+        series[3] += size
+
+
+def socket_counters(udp_socket):
+    """
+    :return: dict - Receive and Send Queue in Bytes and Datagrams dropped by the kernel for the socket,
+             read from /proc/net/udp - empty where there is none
+    """
+    inode = str(os.fstat(udp_socket.fileno()).st_ino)
+    for table in ("/proc/net/udp", "/proc/net/udp6"):
+        try:
+            with open(table) as sockets:
+                next(sockets)
+                for line in sockets:
+                    fields = line.split()
+                    if fields[9] == inode:
+                        send_queue, receive_queue = fields[4].split(':')
+                        return {"receive_queue": int(receive_queue, 16), "send_queue": int(send_queue, 16),
+                                "drops": int(fields[-1])}
+        except OSError:
+            continue
+    return {}
+
+
+def add_socket(registry, get_socket):
+    """
+    Adds the kernel counters of the Server socket, read on every scrape
+    :param get_socket: Callable returning the socket
+    """
+    def read(field):
+        return lambda: socket_counters(get_socket()).get(field, 0)
+    registry.gauge("udp_receive_queue_bytes", "Bytes waiting in the kernel receive buffer",
+                   function=read("receive_queue"))
+    registry.gauge("udp_send_queue_bytes", "Bytes waiting in the kernel send buffer", function=read("send_queue"))
+    registry.counter("udp_socket_drops_total", "Datagrams dropped by the kernel, mostly on a full receive buffer",
+                     function=read("drops"))
+
+
+def add_log(registry, log):
+    """
+    Adds the queue depth and the record counters of a udp_log.Logger
+    """
+    registry.gauge("log_queue_records", "Log records waiting to be written", function=lambda: len(log.queue))
+    registry.counter("log_records_total", "Log records by outcome", ("outcome",),
+                     function=lambda: {key[4:]: value for key, value in log.stats().items()})
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Scrapes are not logged
+        pass
+
+
+def serve(registry, port, host="127.0.0.1"):
+    """
+    Serves the Registry at http://host:port/metrics from a background thread
+    :return: http.server.ThreadingHTTPServer
+    """
+    scrape_server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    scrape_server.daemon_threads = True
+    scrape_server.registry = registry
+    threading.Thread(target=scrape_server.serve_forever, daemon=True).start()
+    return scrape_server
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics-port', type=int, metavar="PORT_NUMBER",
+                        help='Local HTTP Port serving the metrics in the Prometheus text format, none if not given')
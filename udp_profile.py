@@ -0,0 +1,293 @@
+import atexit
+import cProfile
+import functools
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+MODES = ("sample", "wall", "cprofile")
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def fold(frame):
+    """
+    :return: string - Stack of the frame, outermost call first, in the `a;b;c` form of the flamegraph tools -
+             without the span wrappers and signal handlers of this module
+    """
+    names = []
+    while frame is not None:
+        if frame.f_code.co_filename != __file__:
+            names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler:
+    def __init__(self, interval=0.005, wall=False):
+        """
+        Statistical Profiler - counts the stacks once per interval
+
+        By default driven by SIGPROF on the process CPU time, sampling the main thread where the signal caught it -
+        an idle server blocked on a receive costs nothing and is not sampled. On the wall clock a background thread
+        samples every other thread instead, blocked or not - for the clients receiving on threads of their own, and
+        where there is no `signal.setitimer`
+        :param interval: Time in sec between samples
+        :param wall: True to sample every thread on the wall clock
+        """
+        self.interval = interval
+        # Folded Stack -> Samples
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self.thread = None
+        self.use_signal = not wall and hasattr(signal, "setitimer")
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        if self.use_signal:
+            signal.signal(signal.SIGPROF, self.on_signal)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        else:
+            self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.use_signal:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_IGN)
+        elif self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def on_signal(self, signum, frame):
+        self.stacks[fold(frame)] += 1
+        self.samples += 1
+
+    def sample_loop(self):
+        while self.running:
+            time.sleep(self.interval)
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            current_id = threading.get_ident()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != current_id:
+                    self.stacks[f"{names.get(thread_id, thread_id)};{fold(frame)}"] += 1
+            self.samples += 1
+
+    def write(self, path):
+        """
+        Writes the stacks in the folded format - `flamegraph.pl`, speedscope and inferno read it
+        """
+        with open(path, "w") as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+
+
+class Spans:
+    def __init__(self):
+        """
+        Time spent in each stage of the hot path - receive, parse, frame, dispatch, send
+
+        The stages are timed by wrapping the functions and methods doing them, so an endpoint that did not ask for
+        spans runs its own code untouched. A stage entered within another one is kept under it, `dispatch;send`,
+        and the time of a stage excludes the ones nested in it. A receive includes the wait for the datagram, so only
+        a busy endpoint gives its cost
+        """
+        # Stage Path -> [Calls, Self Time in ns]
+        self.totals = {}
+        self.local = threading.local()
+
+    def timed(self, stage, function):
+        @functools.wraps(function)
+        def span(*args, **kwargs):
+            local = self.local
+            if not hasattr(local, "stack"):
+                local.stack, local.children = [], []
+            local.stack.append(stage)
+            local.children.append(0)
+            started = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter_ns() - started
+                path = ';'.join(local.stack)
+                local.stack.pop()
+                nested = local.children.pop()
+                if local.children:
+                    local.children[-1] += elapsed
+                total = self.totals.get(path)
+                if total is None:
+                    total = self.totals[path] = [0, 0]
+                total[0] += 1
+                total[1] += elapsed - nested
+        return span
+
+    def trace(self, owner, stage, *names):
+        """
+        Times the named functions or methods of the owner - a module, class or instance - as the stage
+        """
+        for name in names:
+            function = getattr(owner, name, None)
+            if callable(function):
+                setattr(owner, name, self.timed(stage, function))
+
+    def trace_endpoint(self, endpoint):
+        """
+        Times the stages of a server or client built on udp_core - `receive`, `opcode` / `text`, the Framer,
+        the Dispatcher handlers, a `sendto` method and a SegmentSender, whichever it has
+        """
+        for cls in type(endpoint).__mro__:
+            module = sys.modules.get(cls.__module__)
+            if module is None or cls is object:
+                continue
+            self.trace(module, "receive", "receive")
+            self.trace(module, "parse", "opcode", "text")
+        framer = getattr(endpoint, "framer", None)
+        if framer is not None:
+            self.trace(framer, "frame", "frame", "pad")
+        commands = getattr(endpoint, "commands", None)
+        if commands is not None:
+            for command, handler in list(commands.handlers.items()):
+                commands.handlers[command] = self.timed("dispatch", handler)
+            commands.default = self.timed("dispatch", commands.default)
+        self.trace(endpoint, "send", "sendto")
+        sender = getattr(endpoint, "sender", None)
+        if sender is not None:
+            self.trace(sender, "send", "send")
+
+    def write(self, path):
+        """
+        Writes the stages in the folded format, weighted by their time in us
+        """
+        with open(path, "w") as output:
+            for path_name, (_, total) in sorted(self.totals.items()):
+                output.write(f"{path_name} {total // 1000}\n")
+
+    def summary(self):
+        """
+        :return: string - Table of the Calls, Total and Mean Time of every stage
+        """
+        lines = [f"{'Stage':<24} {'Calls':>10} {'Total ms':>10} {'Mean us':>10}"]
+        for path_name, (calls, total) in sorted(self.totals.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{path_name:<24} {calls:>10} {total / 1e6:>10.1f} {total / calls / 1000:>10.2f}")
+        return '\n'.join(lines)
+
+
+class Profiler:
+    def __init__(self, mode=None, output="profile", interval=0.005, spans=None):
+        """
+        Runtime Profiler of an endpoint, switched on and off by SIGUSR1 - or for the whole run
+
+        Every stop writes what was gathered so far, the files are overwritten with the running totals
+        :param mode: `sample` for the statistical Sampler on CPU time (OUTPUT.folded), `wall` for it on the wall
+                     clock, `cprofile` for cProfile (OUTPUT.prof, read by snakeviz or flameprof), None for spans only
+        :param output: Path prefix of the files written
+        :param interval: Time in sec between samples of the Sampler
+        :param spans: Spans of the endpoint written next to the profile (OUTPUT.spans.folded), None for none
+        """
+        self.mode = mode
+        self.output = output
+        self.spans = spans
+        self.sampler = Sampler(interval, wall=mode == "wall") if mode in ("sample", "wall") else None
+        self.profile = cProfile.Profile() if mode == "cprofile" else None
+        self.running = False
+        atexit.register(self.close)
+
+    def install(self):
+        """
+        Toggles the Profiler on SIGUSR1
+        :return: True if the signal is there to toggle it with
+        """
+        if not hasattr(signal, "SIGUSR1"):
+            return False
+        signal.signal(signal.SIGUSR1, self.toggle)
+        return True
+
+    def toggle(self, *_):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        if self.running or self.mode is None:
+            return
+        self.running = True
+        if self.sampler is not None:
+            self.sampler.start()
+        else:
+            self.profile.enable()
+        print(f"[PROFILE] {self.mode} on, pid {os.getpid()}", file=sys.stderr)
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            if self.sampler is not None:
+                self.sampler.stop()
+            else:
+                self.profile.disable()
+        self.write()
+
+    def write(self):
+        written = []
+        if self.sampler is not None and self.sampler.samples:
+            self.sampler.write(f"{self.output}.folded")
+            written.append(f"{self.output}.folded ({self.sampler.samples} samples)")
+        if self.profile is not None and self.profile.getstats():
+            self.profile.dump_stats(f"{self.output}.prof")
+            written.append(f"{self.output}.prof")
+        if self.spans is not None and self.spans.totals:
+            self.spans.write(f"{self.output}.spans.folded")
+            written.append(f"{self.output}.spans.folded")
+            print(self.spans.summary(), file=sys.stderr)
+        if written:
+            print(f"[PROFILE] written {', '.join(written)}", file=sys.stderr)
+
+    def close(self):
+        self.stop()
+
+
+def add_arguments(parser):
+    """
+    Adds the profiling options shared by the servers and clients to an argparse parser
+    """
+    parser.add_argument('--profile', choices=MODES,
+                        help='Profiler armed for the run, toggled with SIGUSR1 (kill -USR1 PID) - sample: CPU time of the '
+                             'main thread, wall: every thread on the wall clock, cprofile: every call')
+    parser.add_argument('--profile-start', action='store_true',
+                        help='Profile from the start instead of waiting for SIGUSR1')
+    parser.add_argument('--profile-output', type=str, metavar="PREFIX", help='Path prefix of the profile files',
+                        default=f"profile-{os.path.basename(sys.argv[0]).rsplit('.', 1)[0]}")
+    parser.add_argument('--profile-interval', type=float, metavar="TIME",
+                        help='Time in sec between samples of the sampling profiler', default=0.005)
+    parser.add_argument('--profile-spans', action='store_true',
+                        help='Time the receive, parse, frame, dispatch and send stages')
+
+
+def from_arguments(args, endpoint):
+    """
+    :param args: Parsed arguments, see `add_arguments`
+    :param endpoint: Server or Client to time the stages of
+    :return: Profiler, None if neither a profile nor spans were asked for
+    """
+    if args.profile is None and not args.profile_spans:
+        return None
+    spans = None
+    if args.profile_spans:
+        spans = Spans()
+        spans.trace_endpoint(endpoint)
+    profiler = Profiler(mode=args.profile, output=args.profile_output, interval=args.profile_interval, spans=spans)
+    toggled = profiler.install()
+    if args.profile_start or not toggled:
+        profiler.start()
+    return profiler
@@ -0,0 +1,137 @@
+import asyncio
+import socket
+from collections import Counter
+
+from udp_core import FORMAT
+
+# Wildcard address to bind the virtual clients to, per Address Family
+ANY = {socket.AF_INET: "0.0.0.0", socket.AF_INET6: "::"}
+
+
+class HeadlessClient(asyncio.DatagramProtocol):
+    def __init__(self, packet_size, server_socket):
+        """
+        Client without a window or `input()`, driven by a script on an asyncio loop
+
+        Thousands of them share a single loop, every one with its own UDP socket like a real Client
+        :param packet_size: Amount of Information sent per message in Bytes
+        :param server_socket: (IP, Port) of the server
+        """
+        self.packet_size = packet_size
+        self.server_socket = server_socket
+        self.transport = None
+        self.inbox = asyncio.Queue()
+        self.sent = 0
+        self.received = 0
+
+    @classmethod
+    async def connect(cls, *args, family=socket.AF_INET):
+        """
+        :param args: Arguments of the Client class
+        :param family: Address Family of the server
+        """
+        client = cls(*args)
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: client, local_addr=(ANY[family], 0),
+                                                                  family=family)
+        return client
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.received += 1
+        self.on_message(data.decode(FORMAT).strip())
+
+    def on_message(self, message):
+        """
+        :param message: Stripped Server Message, queued for `recv` unless a subclass handles it
+        """
+        self.inbox.put_nowait(message)
+
+    def send(self, message):
+        self.sent += 1
+        self.transport.sendto(message.encode(FORMAT).ljust(self.packet_size), self.server_socket)
+
+    async def recv(self, timeout):
+        """
+        :return: string - Next stripped Server Message
+        :raises asyncio.TimeoutError: Nothing received within the timeout
+        """
+        return await asyncio.wait_for(self.inbox.get(), timeout)
+
+    def close(self):
+        self.transport.close()
+
+
+class Report:
+    def __init__(self, stages):
+        """
+        Counters, Errors and Latency samples (in sec) of a swarm, merged across the worker processes
+        :param stages: Names of the stages timed
+        """
+        self.counters = Counter()
+        self.errors = Counter()
+        self.latencies = {stage: [] for stage in stages}
+
+    def merge(self, other):
+        self.counters.update(other.counters)
+        self.errors.update(other.errors)
+        for stage, samples in other.latencies.items():
+            self.latencies.setdefault(stage, []).extend(samples)
+        return self
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """
+    :return: dict - Percentile -> Sample, nearest rank
+    """
+    if not samples:
+        return {point: 0.0 for point in points}
+    ordered = sorted(samples)
+    return {point: ordered[min(len(ordered) - 1, point * len(ordered) // 100)] for point in points}
+
+
+def run_worker(swarm, *args):
+    """
+    Entry point of a worker process
+    :param swarm: Coroutine function running a slice of the virtual clients, returns their Report
+    """
+    return asyncio.run(swarm(*args))
+
+
+def server_stats(server_socket, packet_size, family, user_name=None, timeout=2):
+    """
+    Reads the Server's `Stats` from a short lived socket
+    :param user_name: Username to sign in with first, None if `Stats` is answered without signing in
+    :return: dict - Counters reported by the Server, empty if it did not answer
+    """
+    with socket.socket(family, socket.SOCK_DGRAM) as client:
+        client.settimeout(timeout)
+        messages = ["Stats"] if user_name is None else [f"User {user_name}", "Stats"]
+        try:
+            for message in messages:
+                client.sendto(message.encode(FORMAT).ljust(packet_size), server_socket)
+                # The counters may not fit in a single Packet Size
+                response = client.recvfrom(1 << 16)[0].decode(FORMAT).split()
+            if user_name is not None:
+                client.sendto(b"Disconnect".ljust(packet_size), server_socket)
+        except socket.timeout:
+            return {}
+    return dict(field.split('=', 1) for field in response[1:] if '=' in field)
+
+
+def print_report(report, lines, total, unit, width=12):
+    """
+    :param lines: Summary lines of the swarm, printed first
+    :param total: Number the errors are a share of
+    :param unit: What `total` counts
+    :param width: Width of the stage names
+    """
+    for line in lines:
+        print(line)
+    for stage, samples in report.latencies.items():
+        spread = ' / '.join(f"{value * 1000:.2f}" for value in percentiles(samples).values())
+        print(f"[LATENCY] {stage:>{width}} p50 / p90 / p99 = {spread} ms over {len(samples)} samples")
+    failed = sum(report.errors.values())
+    print(f"[ERRORS] {failed} ({failed / max(total, 1):.1%} of {unit})",
+          ' '.join(f"{kind}={count}" for kind, count in report.errors.items()))